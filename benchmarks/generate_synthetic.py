@@ -0,0 +1,151 @@
+# benchmarks/generate_synthetic.py
+
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import yaml
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fraction of database targets that are absent from the counts matrix, as in real exports
+MISSING_TARGET_FRAC = 0.1
+# Synthetic 3'UTR length and the share of database edges given a planted 8mer seed site
+UTR_LENGTH = 1000
+PLANTED_SITE_FRAC = 0.7
+
+# Config overrides for benchmark runs: every prediction flows to the downstream stages
+BENCH_CONFIG = {
+    "confidence_threshold": 0.0,
+    "id_resolution": False,
+    "biotype_filter": False,
+    # Every stage must really run to be timed
+    "stage_cache": False,
+    # Two sample groups, so the correlation statistics store holds per-condition sums
+    "sample_metadata": "data/sample_metadata.csv",
+    "condition_columns": ["condition"],
+}
+
+def synthetic_names(prefix, n, suffix=""):
+    return np.char.add(np.char.add(prefix, np.arange(n).astype(str)), suffix)
+
+def random_interactions(rng, mirnas, targets, n_edges):
+    """n_edges distinct (miRNA, target) pairs; a share of targets are unknown to the counts matrix"""
+    n_edges = min(n_edges, len(mirnas) * len(targets))
+    codes = np.unique(rng.integers(0, len(mirnas) * len(targets), size=int(n_edges * 1.2)))
+    codes = rng.permutation(codes)[:n_edges]
+    mir, tgt = np.divmod(codes, len(targets))
+    target_names = targets[tgt].astype(object)
+    missing = rng.random(len(codes)) < MISSING_TARGET_FRAC
+    target_names[missing] = np.char.add(targets[tgt[missing]], "_novel")
+    return pd.DataFrame({"miRNA": mirnas[mir], "target": target_names}), mir, tgt
+
+def write_fasta(path, names, sequences):
+    with open(path, "w") as f:
+        for name, sequence in zip(names, sequences):
+            f.write(f">{name}\n{sequence}\n")
+
+def synthetic_sequences(rng, n_targets, mirna_seqs, edge_mir, edge_tgt):
+    """
+    Random 3'UTRs for n_targets genes with an 8mer site (reverse complement of miRNA
+    nt 2-8, then A) planted for a share of the database edges, and the miRNA sequences.
+    """
+    complement = np.array([3, 2, 1, 0], dtype=np.uint8)
+    utrs = rng.integers(0, 4, size=(n_targets, UTR_LENGTH), dtype=np.uint8)
+    planted = rng.random(len(edge_mir)) < PLANTED_SITE_FRAC
+    starts = rng.integers(0, UTR_LENGTH - 8, size=len(edge_mir))
+    for mir, tgt, start in zip(edge_mir[planted], edge_tgt[planted], starts[planted]):
+        utrs[tgt, start:start + 7] = complement[mirna_seqs[mir, 1:8][::-1]]
+        utrs[tgt, start + 7] = 0
+    bases = np.array(list("ACGT"))
+    return ["".join(bases[row]) for row in utrs]
+
+def generate_dataset(outdir, n_mrna=2000, n_lncrna=500, n_mirna=50, n_samples=40,
+                     n_mrna_edges=5000, n_lncrna_edges=1500, seed=42):
+    """
+    Write a synthetic pipeline input under outdir:
+      data/input_counts.csv                  raw counts (genes x samples)
+      data/sample_metadata.csv               sample_id, condition (tumor/normal, alternating)
+      databases/miRTarBase.txt, LncBase.txt  miRNA-target tables
+      databases/transcripts.fa, mature.fa    synthetic 3'UTRs (planted seed sites) and miRNA sequences
+      config/config.yaml, templates/         pipeline config (benchmark overrides) and report template
+    Counts are Poisson draws around a log-linear model in which every target is
+    repressed by the miRNAs that target it, so downstream stages see real signal.
+    """
+    rng = np.random.default_rng(seed)
+    mrnas = synthetic_names("GENE", n_mrna)
+    lncrnas = synthetic_names("LNC", n_lncrna)
+    mirnas = synthetic_names("hsa-miR-", n_mirna, "-5p")
+
+    mrna_db, mrna_mir, mrna_tgt = random_interactions(rng, mirnas, mrnas, n_mrna_edges)
+    lnc_db, lnc_mir, lnc_tgt = random_interactions(rng, mirnas, lncrnas, n_lncrna_edges)
+
+    # Log expression: gene baseline + miRNA activity (targets repressed) + noise
+    mir_activity = rng.normal(0, 1, size=(n_mirna, n_samples))
+    log_mu = np.empty((n_mrna + n_lncrna + n_mirna, n_samples))
+    log_mu[:n_mrna] = rng.normal(5, 1.5, size=(n_mrna, 1))
+    log_mu[n_mrna:n_mrna + n_lncrna] = rng.normal(3.5, 1.5, size=(n_lncrna, 1))
+    log_mu[n_mrna + n_lncrna:] = rng.normal(4, 1, size=(n_mirna, 1)) + 0.5 * mir_activity
+    np.add.at(log_mu, mrna_tgt, -0.3 * mir_activity[mrna_mir])
+    np.add.at(log_mu, n_mrna + lnc_tgt, -0.3 * mir_activity[lnc_mir])
+    log_mu += rng.normal(0, 0.3, size=log_mu.shape)
+    counts = rng.poisson(np.exp(np.minimum(log_mu, 20)))
+
+    os.makedirs(os.path.join(outdir, "data"), exist_ok=True)
+    os.makedirs(os.path.join(outdir, "databases"), exist_ok=True)
+    os.makedirs(os.path.join(outdir, "config"), exist_ok=True)
+    os.makedirs(os.path.join(outdir, "results"), exist_ok=True)
+
+    genes = np.concatenate([mrnas, lncrnas, mirnas])
+    samples = synthetic_names("S", n_samples)
+    pd.DataFrame(counts, index=pd.Index(genes, name="gene"), columns=samples).to_csv(
+        os.path.join(outdir, "data", "input_counts.csv"))
+    pd.DataFrame({"sample_id": samples, "condition": np.where(np.arange(n_samples) % 2, "normal", "tumor")}).to_csv(
+        os.path.join(outdir, "data", "sample_metadata.csv"), index=False)
+    mrna_db.rename(columns={"target": "mRNA"}).to_csv(
+        os.path.join(outdir, "databases", "miRTarBase.txt"), sep="\t", index=False)
+    lnc_db.rename(columns={"target": "lncRNA"}).to_csv(
+        os.path.join(outdir, "databases", "LncBase.txt"), sep="\t", index=False)
+
+    mirna_seqs = rng.integers(0, 4, size=(n_mirna, 22), dtype=np.uint8)
+    utrs = synthetic_sequences(rng, n_mrna + n_lncrna, mirna_seqs, np.concatenate([mrna_mir, lnc_mir]),
+                               np.concatenate([mrna_tgt, n_mrna + lnc_tgt]))
+    write_fasta(os.path.join(outdir, "databases", "transcripts.fa"), genes[:n_mrna + n_lncrna], utrs)
+    write_fasta(os.path.join(outdir, "databases", "mature.fa"), mirnas,
+                ["".join(np.array(list("ACGU"))[row]) for row in mirna_seqs])
+
+    with open(os.path.join(REPO_ROOT, "config", "config.yaml"), "r") as f:
+        cfg = yaml.safe_load(f)
+    cfg.update(BENCH_CONFIG)
+    cfg["random_seed"] = seed
+    with open(os.path.join(outdir, "config", "config.yaml"), "w") as f:
+        yaml.safe_dump(cfg, f, sort_keys=False)
+
+    templates = os.path.join(outdir, "templates")
+    if os.path.isdir(templates):
+        shutil.rmtree(templates)
+    shutil.copytree(os.path.join(REPO_ROOT, "templates"), templates)
+
+    summary = {
+        "genes": int(len(genes)), "samples": int(n_samples),
+        "mrna_edges": int(len(mrna_db)), "lncrna_edges": int(len(lnc_db)),
+        "seed": seed,
+    }
+    print(f"Synthetic dataset in {outdir}: {json.dumps(summary)}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic counts matrix and miRNA-target tables")
+    parser.add_argument('outdir', help="Pipeline working directory to create")
+    parser.add_argument('--mrnas', type=int, default=2000)
+    parser.add_argument('--lncrnas', type=int, default=500)
+    parser.add_argument('--mirnas', type=int, default=50)
+    parser.add_argument('--samples', type=int, default=40)
+    parser.add_argument('--mrna-edges', type=int, default=5000)
+    parser.add_argument('--lncrna-edges', type=int, default=1500)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    generate_dataset(args.outdir, args.mrnas, args.lncrnas, args.mirnas, args.samples,
+                     args.mrna_edges, args.lncrna_edges, args.seed)
@@ -0,0 +1,215 @@
+# benchmarks/run_benchmarks.py
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+from generate_synthetic import REPO_ROOT, generate_dataset
+
+# Stage scripts record their per-phase timings under results/metrics/<run id>/
+BENCH_RUN_ID = "benchmark"
+
+# Snakefile stages in execution order (download_databases is replaced by the generator)
+STAGES = [
+    "qc_normalization",
+    "prescreen",
+    "feature_engineering",
+    "ml_training",
+    "predict_triplets",
+    "statistical_validation",
+    "correlation_stats",
+    "condition_correlations",
+    "network_analysis",
+    "generate_report",
+]
+
+# Dataset sizes: mRNAs, lncRNAs, miRNAs, samples, miRNA-mRNA and miRNA-lncRNA edges
+SCALES = {
+    "tiny":   dict(n_mrna=500,    n_lncrna=100,   n_mirna=10,  n_samples=20,  n_mrna_edges=1_000,   n_lncrna_edges=300),
+    "small":  dict(n_mrna=2_000,  n_lncrna=500,   n_mirna=50,  n_samples=40,  n_mrna_edges=5_000,   n_lncrna_edges=1_500),
+    "medium": dict(n_mrna=10_000, n_lncrna=3_000, n_mirna=200, n_samples=100, n_mrna_edges=40_000,  n_lncrna_edges=10_000),
+    "large":  dict(n_mrna=20_000, n_lncrna=8_000, n_mirna=500, n_samples=300, n_mrna_edges=150_000, n_lncrna_edges=40_000),
+}
+
+RUNS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runs")
+# Machine-specific timings: kept with the (untracked) benchmark runs, never committed
+HISTORY_PATH = os.path.join(RUNS_DIR, "history.jsonl")
+
+# A stage regresses when slower (or larger) than the recent median by this fraction...
+REGRESSION_TOLERANCE = 0.25
+# ...and by at least this much in absolute terms, so sub-second noise is ignored
+MIN_WALL_DELTA_S = 0.5
+MIN_RSS_DELTA_MB = 50
+HISTORY_WINDOW = 5
+
+# Runs one stage script in a fresh interpreter and reports its own resource usage
+STAGE_WRAPPER = """
+import json, resource, runpy, sys, time
+script, metrics_path, modules_dir = sys.argv[1:4]
+sys.path.insert(0, modules_dir)
+sys.argv = [script]
+start = time.perf_counter()
+status = "ok"
+try:
+    runpy.run_path(script, run_name="__main__")
+except SystemExit as exc:
+    status = "ok" if exc.code in (None, 0) else "failed"
+except BaseException:
+    import traceback
+    traceback.print_exc()
+    status = "failed"
+wall = time.perf_counter() - start
+usage = resource.getrusage(resource.RUSAGE_SELF)
+rss_kb = usage.ru_maxrss / (1024 if sys.platform == "darwin" else 1)
+with open(metrics_path, "w") as f:
+    json.dump({"status": status, "wall_s": wall, "cpu_s": usage.ru_utime + usage.ru_stime,
+               "max_rss_mb": rss_kb / 1024}, f)
+sys.exit(0 if status == "ok" else 1)
+"""
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def prepare_workdir(scale, params, seed, fresh=False):
+    """
+    Working directory for one scale. Data is regenerated only when the scale's
+    parameters change (or with fresh=True), so pipeline caches such as the SPONGE
+    null tables and interaction indexes stay warm between runs.
+    """
+    workdir = os.path.join(RUNS_DIR, scale)
+    marker = os.path.join(workdir, "dataset.json")
+    wanted = dict(params, seed=seed)
+    if not fresh and os.path.exists(marker):
+        with open(marker, "r") as f:
+            if json.load(f) == wanted:
+                return workdir, False
+    if os.path.isdir(workdir):
+        shutil.rmtree(workdir)
+    generate_dataset(workdir, seed=seed, **params)
+    with open(marker, "w") as f:
+        json.dump(wanted, f)
+    return workdir, True
+
+def stage_phases(workdir, stage):
+    """Phase timings and row counts the stage recorded through modules/instrumentation.py"""
+    path = os.path.join(workdir, "results", "metrics", BENCH_RUN_ID, f"{stage}.json")
+    if not os.path.exists(path):
+        return {}, {}
+    with open(path, "r") as f:
+        metrics = json.load(f)
+    return metrics.get("phases", {}), metrics.get("counts", {})
+
+def run_stage(stage, workdir, log_path):
+    """Run modules/<stage>.py in workdir; returns its metrics dict"""
+    script = os.path.join(REPO_ROOT, "modules", f"{stage}.py")
+    fd, metrics_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        with open(log_path, "a") as log:
+            log.write(f"\n===== {stage} =====\n")
+            log.flush()
+            subprocess.call([sys.executable, "-c", STAGE_WRAPPER, script, metrics_path,
+                             os.path.join(REPO_ROOT, "modules")],
+                            cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+                            env=dict(os.environ, CERNA_RUN_ID=BENCH_RUN_ID))
+        with open(metrics_path, "r") as f:
+            content = f.read()
+        return json.loads(content) if content else {"status": "failed"}
+    finally:
+        os.remove(metrics_path)
+
+def load_history(path=HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def find_regressions(record, history, tolerance=REGRESSION_TOLERANCE):
+    """Compare a stage record with the median of its recent successful runs at the same scale"""
+    previous = [h for h in history
+                if h["scale"] == record["scale"] and h["stage"] == record["stage"] and h["status"] == "ok"
+                and h.get("dataset") == record.get("dataset")][-HISTORY_WINDOW:]
+    if not previous or record["status"] != "ok":
+        return []
+    flags = []
+    baseline_wall = float(np.median([h["wall_s"] for h in previous]))
+    if record["wall_s"] > baseline_wall * (1 + tolerance) and record["wall_s"] - baseline_wall > MIN_WALL_DELTA_S:
+        flags.append(f"wall {record['wall_s']:.2f}s vs median {baseline_wall:.2f}s")
+    baseline_rss = float(np.median([h["max_rss_mb"] for h in previous]))
+    if record["max_rss_mb"] > baseline_rss * (1 + tolerance) and record["max_rss_mb"] - baseline_rss > MIN_RSS_DELTA_MB:
+        flags.append(f"peak RSS {record['max_rss_mb']:.0f}MB vs median {baseline_rss:.0f}MB")
+    return flags
+
+def run_benchmarks(scales, stages=STAGES, seed=42, fresh=False, tolerance=REGRESSION_TOLERANCE,
+                   history_path=HISTORY_PATH):
+    """Run the requested stages at each scale, append to the history and return (records, regressions)"""
+    history = load_history(history_path)
+    revision = git_revision()
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    records, regressions = [], []
+
+    for scale in scales:
+        params = SCALES[scale]
+        workdir, generated = prepare_workdir(scale, params, seed, fresh)
+        log_path = os.path.join(workdir, "benchmark.log")
+        print(f"\n[{scale}] {params} -> {workdir}")
+        for stage in stages:
+            metrics = run_stage(stage, workdir, log_path)
+            phases, counts = stage_phases(workdir, stage)
+            record = {
+                "timestamp": timestamp, "revision": revision, "scale": scale, "stage": stage,
+                "dataset": dict(params, seed=seed), "fresh_data": generated,
+                "status": metrics.get("status", "failed"),
+                "wall_s": metrics.get("wall_s"), "cpu_s": metrics.get("cpu_s"),
+                "max_rss_mb": metrics.get("max_rss_mb"),
+                "phases": phases, "counts": counts,
+            }
+            flags = find_regressions(record, history, tolerance)
+            record["regression"] = flags
+            records.append(record)
+            if flags:
+                regressions.append(record)
+            if record["status"] == "ok":
+                print(f"  {stage:<24} {record['wall_s']:8.2f}s  cpu {record['cpu_s']:8.2f}s  "
+                      f"rss {record['max_rss_mb']:8.0f}MB" + (f"  REGRESSION: {'; '.join(flags)}" if flags else ""))
+            else:
+                print(f"  {stage:<24} FAILED (see {log_path})")
+                break
+
+    os.makedirs(os.path.dirname(history_path) or ".", exist_ok=True)
+    with open(history_path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    print(f"\nAppended {len(records)} records to {history_path}")
+    return records, regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time and memory-profile every pipeline stage on synthetic data")
+    parser.add_argument('--scales', nargs='+', default=["tiny", "small"], choices=list(SCALES),
+                        help="Dataset sizes to run")
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help="Stages to run (in pipeline order)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--fresh', action='store_true', help="Regenerate data and drop cached pipeline state")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help="Relative slowdown / memory growth flagged as a regression")
+    parser.add_argument('--history', default=HISTORY_PATH, help="JSONL benchmark history")
+    parser.add_argument('--fail-on-regression', action='store_true', help="Exit with status 1 on any regression")
+    args = parser.parse_args()
+
+    stages = [s for s in STAGES if s in args.stages]
+    records, regressions = run_benchmarks(args.scales, stages, args.seed, args.fresh, args.tolerance, args.history)
+    failed = [r for r in records if r["status"] != "ok"]
+    if regressions:
+        print(f"{len(regressions)} stage regression(s) flagged")
+    if failed or (regressions and args.fail_on_regression):
+        sys.exit(1)
@@ -1,41 +1,104 @@
 # cerna_pipeline_main.py
 
 import argparse
+import filecmp
+import shutil
 import subprocess
 import os
 import sys
 import yaml
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "modules"))
+from instrumentation import METRICS_DIR, PROFILE_ENV, RUN_ID_ENV, collect_run_metrics, new_run_id
+from cohort_summary import COHORT_RESULTS_DIR, SUMMARY_PATH, load_manifest
+
+def stage_input(src, dest):
+    """
+    Copy the input counts into the pipeline location unless dest already holds the
+    same content, so an unchanged input keeps its mtime and does not rerun every rule.
+    """
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return False
+    if os.path.exists(dest) and filecmp.cmp(src, dest, shallow=False):
+        print(f"Input {dest} is unchanged; keeping the staged copy")
+        return False
+    shutil.copy(src, dest)
+    return True
+
+def print_stage_summary(records):
+    """One line per stage: status, wall/CPU time and peak memory"""
+    if not records:
+        return
+    print("\nStage metrics:")
+    for r in records:
+        rss = r.get("peak_rss_mb")
+        print(f"  {r['stage']:<24} {r['status']:<7} wall {r['wall_s']:8.2f}s  cpu {r['cpu_s']:8.2f}s"
+              + (f"  peak RSS {rss:8.0f} MB" if rss is not None else ""))
+
 def main():
     parser = argparse.ArgumentParser(description="ceRNA Discovery Pipeline: main runner")
-    parser.add_argument('--input', required=True, help="Path to input raw counts matrix (csv)")
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('--input', help="Path to input raw counts matrix (csv)")
+    inputs.add_argument('--manifest', help="Batch mode: table (csv/tsv) with columns cohort and counts, "
+                                           "one counts matrix per cohort")
     parser.add_argument('--config', default="config/config.yaml", help="Path to YAML config file")
     parser.add_argument('--threads', default="4", help="Number of threads/cores", type=int)
+    parser.add_argument('--profile', nargs='*', metavar='STAGE',
+                        help="Run the given stages (all stages if none given) under cProfile; "
+                             f"profiles are written next to the run metrics in {METRICS_DIR}/")
     args = parser.parse_args()
 
-    # Copy input file to pipeline location
-    os.makedirs("data", exist_ok=True)
-    input_target = "data/input_counts.csv"
-    if args.input != input_target:
-        import shutil
-        shutil.copy(args.input, input_target)
-    
     # Sanity check config
     if not os.path.isfile(args.config):
         print(f"ERROR: Config yaml not found at {args.config}")
         sys.exit(1)
 
-    print("Launching Snakemake workflow...")
+    if args.manifest:
+        # Batch mode: cohorts are read in place, databases are processed once for all
+        try:
+            cohorts = load_manifest(args.manifest)
+        except ValueError as e:
+            print(f"ERROR: {e}")
+            sys.exit(1)
+        print(f"Batch mode: {len(cohorts)} cohort(s) from {args.manifest}")
+    else:
+        # Copy input file to pipeline location
+        os.makedirs("data", exist_ok=True)
+        input_target = "data/input_counts.csv"
+        stage_input(args.input, input_target)
+
+    # Every stage of this run writes its metrics under results/metrics/<run_id>/
+    run_id = new_run_id()
+    env = dict(os.environ, **{RUN_ID_ENV: run_id})
+    if args.profile is not None:
+        env[PROFILE_ENV] = ",".join(args.profile) or "all"
+
+    print(f"Launching Snakemake workflow (run {run_id})...")
     snakemake_cmd = [
         "snakemake",
         "--cores", str(args.threads),
         "--rerun-incomplete",
         "--keep-going"
     ]
-    subprocess.call(snakemake_cmd)
+    if args.manifest:
+        snakemake_cmd += ["--config", f"manifest={args.manifest}"]
+    returncode = subprocess.run(snakemake_cmd, env=env).returncode
+
+    records = collect_run_metrics(run_id)
+    print_stage_summary(records)
+    if records:
+        print(f"Run metrics saved to {os.path.join(METRICS_DIR, run_id)}.json/.csv")
+
+    if returncode != 0:
+        print(f"\nERROR: Snakemake exited with status {returncode}; see the log above for failed rules.")
+        sys.exit(returncode)
 
     print("\nPipeline completed.")
-    print("Check your results in the 'results/' folder.")
+    if args.manifest:
+        print(f"Per-cohort results are in '{COHORT_RESULTS_DIR}/<cohort>/'; "
+              f"the cross-cohort triplet summary is {SUMMARY_PATH}.")
+    else:
+        print("Check your results in the 'results/' folder.")
 
 if __name__ == "__main__":
     main()
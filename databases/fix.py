@@ -1,53 +1,121 @@
+import argparse
+import csv
 import re
+import numpy as np
 import pandas as pd
 
-def split_miRNA_target(in_path, out_path, out_target_col):
-    # Read raw single-column file
-    # auto-detect separator, but will fallback to one-column if none
-    with open(in_path, 'r', encoding='utf-8') as f:
-        lines = [line.strip() for line in f if line.strip()]
-    # First line is header
-    header = lines[0]
-    rows = lines[1:]
-
-    # Prepare output rows
-    out = []
-    # miRNA ID pattern: hsa-miR-... or hsa-let-...
-    # We’ll split at the boundary between miRNA and the rest
-    # This regex captures miRNA (miR or let family) with optional arm -5p/-3p, then the rest
-    pat = re.compile(r'^(hsa-(?:miR|let)-[0-9a-zA-Z\-]+?p?)(.+)$')
-
-    for r in rows:
-        m = pat.match(r)
-        if not m:
-            # If not matching, try a more permissive pattern (up to first uppercase letter in gene)
-            # or skip/log
-            # Attempt split at first uppercase letter after miRNA prefix
-            m2 = re.match(r'^(hsa-(?:miR|let)-[0-9a-zA-Z\-]+?p?)([A-Z].+)$', r)
-            if not m2:
-                # If still not matched, skip row or log
-                # print(f"Skipping unmapped row: {r}")
-                continue
-            mi, tgt = m2.group(1), m2.group(2)
+# miRNA ID pattern: hsa-miR-... or hsa-let-...
+# Strict miRBase nomenclature first (e.g. hsa-miR-125b-2-3p); targets start with an uppercase letter or digit
+MIRNA_TARGET_PAT = re.compile(r'^(hsa-(?:miR|let)-\d+[a-z]?(?:-\d+)?(?:-[35]p)?)[\s,;|]*([A-Z0-9].*)$')
+# More permissive fallback: split at the first uppercase letter after the miRNA prefix
+MIRNA_TARGET_FALLBACK_PAT = re.compile(r'^(hsa-(?:miR|let)-[0-9a-zA-Z\-]+?p?)([A-Z].+)$')
+
+# Raw lines per chunk
+CHUNK_ROWS = 1_000_000
+
+def split_rows(rows):
+    """
+    Vectorized split of raw 'miRNA+target' strings.
+    Returns a (miRNA, target) DataFrame aligned to rows, with NaN where neither pattern matched.
+    """
+    parts = rows.str.extract(MIRNA_TARGET_PAT)
+    unmatched = parts[0].isna()
+    if unmatched.any():
+        parts.loc[unmatched] = rows[unmatched].str.extract(MIRNA_TARGET_FALLBACK_PAT).to_numpy()
+    parts.columns = ["miRNA", "target"]
+    return parts.apply(lambda col: col.str.strip())
+
+def iter_raw_rows(in_path, chunk_rows=CHUNK_ROWS):
+    """Stream stripped, non-empty raw lines (header excluded) in chunks"""
+    reader = pd.read_csv(
+        in_path, header=None, names=["raw"], skiprows=1, dtype=str,
+        sep='\x1f', quoting=csv.QUOTE_NONE, skip_blank_lines=True,
+        chunksize=chunk_rows, encoding='utf-8'
+    )
+    for chunk in reader:
+        rows = chunk["raw"].dropna().str.strip()
+        yield rows[rows != ""].reset_index(drop=True)
+
+class _PairWriter:
+    """Append (miRNA, target) blocks to a TSV or Parquet file"""
+
+    def __init__(self, out_path, out_target_col):
+        self.out_path = out_path
+        self.columns = ["miRNA", out_target_col]
+        self._parquet = None
+        if out_path.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self._pa = pa
+            self._schema = pa.schema([(c, pa.string()) for c in self.columns])
+            self._parquet = pq.ParquetWriter(out_path, self._schema)
+        else:
+            with open(out_path, 'w', encoding='utf-8', newline='') as f:
+                f.write('\t'.join(self.columns) + '\n')
+
+    def write(self, df):
+        df = df.set_axis(self.columns, axis=1)
+        if self._parquet is not None:
+            self._parquet.write_table(self._pa.Table.from_pandas(df, schema=self._schema, preserve_index=False))
         else:
-            mi, tgt = m.group(1), m.group(2)
+            df.to_csv(self.out_path, sep='\t', index=False, header=False, mode='a')
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+def split_miRNA_target(in_path, out_path, out_target_col, reject_path=None, chunk_rows=CHUNK_ROWS):
+    """
+    Split a raw single-column miRNA-target export into a two-column table, chunk by chunk.
+    Parsed pairs are de-duplicated and written as they are produced (TSV, or Parquet when
+    out_path ends in .parquet). Unparsed rows are written with their counts to reject_path
+    (default: <out_path>.rejects.tsv).
+    """
+    reject_path = reject_path or f"{out_path}.rejects.tsv"
+    writer = _PairWriter(out_path, out_target_col)
+    seen = np.empty(0, dtype=np.uint64)  # sorted hashes of pairs already written
+    rejects = pd.Series(dtype='int64')
+    n_written = 0
+    try:
+        for rows in iter_raw_rows(in_path, chunk_rows):
+            parts = split_rows(rows)
+            failed = parts["miRNA"].isna()
+            if failed.any():
+                rejects = rejects.add(rows[failed].value_counts(), fill_value=0)
 
-        mi = mi.strip()
-        tgt = tgt.strip()
-        out.append((mi, tgt))
+            # Drop duplicates within the chunk and against earlier chunks
+            pairs = parts[~failed].drop_duplicates()
+            hashes = pd.util.hash_pandas_object(pairs, index=False).to_numpy()
+            is_new = ~np.isin(hashes, seen, assume_unique=True)
+            pairs = pairs[is_new]
+            seen = np.union1d(seen, hashes[is_new])
 
-    if not out:
+            writer.write(pairs)
+            n_written += len(pairs)
+    finally:
+        writer.close()
+
+    rejects = rejects.astype('int64').sort_values(ascending=False)
+    rejects.rename_axis("row").rename("count").to_frame().to_csv(reject_path, sep='\t')
+    if rejects.sum():
+        print(f"Rejected {int(rejects.sum())} unparsed rows ({len(rejects)} distinct); see {reject_path}")
+
+    if n_written == 0:
         raise ValueError(f"No rows could be parsed from {in_path}. Check formatting.")
+    print(f"Wrote {n_written} rows to {out_path}")
+    return n_written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split raw miRNA+target exports (ENCORI/LncBase/miRTarBase) into TSV")
+    parser.add_argument('input', nargs='?', help="Raw single-column export")
+    parser.add_argument('output', nargs='?', help="Output table (.tsv/.txt or .parquet)")
+    parser.add_argument('--target-col', default="lncRNA", help="Name of the target column (lncRNA or mRNA)")
+    parser.add_argument('--rejects', default=None, help="Reject file (default: <output>.rejects.tsv)")
+    args = parser.parse_args()
 
-    df = pd.DataFrame(out, columns=["miRNA", out_target_col])
-    # Drop duplicates, strip spaces just in case
-    df["miRNA"] = df["miRNA"].str.strip()
-    df[out_target_col] = df[out_target_col].str.strip()
-    df = df.drop_duplicates().reset_index(drop=True)
-    # Write as tab-delimited TSV
-    df.to_csv(out_path, sep='\t', index=False)
-    print(f"Wrote {len(df)} rows to {out_path}")
-
-# Paths: adjust to your actual file names/locations
-split_miRNA_target("LncBase.txt", "LncBase_w.txt", out_target_col="lncRNA")
-split_miRNA_target("miRTarBase.txt", "miRTarBase_w.txt", out_target_col="mRNA")
\ No newline at end of file
+    if args.input and args.output:
+        split_miRNA_target(args.input, args.output, args.target_col, args.rejects)
+    else:
+        # Paths: adjust to your actual file names/locations
+        split_miRNA_target("LncBase.txt", "LncBase_w.txt", out_target_col="lncRNA")
+        split_miRNA_target("miRTarBase.txt", "miRTarBase_w.txt", out_target_col="mRNA")
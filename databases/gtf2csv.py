@@ -1,30 +1,102 @@
 # convert_gtf.py
-import pandas as pd
+import argparse
+import gzip
 import re
+import sys
+from multiprocessing import Pool
+
+import pandas as pd
+
+# One pass over the attribute column picks up every key "value" pair
+ATTRIBUTE_RE = re.compile(r'(\w+) "([^"]*)"')
+ANNOTATION_COLUMNS = ['gene_id', 'gene_name', 'gene_biotype']
+
+def open_gtf(gtf_file):
+    """Open a GTF as text, decompressing on the fly when it ends in .gz"""
+    if gtf_file.endswith('.gz'):
+        return gzip.open(gtf_file, 'rt')
+    return open(gtf_file, 'r')
 
-def gtf_to_csv(gtf_file, output_csv):
+def parse_gene_lines(lines):
+    """Parse a batch of GTF lines into (gene_id, gene_name, gene_biotype) tuples, gene records only"""
     genes = []
-    with open(gtf_file, 'r') as f:
-        for line in f:
-            if line.startswith('#'):
-                continue
-            parts = line.strip().split('\t')
-            if len(parts) >= 9 and parts[2] == 'gene':
-                attributes = parts[8]
-                gene_id = re.search(r'gene_id "([^"]+)"', attributes)
-                gene_name = re.search(r'gene_name "([^"]+)"', attributes)
-                gene_biotype = re.search(r'gene_biotype "([^"]+)"', attributes)
-                
-                if gene_id:
-                    genes.append({
-                        'gene_id': gene_id.group(1),
-                        'gene_name': gene_name.group(1) if gene_name else '',
-                        'gene_biotype': gene_biotype.group(1) if gene_biotype else ''
-                    })
-    
-    df = pd.DataFrame(genes)
-    df.to_csv(output_csv, index=False)
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        # Split off the feature type first; non-gene records never reach attribute parsing
+        parts = line.split('\t', 3)
+        if len(parts) < 4 or parts[2] != 'gene':
+            continue
+        fields = parts[3].split('\t', 5)
+        if len(fields) < 6:
+            continue
+        attributes = dict(ATTRIBUTE_RE.findall(fields[5]))
+        if 'gene_id' in attributes:
+            genes.append((
+                attributes['gene_id'],
+                attributes.get('gene_name', ''),
+                attributes.get('gene_biotype', attributes.get('gene_type', ''))
+            ))
+    return genes
+
+def iter_line_batches(handle, batch_size, allow_truncated=False):
+    """
+    Yield lists of up to batch_size lines. A truncated .gz stream raises EOFError,
+    since a partial annotation would silently drop most genes downstream; with
+    allow_truncated it ends early with a warning instead.
+    """
+    batch = []
+    try:
+        for line in handle:
+            batch.append(line)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    except EOFError:
+        if not allow_truncated:
+            raise EOFError("compressed GTF ended early (truncated download?); re-download it "
+                           "or pass --allow-truncated to keep the genes parsed so far")
+        print("WARNING: compressed GTF ended early (truncated download?); keeping genes parsed so far",
+              file=sys.stderr)
+    if batch:
+        yield batch
+
+def gtf_to_csv(gtf_file, output_csv, processes=1, batch_size=200_000, allow_truncated=False):
+    """
+    Stream a (optionally gzip-compressed) GTF and write the gene annotation table.
+    With processes > 1, line batches are parsed in parallel while the main process
+    keeps decompressing. A truncated GTF raises EOFError before anything is written,
+    unless allow_truncated.
+    """
+    genes = []
+    with open_gtf(gtf_file) as handle:
+        batches = iter_line_batches(handle, batch_size, allow_truncated)
+        if processes > 1:
+            with Pool(processes) as pool:
+                for parsed in pool.imap(parse_gene_lines, batches):
+                    genes.extend(parsed)
+        else:
+            for batch in batches:
+                genes.extend(parse_gene_lines(batch))
+
+    df = pd.DataFrame(genes, columns=ANNOTATION_COLUMNS)
+    if output_csv.endswith('.parquet'):
+        # Biotypes repeat heavily; store them as a categorical column
+        df['gene_biotype'] = df['gene_biotype'].astype('category')
+        df.to_parquet(output_csv, index=False)
+    else:
+        df.to_csv(output_csv, index=False)
     print(f"Converted {len(genes)} genes to {output_csv}")
 
 if __name__ == "__main__":
-    gtf_to_csv("Homo_sapiens.GRCh38.114.gtf", "gene_annotation.csv")
+    parser = argparse.ArgumentParser(description="Convert an Ensembl GTF (.gtf or .gtf.gz) to a gene annotation table")
+    parser.add_argument('gtf', nargs='?', default="Homo_sapiens.GRCh38.110.gtf.gz", help="Input GTF, plain or gzip-compressed")
+    parser.add_argument('output', nargs='?', default="gene_annotation.csv", help="Output table (.csv or .parquet)")
+    parser.add_argument('--processes', type=int, default=1, help="Worker processes for attribute parsing")
+    parser.add_argument('--allow-truncated', action='store_true',
+                        help="Write the genes parsed so far from a truncated .gz instead of failing")
+    args = parser.parse_args()
+    try:
+        gtf_to_csv(args.gtf, args.output, args.processes, allow_truncated=args.allow_truncated)
+    except EOFError as e:
+        sys.exit(f"ERROR: {args.gtf}: {e}")
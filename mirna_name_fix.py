@@ -1,22 +1,37 @@
+
+import argparse
+import os
+import sys
 import pandas as pd
 
-def standardize_miRNA_counts(in_path, out_path):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "modules"))
+from id_resolver import ALIAS_FILE, ANNOTATION_FILE, canonical_mirna_names, load_id_resolver
+
+def standardize_miRNA_counts(in_path, out_path, annotation_path=ANNOTATION_FILE, alias_path=ALIAS_FILE):
     df = pd.read_csv(in_path, index_col=0)  # Assuming first column is gene/miRNA ID
-    
-    # Standardize miRNA rows (assuming they start with "MIR" or similar)
-    def standardize(name):
-        if name.upper().startswith("MIR"):
-            # Add "hsa-miR-" prefix, lowercase, and assume no arm for simplicity
-            return f"hsa-miR-{name[3:].lower()}"  # e.g., MIR3935 → hsa-miR-3935
-        return name  # Leave non-miRNA rows unchanged
-    
-    df.index = [standardize(idx) for idx in df.index]
-    
-    # Drop duplicates if any after mapping
-    df = df[~df.index.duplicated(keep='first')]
-    
+
+    if os.path.exists(annotation_path):
+        # Ensembl IDs, symbols and miRNA spellings -> canonical IDs, one vectorized lookup
+        resolver = load_id_resolver(annotation_path, alias_path)
+        df, n_dropped = resolver.resolve_index(df)
+    else:
+        # No annotation: only rewrite miRNA spellings, e.g. MIR3935 -> hsa-miR-3935
+        print(f"{annotation_path} not found; standardizing miRNA names only")
+        df.index = pd.Index(canonical_mirna_names(df.index).to_numpy(), name=df.index.name)
+        # Drop duplicates if any after mapping
+        duplicated = df.index.duplicated(keep='first')
+        df, n_dropped = df[~duplicated], int(duplicated.sum())
+
+    if n_dropped:
+        print(f"Dropped {n_dropped} rows whose IDs collapsed onto an existing gene")
     df.to_csv(out_path)
     print(f"Standardized miRNA names and saved to {out_path}")
 
-# Run with your file
-standardize_miRNA_counts("GSE40419_RPKM.csv", "GSE40419_standardized.csv")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Harmonize gene/miRNA identifiers of a counts matrix")
+    parser.add_argument('input', nargs='?', default="GSE40419_RPKM.csv", help="Counts CSV with gene/miRNA IDs as row names")
+    parser.add_argument('output', nargs='?', default="GSE40419_standardized.csv", help="Output CSV")
+    parser.add_argument('--annotation', default=ANNOTATION_FILE, help="gtf2csv gene annotation table")
+    parser.add_argument('--aliases', default=ALIAS_FILE, help="Optional alias table (alias<TAB>canonical)")
+    args = parser.parse_args()
+    standardize_miRNA_counts(args.input, args.output, args.annotation, args.aliases)
@@ -0,0 +1,101 @@
+# modules/cohort_summary.py
+
+import os
+import re
+import glob
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, phase, run_stage
+from stage_io import ensure_parent, snakemake_job
+
+# Batch mode: per-cohort stage outputs live under results/cohorts/<cohort>/
+COHORT_RESULTS_DIR = "results/cohorts"
+SUMMARY_PATH = "results/cohort_summary.csv"
+
+COHORT_NAME_PAT = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+SUMMARY_COLUMNS = ["lncRNA", "miRNA", "mRNA", "n_cohorts", "cohorts", "mean_score", "max_score",
+                   "min_mediation_pvalue", "mean_sensitivity"]
+
+def load_manifest(path):
+    """
+    Cohort manifest (.csv or tab-separated .tsv/.txt) with columns cohort and counts:
+    one raw counts matrix per cohort. Returns {cohort: counts_path} in manifest order.
+    """
+    sep = "," if path.endswith(".csv") else "\t"
+    manifest = pd.read_csv(path, sep=sep, dtype=str).fillna("")
+    missing = {"cohort", "counts"} - set(manifest.columns)
+    if missing:
+        raise ValueError(f"Manifest {path} lacks column(s): {', '.join(sorted(missing))}")
+    manifest["cohort"] = manifest["cohort"].str.strip()
+    manifest["counts"] = manifest["counts"].str.strip()
+    bad = manifest.loc[~manifest["cohort"].str.match(COHORT_NAME_PAT), "cohort"]
+    if len(bad):
+        raise ValueError(f"Invalid cohort name(s) in {path} (letters, digits, '_', '.', '-'): {', '.join(bad)}")
+    duplicated = manifest.loc[manifest["cohort"].duplicated(), "cohort"]
+    if len(duplicated):
+        raise ValueError(f"Duplicate cohort name(s) in {path}: {', '.join(duplicated.unique())}")
+    absent = manifest.loc[~manifest["counts"].map(os.path.isfile), "counts"]
+    if len(absent):
+        raise ValueError(f"Counts file(s) listed in {path} not found: {', '.join(absent)}")
+    return dict(zip(manifest["cohort"], manifest["counts"]))
+
+def summarize_cohorts(validated_paths, cohorts):
+    """
+    Merge per-cohort validated triplets into one row per (lncRNA, miRNA, mRNA): in how
+    many (and which) cohorts it validated, its mean/max ML score, best mediation
+    p-value and mean sensitivity correlation. Most reproducible triplets come first.
+    """
+    frames = []
+    for path, cohort in zip(validated_paths, cohorts):
+        df = pd.read_csv(path)
+        for col in ("score", "mediation_pvalue", "sensitivity"):
+            if col not in df.columns:
+                df[col] = np.nan
+        df = df[["lncRNA", "miRNA", "mRNA", "score", "mediation_pvalue", "sensitivity"]]
+        frames.append(df.assign(cohort=cohort))
+        count(f"rows_{cohort}", len(df))
+    merged = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+        columns=["lncRNA", "miRNA", "mRNA", "score", "mediation_pvalue", "sensitivity", "cohort"])
+    if merged.empty:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    for col in ("score", "mediation_pvalue", "sensitivity"):
+        merged[col] = pd.to_numeric(merged[col], errors="coerce")
+    # Each triplet appears at most once per cohort, so the cohort lists follow manifest order
+    summary = merged.groupby(["lncRNA", "miRNA", "mRNA"], sort=False).agg(
+        n_cohorts=("cohort", "nunique"),
+        cohorts=("cohort", ";".join),
+        mean_score=("score", "mean"),
+        max_score=("score", "max"),
+        min_mediation_pvalue=("mediation_pvalue", "min"),
+        mean_sensitivity=("sensitivity", "mean"),
+    ).reset_index()
+    return summary.sort_values(["n_cohorts", "mean_score"], ascending=[False, False], kind="stable")[SUMMARY_COLUMNS]
+
+def main():
+    job = snakemake_job()
+    if job is not None:
+        validated_paths = [str(p) for p in job.input.validated]
+        cohorts = list(job.params.cohorts)
+        summary_path = str(job.output.summary)
+    else:
+        # Standalone: every cohort found under results/cohorts/
+        validated_paths = sorted(glob.glob(os.path.join(COHORT_RESULTS_DIR, "*", "validated_triplets.csv")))
+        cohorts = [os.path.basename(os.path.dirname(p)) for p in validated_paths]
+        summary_path = SUMMARY_PATH
+
+    print(f"Merging validated triplets from {len(cohorts)} cohort(s)...")
+    with phase("merge"):
+        summary = summarize_cohorts(validated_paths, cohorts)
+    ensure_parent(summary_path)
+    with phase("writing"):
+        summary.to_csv(summary_path, index=False)
+    count("output_rows", len(summary))
+    shared = int((summary["n_cohorts"] > 1).sum()) if len(summary) else 0
+    print(f"{len(summary)} distinct triplets, {shared} validated in more than one cohort")
+    print(f"Cross-cohort summary saved to {summary_path}")
+
+if __name__ == "__main__":
+    run_stage("cohort_summary", main)
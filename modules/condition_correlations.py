@@ -0,0 +1,108 @@
+# modules/condition_correlations.py
+
+import os
+import yaml
+import warnings
+import numpy as np
+import pandas as pd
+
+from correlation_stats import CorrelationStats
+from feature_engineering import partial_from_pearson
+from prescreen import passes
+from instrumentation import count, phase, run_stage
+from stage_cache import cached
+from stage_io import ensure_parent, stage_paths
+
+# Named stage files (Snakemake rule input/output names) with their standalone paths
+INPUTS = {
+    "triplets": "results/validated_triplets.csv",
+    "stats": "results/correlation_stats.npz",
+}
+OUTPUTS = {"correlations": "results/condition_correlations.csv"}
+# Config keys that change the results (stage cache)
+CONFIG_KEYS = ["stats_bootstrap_resamples", "random_seed", "prescreen_lnc_mrna_cutoff", "prescreen_lnc_mrna_sign"]
+
+# Upper bound on (triplet, resample) correlations assembled at once
+BOOTSTRAP_CHUNK_VALUES = 10_000_000
+
+def triplet_correlations(stats, lnc_idx, mir_idx, mrna_idx, weights):
+    """lncRNA-mRNA, lncRNA-miRNA, mRNA-miRNA and partial r of triplets under each weight vector"""
+    r_lncmrna = stats.correlations("lnc_mrna", lnc_idx, mrna_idx, weights)
+    r_lncmirna = stats.correlations("mir_lnc", mir_idx, lnc_idx, weights)
+    r_mrnamirna = stats.correlations("mir_mrna", mir_idx, mrna_idx, weights)
+    return {
+        "pearson_lncmrna": r_lncmrna,
+        "pearson_lncmirna": r_lncmirna,
+        "pearson_mrnamirna": r_mrnamirna,
+        "partial_corr_lncmrna_mirna": partial_from_pearson(r_lncmrna, r_lncmirna, r_mrnamirna),
+    }
+
+def bootstrap_stability(stats, lnc_idx, mrna_idx, weights, sign, cutoff, chunk_values=BOOTSTRAP_CHUNK_VALUES):
+    """
+    Per triplet: 2.5/97.5 percentiles of the lncRNA-mRNA r over the bootstrap
+    resamples, and the fraction of resamples in which it passes the pre-screen rule.
+    """
+    lo, hi, stable = (np.full(len(lnc_idx), np.nan) for _ in range(3))
+    step = max(1, chunk_values // max(len(weights), 1))
+    for start in range(0, len(lnc_idx), step):
+        sl = slice(start, start + step)
+        r = stats.correlations("lnc_mrna", lnc_idx[sl], mrna_idx[sl], weights)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN rows: genes missing from the store
+            lo[sl], hi[sl] = np.nanpercentile(r, [2.5, 97.5], axis=1)
+        stable[sl] = passes(r, sign, cutoff).mean(axis=1)
+    return lo, hi, stable
+
+def main():
+    cfg_path = "config/config.yaml"
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r") as f:
+            cfg = yaml.safe_load(f)
+    else:
+        cfg = {}
+    n_resamples = int(cfg.get("stats_bootstrap_resamples", 200))
+    seed = int(cfg.get("random_seed", 42))
+
+    paths = stage_paths(INPUTS, OUTPUTS)
+    with phase("load"):
+        triplets = pd.read_csv(paths["triplets"], usecols=["lncRNA", "miRNA", "mRNA"])
+        stats = CorrelationStats(paths["stats"])
+    count("input_rows", len(triplets))
+
+    lnc_idx = stats.index_of(triplets["lncRNA"])
+    mir_idx = stats.index_of(triplets["miRNA"])
+    mrna_idx = stats.index_of(triplets["mRNA"])
+    result = triplets.copy()
+
+    # Correlations within each sample group, assembled from the stored block sums
+    with phase("conditions"):
+        labels = stats.labels if len(stats.labels) > 1 else []
+        weights = np.vstack([stats.group_weights(None)] + [stats.group_weights([g]) for g in labels])
+        correlations = triplet_correlations(stats, lnc_idx, mir_idx, mrna_idx, weights)
+        for name, r in correlations.items():
+            result[name] = r[:, 0]
+            for k, label in enumerate(labels, start=1):
+                result[f"{name}.{label}"] = r[:, k]
+
+    # Block bootstrap over all samples, stratified by group
+    if n_resamples > 0:
+        with phase("bootstrap"):
+            resamples = stats.bootstrap_weights(n_resamples, seed)
+            lo, hi, stable = bootstrap_stability(stats, lnc_idx, mrna_idx, resamples,
+                                                 cfg.get("prescreen_lnc_mrna_sign", "positive"),
+                                                 float(cfg.get("prescreen_lnc_mrna_cutoff", 0.15)))
+        result["pearson_lncmrna_ci_low"] = lo
+        result["pearson_lncmrna_ci_high"] = hi
+        result["bootstrap_stability"] = stable
+
+    with phase("writing"):
+        ensure_parent(paths["correlations"])
+        result.to_csv(paths["correlations"], index=False)
+    count("output_rows", len(result))
+    print(f"Correlations of {len(result)} triplets in {max(len(labels), 1)} sample group(s) "
+          f"saved to {paths['correlations']}")
+
+if __name__ == "__main__":
+    run_stage("condition_correlations", cached("condition_correlations", main, INPUTS, OUTPUTS, CONFIG_KEYS,
+                                               modules=["correlation_stats.py", "feature_engineering.py",
+                                                        "prescreen.py"]))
@@ -0,0 +1,266 @@
+# modules/correlation_stats.py
+
+import os
+import yaml
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from expression_matrix import open_expression_matrix
+from feature_engineering import load_candidates
+from instrumentation import count, phase, run_stage
+from stage_cache import cached
+from stage_io import ensure_parent, stage_paths
+
+# Named stage files (Snakemake rule input/output names) with their standalone paths
+INPUTS = {
+    "counts": "results/norm_counts.npy",
+    "genes": "results/norm_counts.genes.txt",
+    "metadata": "results/sample_metadata.csv",
+    "prescreen": "results/prescreen.npz",
+}
+OUTPUTS = {"stats": "results/correlation_stats.npz"}
+# Config keys that change the store (stage cache)
+CONFIG_KEYS = ["condition_columns", "stats_blocks_per_group", "random_seed"]
+
+# Candidate interaction patterns whose cross-products are stored: lncRNA x mRNA
+# pairs and the miRNA -> target edges, all indexed by expression matrix row
+PATTERNS = ("lnc_mrna", "mir_lnc", "mir_mrna")
+
+# Samples without condition columns form one group
+ALL_SAMPLES = "all"
+
+# Upper bound on values materialized at once while accumulating cross-products
+STATS_CHUNK_VALUES = 20_000_000
+
+def sample_groups(metadata, samples, condition_columns):
+    """Group label of every matrix sample: its condition column values joined by '/'"""
+    metadata = metadata.astype({'sample_id': str}).drop_duplicates('sample_id').set_index('sample_id')
+    missing = [c for c in condition_columns if c not in metadata.columns]
+    if missing:
+        raise ValueError(f"Condition column(s) not in the sample metadata: {', '.join(missing)}")
+    if not condition_columns:
+        return np.full(len(samples), ALL_SAMPLES, dtype=object)
+    values = metadata.reindex(pd.Index(samples).astype(str))[list(condition_columns)]
+    return values.fillna('NA').astype(str).agg('/'.join, axis=1).to_numpy(dtype=object)
+
+def sample_blocks(groups, blocks_per_group, seed=42):
+    """
+    Split every group's samples into up to blocks_per_group random blocks.
+    Returns (labels, block_group, block_of_sample): the sorted group labels, the group
+    index of each block and the block index of each sample.
+    """
+    rng = np.random.default_rng(seed)
+    labels = sorted(set(groups))
+    block_group = []
+    block_of_sample = np.empty(len(groups), dtype=np.int64)
+    for g, label in enumerate(labels):
+        members = rng.permutation(np.flatnonzero(groups == label))
+        for part in np.array_split(members, min(blocks_per_group, len(members))):
+            block_of_sample[part] = len(block_group)
+            block_group.append(g)
+    return labels, np.array(block_group, dtype=np.int64), block_of_sample
+
+def candidate_patterns(mir_mrna, mir_lnc, pairs=None):
+    """
+    Gene-indexed CSR patterns of the correlations the triplets use. Without
+    pre-screened pairs every co-targeted lncRNA x mRNA pair is a candidate.
+    """
+    if pairs is None:
+        pairs = (mir_lnc.T.astype(np.int32) @ mir_mrna.astype(np.int32)) != 0
+    patterns = {"lnc_mrna": pairs, "mir_lnc": mir_lnc, "mir_mrna": mir_mrna}
+    patterns = {name: sparse.csr_matrix(m, dtype=np.int8) for name, m in patterns.items()}
+    for pattern in patterns.values():
+        pattern.sort_indices()  # row-major nonzero order, searched by CorrelationStats.positions
+    return patterns
+
+def pattern_rows(indptr):
+    """Row of every nonzero of a CSR pattern"""
+    return np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+
+def pattern_cross_products(centered, local_rows, local_cols, block_matrix, chunk_values=STATS_CHUNK_VALUES):
+    """
+    Per-block sums of x*y for every (row, col) gene pair, as an nnz x blocks float32
+    array. block_matrix is the samples x blocks indicator, so one product per chunk of
+    pairs accumulates all blocks at once.
+    """
+    n_samples = centered.shape[1]
+    out = np.empty((len(local_rows), block_matrix.shape[1]), dtype=np.float32)
+    step = max(1, chunk_values // max(n_samples, 1))
+    for start in range(0, len(local_rows), step):
+        sl = slice(start, start + step)
+        out[sl] = (centered[local_rows[sl]] * centered[local_cols[sl]]) @ block_matrix
+    return out
+
+def build_correlation_stats(values, gene_names, groups, patterns, blocks_per_group=8, seed=42):
+    """
+    Sufficient statistics of the candidate correlations per sample block: block sizes,
+    and for every candidate gene the block sums and sums of squares, plus block
+    cross-products for every pattern nonzero. Values are shifted by the gene means
+    first, which leaves correlations unchanged and keeps the sums well conditioned.
+    Candidate genes are stored with their expression matrix row and name (gene_names).
+    Returns the arrays written by save_correlation_stats.
+    """
+    labels, block_group, block_of_sample = sample_blocks(groups, blocks_per_group, seed)
+    n_blocks = len(block_group)
+    block_matrix = np.zeros((len(groups), n_blocks))
+    block_matrix[np.arange(len(groups)), block_of_sample] = 1.0
+
+    genes = np.unique(np.concatenate([np.concatenate(m.nonzero()) for m in patterns.values()]))
+    centered = np.asarray(values[genes], dtype=np.float64)
+    shift = centered.mean(axis=1)
+    centered -= shift[:, None]
+
+    arrays = {
+        "labels": np.array(labels, dtype=str),
+        "block_group": block_group,
+        "block_n": block_matrix.sum(axis=0),
+        "genes": genes,
+        "gene_names": np.asarray(gene_names)[genes].astype(str),
+        "shift": shift,
+        "sums": (centered @ block_matrix).T,
+        "sumsq": ((centered * centered) @ block_matrix).T,
+    }
+    for name, pattern in patterns.items():
+        rows, cols = pattern_rows(pattern.indptr), pattern.indices
+        with phase(f"cross_{name}"):
+            arrays[f"{name}_cross"] = pattern_cross_products(
+                centered, np.searchsorted(genes, rows), np.searchsorted(genes, cols), block_matrix)
+        arrays[f"{name}_indptr"] = pattern.indptr
+        arrays[f"{name}_indices"] = pattern.indices
+    return arrays
+
+def save_correlation_stats(path, arrays):
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+class CorrelationStats:
+    """
+    Read side of the sufficient-statistics store. Sample sets are given as weight
+    vectors over blocks (see group_weights and bootstrap_weights); Pearson r for any
+    stored pair under any number of sample sets is assembled from the weighted sums,
+    without touching the expression matrix.
+    """
+
+    def __init__(self, path):
+        with np.load(path) as f:
+            self.arrays = {k: f[k] for k in f.files}
+        self.labels = [str(label) for label in self.arrays["labels"]]
+        self.block_group = self.arrays["block_group"]
+        self.genes = self.arrays["genes"]
+        self.gene_rows = pd.Index(self.arrays["gene_names"])
+
+    def index_of(self, names):
+        """Expression matrix rows of gene names (-1 for genes outside the store)"""
+        local = self.gene_rows.get_indexer(names)
+        return np.where(local >= 0, self.genes[local], -1)
+
+    @property
+    def n_blocks(self):
+        return len(self.block_group)
+
+    def group_weights(self, groups=None):
+        """Weights selecting the union of the named groups (all samples when None)"""
+        if groups is None:
+            return np.ones(self.n_blocks)
+        unknown = set(groups) - set(self.labels)
+        if unknown:
+            raise ValueError(f"Unknown sample group(s): {', '.join(sorted(unknown))}")
+        selected = [self.labels.index(g) for g in groups]
+        return np.isin(self.block_group, selected).astype(np.float64)
+
+    def bootstrap_weights(self, n_resamples, seed=42, groups=None):
+        """
+        Block-bootstrap resamples as an n_resamples x blocks count matrix: within each
+        selected group, its blocks are drawn with replacement as often as it has blocks.
+        """
+        rng = np.random.default_rng(seed)
+        selected = self.group_weights(groups) > 0
+        weights = np.zeros((n_resamples, self.n_blocks))
+        for g in np.unique(self.block_group[selected]):
+            blocks = np.flatnonzero(self.block_group == g)
+            draws = rng.integers(0, len(blocks), size=(n_resamples, len(blocks)))
+            offsets = np.arange(n_resamples)[:, None] * len(blocks)
+            counts = np.bincount((draws + offsets).ravel(), minlength=n_resamples * len(blocks))
+            weights[:, blocks] = counts.reshape(n_resamples, len(blocks))
+        return weights
+
+    def positions(self, name, rows, cols):
+        """Positions of (row, col) expression-row pairs among a pattern's nonzeros (-1 if absent)"""
+        indptr = self.arrays[f"{name}_indptr"]
+        indices = self.arrays[f"{name}_indices"]
+        n_genes = len(indptr) - 1
+        keys = pattern_rows(indptr) * n_genes + indices
+        wanted = np.asarray(rows, dtype=np.int64) * n_genes + np.asarray(cols, dtype=np.int64)
+        if len(keys) == 0:
+            return np.full(len(wanted), -1)
+        pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        return np.where(keys[pos] == wanted, pos, -1)
+
+    def correlations(self, name, rows, cols, weights):
+        """
+        Pearson r of (row, col) pairs of a pattern under each weight vector: weights is
+        blocks or sample-sets x blocks; returns pairs x sample-sets. Pairs not stored,
+        and sample sets where a gene is constant, give NaN.
+        """
+        weights = np.atleast_2d(weights)
+        pos = self.positions(name, rows, cols)
+        stored = pos >= 0
+        li = np.searchsorted(self.genes, np.asarray(rows)[stored])
+        lj = np.searchsorted(self.genes, np.asarray(cols)[stored])
+
+        n = weights @ self.arrays["block_n"]
+        sums = weights @ self.arrays["sums"]
+        sumsq = weights @ self.arrays["sumsq"]
+        sx, sy = sums[:, li].T, sums[:, lj].T
+        sxx, syy = sumsq[:, li].T, sumsq[:, lj].T
+        sxy = self.arrays[f"{name}_cross"][pos[stored]].astype(np.float64) @ weights.T
+
+        r = np.full((len(pos), len(weights)), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r[stored] = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx**2) * (n * syy - sy**2))
+        return np.clip(r, -1.0, 1.0)
+
+def load_correlation_stats(path=OUTPUTS["stats"]):
+    return CorrelationStats(path)
+
+def main():
+    cfg_path = "config/config.yaml"
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r") as f:
+            cfg = yaml.safe_load(f)
+    else:
+        cfg = {}
+    condition_columns = cfg.get("condition_columns") or []
+    if isinstance(condition_columns, str):
+        condition_columns = [condition_columns]
+    blocks_per_group = max(1, int(cfg.get("stats_blocks_per_group", 8)))
+
+    paths = stage_paths(INPUTS, OUTPUTS)
+    with phase("load"):
+        norm_counts = open_expression_matrix(os.path.splitext(paths["counts"])[0])
+        metadata = pd.read_csv(paths["metadata"], dtype=str)
+        mir_mrna, mir_lnc, pairs = load_candidates(paths["prescreen"], len(norm_counts.genes))
+        patterns = candidate_patterns(mir_mrna, mir_lnc, pairs)
+    groups = sample_groups(metadata, norm_counts.samples, condition_columns)
+
+    print(f"Accumulating correlation statistics over {len(set(groups))} sample group(s)...")
+    arrays = build_correlation_stats(norm_counts.values, norm_counts.genes, groups, patterns,
+                                     blocks_per_group, int(cfg.get("random_seed", 42)))
+    count("genes", len(arrays["genes"]))
+    count("blocks", len(arrays["block_group"]))
+    for name in PATTERNS:
+        count(f"{name}_pairs", patterns[name].nnz)
+
+    with phase("writing"):
+        ensure_parent(paths["stats"])
+        save_correlation_stats(paths["stats"], arrays)
+    for g, label in enumerate(arrays["labels"]):
+        n = int(arrays["block_n"][arrays["block_group"] == g].sum())
+        print(f"  {label}: {n} samples")
+    print(f"Correlation statistics saved to {paths['stats']}")
+
+if __name__ == "__main__":
+    run_stage("correlation_stats", cached("correlation_stats", main, INPUTS, OUTPUTS, CONFIG_KEYS,
+                                          modules=["expression_matrix.py", "feature_engineering.py"]))
@@ -1,9 +1,16 @@
 # modules/download_databases.py
 
 import os
+import yaml
 import pandas as pd
 import shutil
 
+from interaction_index import build_interaction_index, default_index_dir, index_is_current
+from id_resolver import ALIAS_FILE, build_id_lookup, default_lookup_dir, lookup_is_current
+from sequence_index import build_seed_index, seed_index_is_current
+from sequence_index import default_index_dir as default_seed_index_dir
+from instrumentation import phase, run_stage
+
 def process_mirtarbase(src, dest):
     """Process miRTarBase txt file ('miRNA', 'Target'), rename and export."""
     print(f"Processing miRTarBase from {src} ...")
@@ -27,7 +34,42 @@ def copy_annotation(src, dest):
     shutil.copy(src, dest)
     print(f"Copied annotation to {dest}")
 
+def compile_index(src):
+    """Compile the CSR interaction index for src unless it is already current"""
+    index_dir = default_index_dir(src)
+    if index_is_current(src, index_dir, refresh_stat=True):
+        print(f"Interaction index {index_dir} is up to date")
+    else:
+        build_interaction_index(src, index_dir)
+
+def compile_seed_index(fasta):
+    """Compile the seed-match index of the transcript FASTA, if one is present and not current"""
+    if not os.path.exists(fasta):
+        print(f"No transcript sequences at {fasta}; sequence features will be left empty")
+        return
+    index_dir = default_seed_index_dir(fasta)
+    if seed_index_is_current(fasta, index_dir, refresh_stat=True):
+        print(f"Seed index {index_dir} is up to date")
+    else:
+        build_seed_index(fasta, index_dir)
+
+def compile_id_lookup(annotation, aliases=ALIAS_FILE):
+    """Precompute the identifier-harmonization lookup unless it is already current"""
+    lookup_dir = default_lookup_dir(annotation)
+    if lookup_is_current(annotation, aliases, lookup_dir, refresh_stat=True):
+        print(f"Identifier lookup {lookup_dir} is up to date")
+    else:
+        build_id_lookup(annotation, aliases, lookup_dir)
+
 def main():
+    # Load config parameters
+    cfg_path = "config/config.yaml"
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r") as f:
+            cfg = yaml.safe_load(f)
+    else:
+        cfg = {}
+
     # Ensure the output folder exists
     os.makedirs("databases", exist_ok=True)
 
@@ -35,6 +77,10 @@ def main():
     mirtarbase_src = "databases/miRTarBase_MTI.txt"
     starbase_src   = "databases/starBase_miRNA_lncRNA.txt"
     annotation_src = "gene_annotation.csv"
+    # Optional inputs at their configured paths, so the stages find these indexes
+    # current instead of each rebuilding them
+    alias_file = cfg.get("alias_file", ALIAS_FILE)
+    transcript_fasta = cfg.get("transcript_fasta", "databases/transcripts.fa")
 
     # Output files
     mirtarbase_dest    = "databases/miRTarBase.txt"
@@ -42,11 +88,19 @@ def main():
     annotation_dest    = "databases/gene_annotation.csv"
 
     # Process each file
-    process_mirtarbase(mirtarbase_src, mirtarbase_dest)
-    process_starbase(starbase_src, starbase_dest)
-    copy_annotation(annotation_src, annotation_dest)
+    with phase("process_tables"):
+        process_mirtarbase(mirtarbase_src, mirtarbase_dest)
+        process_starbase(starbase_src, starbase_dest)
+        copy_annotation(annotation_src, annotation_dest)
+
+    # Compile the on-disk interaction indexes used by feature engineering
+    with phase("compile_indexes"):
+        compile_index(mirtarbase_dest)
+        compile_index(starbase_dest)
+        compile_id_lookup(annotation_dest, alias_file)
+        compile_seed_index(transcript_fasta)
 
     print("Finished processing all interaction databases.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_stage("download_databases", main)
\ No newline at end of file
@@ -0,0 +1,72 @@
+# modules/expression_matrix.py
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+
+# Binary normalized matrix written next to results/norm_counts.csv by qc_normalization
+NORM_MATRIX_PREFIX = "results/norm_counts"
+
+def matrix_paths(prefix=NORM_MATRIX_PREFIX):
+    """Paths of the .npy matrix and its gene/sample index sidecars"""
+    return f"{prefix}.npy", f"{prefix}.genes.txt", f"{prefix}.samples.txt"
+
+def _write_names(path, names):
+    with open(path, "w") as f:
+        for name in names:
+            f.write(f"{name}\n")
+
+def _read_names(path):
+    with open(path, "r") as f:
+        return pd.Index([line.rstrip("\n") for line in f])
+
+def create_expression_matrix(genes, samples, prefix=NORM_MATRIX_PREFIX, dtype=np.float64):
+    """
+    Create an on-disk genes x samples matrix and its sidecars, returning a writable
+    memmap so callers can fill it block by block.
+    """
+    matrix_path, genes_path, samples_path = matrix_paths(prefix)
+    _write_names(genes_path, genes)
+    _write_names(samples_path, samples)
+    return open_memmap(matrix_path, mode="w+", dtype=dtype, shape=(len(genes), len(samples)))
+
+def write_expression_matrix(df, prefix=NORM_MATRIX_PREFIX):
+    """Write a genes x samples DataFrame as a memory-mappable matrix with sidecars"""
+    matrix = create_expression_matrix(df.index, df.columns, prefix)
+    matrix[:] = df.to_numpy(dtype=np.float64)
+    matrix.flush()
+    del matrix
+
+class ExpressionMatrix:
+    """
+    Read-only, memory-mapped genes x samples matrix.
+    Rows are addressed by integer position; index_of maps gene names to positions
+    once, so stages never do label-based .loc lookups.
+    """
+
+    def __init__(self, values, genes, samples):
+        self.values = values
+        self.genes = genes
+        self.samples = samples
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def index_of(self, names):
+        """Row positions for gene names (-1 where a name is absent)"""
+        return self.genes.get_indexer(names)
+
+    def rows(self, idx):
+        """In-memory float64 copy of the requested rows only"""
+        return np.asarray(self.values[idx], dtype=np.float64)
+
+    def to_frame(self):
+        """Materialize as a DataFrame (loads the whole matrix)"""
+        return pd.DataFrame(np.asarray(self.values), index=self.genes, columns=self.samples)
+
+def open_expression_matrix(prefix=NORM_MATRIX_PREFIX):
+    """Open the binary matrix zero-copy via mmap, with its gene and sample indexes"""
+    matrix_path, genes_path, samples_path = matrix_paths(prefix)
+    values = np.load(matrix_path, mmap_mode="r")
+    return ExpressionMatrix(values, _read_names(genes_path), _read_names(samples_path))
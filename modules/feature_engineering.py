@@ -2,166 +2,461 @@
 
 import pandas as pd
 import numpy as np
-import pickle
-from scipy.stats import pearsonr, spearmanr
-from itertools import product
-from collections import defaultdict
-
-def compute_pearson(df1, df2):
-    """Compute Pearson correlation for each pair of rows from df1 and df2"""
-    results = {}
-    for i in df1.index:
-        for j in df2.index:
-            r, p = pearsonr(df1.loc[i, :], df2.loc[j, :])
-            results[(i,j)] = (r, p)
-    return results
-
-def compute_partial_correlation(x, y, z):
-    """
-    Compute partial correlation between vectors x and y controlling for z.
-    Equivalent to correlation(x_res, y_res) where x_res and y_res are residuals
-    from linear regression on z.
-    """
-    from sklearn.linear_model import LinearRegression
-    
-    x = x.values.reshape(-1,1)
-    y = y.values.reshape(-1,1)
-    z = z.values.reshape(-1,1)
-    
-    model_x = LinearRegression().fit(z, x)
-    model_y = LinearRegression().fit(z, y)
-    
-    x_res = x - model_x.predict(z)
-    y_res = y - model_y.predict(z)
-    
-    r, p = pearsonr(x_res.flatten(), y_res.flatten())
-    return r, p
-
-def sponge_effect(lnc_expr, mirna_expr, mrna_expr):
-    """
-    Approximate SPONGE multiple sensitivity correlation effect size.
-    Here simplified as the change in correlation of lncRNA-mRNA when conditioning on miRNA.
-    More sophisticated implementations require matrix operations.
-    """
-    r_lnc_mrna, _ = pearsonr(lnc_expr, mrna_expr)
-    r_lnc_mirna, _ = pearsonr(lnc_expr, mirna_expr)
-    r_mrna_mirna, _ = pearsonr(mrna_expr, mirna_expr)
-
-    # Compute partial correlation (lnc-mrna | miRNA)
-    from sklearn.linear_model import LinearRegression
-    import numpy as np
-
-    def residuals(x, z):
-        model = LinearRegression().fit(z.reshape(-1,1), x.reshape(-1,1))
-        return x - model.predict(z.reshape(-1,1))
-
-    x_res = residuals(lnc_expr, mirna_expr)
-    y_res = residuals(mrna_expr, mirna_expr)
-    r_partial, _ = pearsonr(x_res.flatten(), y_res.flatten())
-
-    # Sensitivity correlation (effect of miRNA on lnc-mrna correlation)
-    sensitivity = r_lnc_mrna - r_partial
-    return sensitivity
-
-def load_interaction_db(path):
-    """Load miRNA-target interactions as dict: miRNA->set(targets)"""
-    df = pd.read_csv(path, sep='\t')
-    mirna_to_targets = defaultdict(set)
-    for _, row in df.iterrows():
-        mirna_to_targets[row['miRNA']].add(row.iloc[1])
-    return mirna_to_targets
-
-def feature_engineering_main():
-    print("Loading normalized expression data...")
-    norm_counts = pd.read_csv("results/norm_counts.csv", index_col=0)
-    
+import os
+import yaml
+import shutil
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from scipy import sparse
+from scipy.stats import beta
+from threadpoolctl import threadpool_limits
+
+from expression_matrix import open_expression_matrix
+from feature_store import ROW_GROUP_SIZE, FeatureStoreWriter, part_path, replace_store
+from interaction_index import load_interaction_index
+from id_resolver import load_id_resolver, mirna_locus_matches
+from sequence_features import sequence_features
+from instrumentation import count, phase, run_stage
+from stage_cache import cached
+from stage_io import stage_paths
+
+# Annotation biotypes accepted as lncRNA / mRNA targets (older Ensembl lncRNA subtypes included)
+LNCRNA_BIOTYPES = {
+    "lncRNA", "lincRNA", "antisense", "sense_intronic", "sense_overlapping",
+    "processed_transcript", "3prime_overlapping_ncRNA", "bidirectional_promoter_lncRNA",
+    "macro_lncRNA", "non_coding"
+}
+MRNA_BIOTYPES = {"protein_coding"}
+
+# Named stage files (Snakemake rule input/output names) with their standalone paths
+OUTPUTS = {"features": "results/features.parquet"}
+# Config keys that change the features (stage cache)
+CONFIG_KEYS = ["id_resolution", "biotype_filter", "annotation_file", "alias_file",
+               "transcript_fasta", "mirna_fasta", "localization_file"]
+
+def stage_inputs(cfg):
+    """Files feature engineering reads; the annotation and alias tables come from the config"""
+    return {
+        "counts": "results/norm_counts.npy",
+        "genes": "results/norm_counts.genes.txt",
+        "mirna_mrna_db": "databases/miRTarBase.txt",
+        "mirna_lncrna_db": "databases/LncBase.txt",
+        "annotation_file": cfg.get("annotation_file", "databases/gene_annotation.csv"),
+        "alias_file": cfg.get("alias_file", "databases/id_aliases.tsv"),
+        "prescreen": "results/prescreen.npz",
+        "transcript_fasta": cfg.get("transcript_fasta", "databases/transcripts.fa"),
+        "mirna_fasta": cfg.get("mirna_fasta", "databases/mature.fa"),
+        "localization_file": cfg.get("localization_file") or "",
+    }
+
+# Upper bound on triplets materialized at once by iter_triplet_blocks
+TRIPLET_CHUNK_SIZE = 500_000
+# Feature store parts per worker process: enough to even out uneven miRNA blocks
+PARTS_PER_WORKER = 4
+
+FEATURE_COLUMNS = [
+    "lncRNA", "miRNA", "mRNA",
+    "pearson_lncmrna", "pval_lncmrna",
+    "pearson_lncmirna", "pval_lncmirna",
+    "pearson_mrnamirna", "pval_mrnamirna",
+    "partial_corr_lncmrna_mirna", "partial_corr_pval",
+    "sponge_score",
+    "mre_counts", "seed_match_energy", "cytoplasmic_localization"
+]
+
+def standardize_rows(values):
+    """
+    Centre each row and scale it to unit length, so that the dot product of
+    two standardized rows is their Pearson correlation.
+    Constant rows become NaN, mirroring pearsonr on constant input.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    centered = values - values.mean(axis=1, keepdims=True)
+    norms = np.sqrt(np.einsum('ij,ij->i', centered, centered))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return centered / norms[:, None]
+
+def pearson_pvalues(r, n_samples):
+    """Two-sided p-values for Pearson r over n_samples (same exact test as scipy.stats.pearsonr)"""
+    r = np.clip(r, -1.0, 1.0)
+    ab = n_samples / 2 - 1
+    return 2 * beta.sf(np.abs(r), ab, ab, loc=-1, scale=2)
+
+def partial_from_pearson(r_xy, r_xz, r_yz):
+    """
+    Closed-form partial correlation of x and y given z from the three pairwise r's.
+    Same value as correlating the residuals of x and y regressed on z; a constant z
+    (NaN r's) leaves r_xy unchanged.
+    """
+    r_xz = np.nan_to_num(r_xz)
+    r_yz = np.nan_to_num(r_yz)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = (r_xy - r_xz * r_yz) / np.sqrt((1 - r_xz**2) * (1 - r_yz**2))
+    return np.clip(r, -1.0, 1.0)
+
+def sponge_from_pearson(r_xy, r_xz, r_yz):
+    """
+    SPONGE sensitivity (r_xy minus the correlation after conditioning on z) from the
+    three pairwise r's. The original per-triplet implementation subtracted the (n, 1)
+    regression fit from an (n,) vector, which broadcasts to an n x n residual grid;
+    correlating the flattened grids gives
+    (r_xy + r_xz * r_yz) / sqrt((1 + r_xz^2) * (1 + r_yz^2)).
+    """
+    r_xz = np.nan_to_num(r_xz)
+    r_yz = np.nan_to_num(r_yz)
+    r_grid = (r_xy + r_xz * r_yz) / np.sqrt((1 + r_xz**2) * (1 + r_yz**2))
+    return r_xy - r_grid
+
+def mirna_block_features(unit, mir, lnc_idx, mrna_idx):
+    """
+    Correlation features for every (lnc, mir, mrna) in lnc_idx x mrna_idx.
+    unit holds standardized rows (see standardize_rows); each pairwise r is a
+    dot product, so the whole block costs one matrix product.
+    Triplets are returned lncRNA-major, matching the nested triplet loop.
+    """
+    n_samples = unit.shape[1]
+    r_lncmrna = (unit[lnc_idx] @ unit[mrna_idx].T).ravel()
+    r_lncmirna = np.repeat(unit[lnc_idx] @ unit[mir], len(mrna_idx))
+    r_mrnamirna = np.tile(unit[mrna_idx] @ unit[mir], len(lnc_idx))
+    r_lncmrna = np.clip(r_lncmrna, -1.0, 1.0)
+    r_lncmirna = np.clip(r_lncmirna, -1.0, 1.0)
+    r_mrnamirna = np.clip(r_mrnamirna, -1.0, 1.0)
+
+    # Partial correlation controlling for miRNA, and SPONGE sensitivity correlation
+    r_partial = partial_from_pearson(r_lncmrna, r_lncmirna, r_mrnamirna)
+    sponge_score = sponge_from_pearson(r_lncmrna, r_lncmirna, r_mrnamirna)
+
+    return {
+        "pearson_lncmrna": r_lncmrna,
+        "pval_lncmrna": pearson_pvalues(r_lncmrna, n_samples),
+        "pearson_lncmirna": r_lncmirna,
+        "pval_lncmirna": pearson_pvalues(r_lncmirna, n_samples),
+        "pearson_mrnamirna": r_mrnamirna,
+        "pval_mrnamirna": pearson_pvalues(r_mrnamirna, n_samples),
+        "partial_corr_lncmrna_mirna": r_partial,
+        # pearsonr on the residuals keeps n - 2 degrees of freedom
+        "partial_corr_pval": pearson_pvalues(r_partial, n_samples),
+        "sponge_score": sponge_score,
+    }
+
+def load_interaction_incidence(path, genes, resolver=None):
+    """
+    Load miRNA-target interactions as a sparse incidence matrix over integer gene IDs.
+    Row and column i both refer to genes[i]; pairs with a name missing from genes are dropped.
+    Reads the compiled, memory-mapped index next to path (rebuilt only if path changed).
+    With a resolver, genes and database names are both matched on canonical IDs, and
+    arm-specific database miRNAs missing from genes fall back to the precursor row of
+    their locus (id_resolver.mirna_locus_matches).
+    """
+    index = load_interaction_index(path)
+    if resolver is None:
+        return index.gene_incidence(genes)
+    return index.resolved(resolver).gene_incidence(resolver.resolve(genes), mirna_locus_matches)
+
+def load_gene_biotypes(path, genes):
+    """
+    Biotype of every expression-matrix gene from the gtf2csv annotation table
+    (gene_id, gene_name, gene_biotype; .csv or .parquet). Genes are matched by
+    version-less Ensembl ID first, then by gene name; unannotated genes get ''.
+    """
+    if path.endswith('.parquet'):
+        ann = pd.read_parquet(path, columns=['gene_id', 'gene_name', 'gene_biotype'])
+    else:
+        ann = pd.read_csv(path, usecols=['gene_id', 'gene_name', 'gene_biotype'], dtype=str)
+    ann = ann.fillna('').astype(str)
+    by_id = ann.drop_duplicates('gene_id').set_index('gene_id')['gene_biotype']
+    named = ann[ann['gene_name'] != '']
+    by_name = named.drop_duplicates('gene_name').set_index('gene_name')['gene_biotype']
+
+    gene_ids = genes.astype(str).str.replace(r'^(ENS\w*G\d+)\.\d+$', r'\1', regex=True)
+    biotypes = by_id.reindex(gene_ids).to_numpy()
+    missing = pd.isna(biotypes)
+    biotypes[missing] = by_name.reindex(genes[missing]).to_numpy()
+    return pd.Series(biotypes, index=genes).fillna('')
+
+def restrict_targets(incidence, allowed):
+    """Keep only target columns where allowed (boolean per gene) is True"""
+    restricted = incidence @ sparse.diags(allowed.astype(np.int8), dtype=np.int8)
+    restricted.eliminate_zeros()
+    return restricted.tocsr()
+
+def build_incidences(cfg, genes, paths):
+    """
+    miRNA -> mRNA and miRNA -> lncRNA incidence matrices over the expression matrix
+    rows, with names matched on canonical IDs (id_resolution) and targets restricted
+    by annotated biotype (biotype_filter). paths holds the stage_inputs files.
+    """
+    # Match expression rows and database names on canonical IDs (Ensembl ID,
+    # symbol and miRBase spellings all resolve to the same key)
+    annotation_path = paths["annotation_file"]
+    resolver = None
+    if cfg.get("id_resolution", True) and os.path.exists(annotation_path):
+        print(f"Harmonizing identifiers against {annotation_path}...")
+        with phase("load_id_resolver"):
+            resolver = load_id_resolver(annotation_path, paths["alias_file"])
+
+    # miRNA -> target incidence over the expression matrix rows; names that are
+    # not in norm_counts never get a gene ID, so no per-target membership tests
     print("Loading miRNA - mRNA and miRNA - lncRNA interaction data...")
-    mirna_mrna = load_interaction_db("databases/miRTarBase.txt")
-    mirna_lncrna = load_interaction_db("databases/LncBase.txt")
-
-    # Extract miRNA, lncRNA, mRNA indices
-    # Assume norm_counts contains all genes and miRNAs together with consistent naming
-    genes = norm_counts.index.tolist()
-    
-    # Simple heuristics:  
-    # miRNA names start with "hsa-miR" or similar — adjust accordingly  
-    # lncRNAs have ENSG ids or annotated in database  
-    # We will only process miRNAs present in interaction databases
-    
-    mirnas = set(list(mirna_mrna.keys()) + list(mirna_lncrna.keys()))
-    mirnas = [m for m in mirnas if m in norm_counts.index]
-
-    mRNAs = set()
-    for targets in mirna_mrna.values():
-        mRNAs.update(targets)
-    mRNAs = [g for g in mRNAs if g in norm_counts.index]
-    
-    lncRNAs = set()
-    for targets in mirna_lncrna.values():
-        lncRNAs.update(targets)
-    lncRNAs = [g for g in lncRNAs if g in norm_counts.index]
-
-    print(f"Number of miRNAs: {len(mirnas)}")
-    print(f"Number of mRNAs: {len(mRNAs)}")
-    print(f"Number of lncRNAs: {len(lncRNAs)}")
-    
-    # Build triplets: (lncRNA, miRNA, mRNA) where miRNA targets both lncRNA and mRNA
-    triplets = []
-    for miRNA in mirnas:
-        targets_mrna = mirna_mrna.get(miRNA, set())
-        targets_lncrna = mirna_lncrna.get(miRNA, set())
-        # Filter to genes present in expression data
-        targets_mrna = set(t for t in targets_mrna if t in mRNAs)
-        targets_lncrna = set(t for t in targets_lncrna if t in lncRNAs)
-        for lnc in targets_lncrna:
-            for mrna in targets_mrna:
-                triplets.append((lnc, miRNA, mrna))
-    print(f"Total candidate triplets: {len(triplets)}")
-
-    # Preallocate feature storage
-    feature_rows = []
-    for (lnc, miRNA, mrna) in triplets:
-        lnc_expr = norm_counts.loc[lnc]
-        miRNA_expr = norm_counts.loc[miRNA]
-        mrna_expr = norm_counts.loc[mrna]
-
-        # Pairwise correlations
-        r_lncmrna, p_lncmrna = pearsonr(lnc_expr, mrna_expr)
-        r_lncmirna, p_lncmirna = pearsonr(lnc_expr, miRNA_expr)
-        r_mrnamirna, p_mrnamirna = pearsonr(mrna_expr, miRNA_expr)
-
-        # Partial correlation controlling for miRNA
-        r_partial, p_partial = compute_partial_correlation(lnc_expr, mrna_expr, miRNA_expr)
-        
-        # SPONGE sensitivity correlation
-        sponge_score = sponge_effect(lnc_expr.values, miRNA_expr.values, mrna_expr.values)
-        
-        # Sequence features (placeholders; real implementation requires sequence files)
-        mre_counts = np.nan  # placeholder
-        seed_match_energy = np.nan  # placeholder
-        cytoplasmic_localization = np.nan  # placeholder
-        
-        feature_rows.append({
-            "lncRNA": lnc,
-            "miRNA": miRNA,
-            "mRNA": mrna,
-            "pearson_lncmrna": r_lncmrna,
-            "pval_lncmrna": p_lncmrna,
-            "pearson_lncmirna": r_lncmirna,
-            "pval_lncmirna": p_lncmirna,
-            "pearson_mrnamirna": r_mrnamirna,
-            "pval_mrnamirna": p_mrnamirna,
-            "partial_corr_lncmrna_mirna": r_partial,
-            "partial_corr_pval": p_partial,
-            "sponge_score": sponge_score,
-            "mre_counts": mre_counts,
-            "seed_match_energy": seed_match_energy,
-            "cytoplasmic_localization": cytoplasmic_localization
-        })
-    
-    features_df = pd.DataFrame(feature_rows)
-    features_df.to_pickle("results/features.pkl")
-    print("Feature engineering completed and saved to results/features.pkl")
+    with phase("load_interactions"):
+        mir_mrna = load_interaction_incidence(paths["mirna_mrna_db"], genes, resolver)
+        mir_lnc = load_interaction_incidence(paths["mirna_lncrna_db"], genes, resolver)
+    count("input_mirna_mrna_pairs", mir_mrna.nnz)
+    count("input_mirna_lncrna_pairs", mir_lnc.nnz)
+
+    # Classify targets by annotated biotype: database targets annotated with a
+    # conflicting biotype are dropped, unannotated genes are kept
+    if cfg.get("biotype_filter", True) and os.path.exists(annotation_path):
+        print(f"Classifying lncRNA/mRNA targets by biotype from {annotation_path}...")
+        with phase("biotype_filter"):
+            biotypes = load_gene_biotypes(annotation_path, genes)
+            unannotated = (biotypes == '').to_numpy()
+            mir_mrna = restrict_targets(mir_mrna, unannotated | biotypes.isin(MRNA_BIOTYPES).to_numpy())
+            mir_lnc = restrict_targets(mir_lnc, unannotated | biotypes.isin(LNCRNA_BIOTYPES).to_numpy())
+    return mir_mrna, mir_lnc
+
+def save_candidates(path, mir_mrna, mir_lnc, pairs=None):
+    """
+    Write the prescreen candidate file: the miRNA -> target incidences and, unless
+    pair screening is off, the lncRNA x mRNA pairs allowed to form triplets, all as
+    gene-indexed CSR structure in one .npz (written atomically).
+    """
+    arrays = {"n_genes": np.array(mir_mrna.shape[0])}
+    for name, matrix in (("mir_mrna", mir_mrna), ("mir_lnc", mir_lnc), ("pairs", pairs)):
+        if matrix is not None:
+            matrix = sparse.csr_matrix(matrix)
+            arrays[f"{name}_indptr"] = matrix.indptr
+            arrays[f"{name}_indices"] = matrix.indices
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+def load_candidates(path, n_genes):
+    """Read a candidate file back as (mir_mrna, mir_lnc, pairs); pairs is None when not screened"""
+    with np.load(path) as f:
+        if int(f["n_genes"]) != n_genes:
+            raise ValueError(f"{path} was screened over {int(f['n_genes'])} genes but the expression "
+                             f"matrix has {n_genes}; rerun the prescreen stage")
+        matrices = []
+        for name in ("mir_mrna", "mir_lnc", "pairs"):
+            if f"{name}_indptr" not in f.files:
+                matrices.append(None)
+                continue
+            indices = f[f"{name}_indices"]
+            matrices.append(sparse.csr_matrix((np.ones(len(indices), dtype=np.int8), indices,
+                                               f[f"{name}_indptr"]), shape=(n_genes, n_genes)))
+    return tuple(matrices)
+
+def pair_mask(pairs, lnc_idx, mrna_idx):
+    """Allowed lncRNA-mRNA pairs of a triplet block, lncRNA-major like the block's features"""
+    return (pairs[lnc_idx][:, mrna_idx].toarray() != 0).ravel()
+
+def iter_triplet_blocks(mir_lnc, mir_mrna, chunk_size=TRIPLET_CHUNK_SIZE):
+    """
+    Stream candidate triplets as (miRNA, lnc_idx, mrna_idx) blocks.
+    Each block stands for every (lnc, miRNA, mrna) in lnc_idx x mrna_idx and holds at
+    most chunk_size triplets, so hub miRNAs never materialize their full triplet list.
+    """
+    shared = np.flatnonzero((mir_lnc.getnnz(axis=1) > 0) & (mir_mrna.getnnz(axis=1) > 0))
+    for mir in shared:
+        lnc_targets = mir_lnc.indices[mir_lnc.indptr[mir]:mir_lnc.indptr[mir + 1]]
+        mrna_targets = mir_mrna.indices[mir_mrna.indptr[mir]:mir_mrna.indptr[mir + 1]]
+        mrna_step = min(len(mrna_targets), chunk_size)
+        lnc_step = max(1, chunk_size // mrna_step)
+        for lnc_start in range(0, len(lnc_targets), lnc_step):
+            for mrna_start in range(0, len(mrna_targets), mrna_step):
+                yield (mir,
+                       lnc_targets[lnc_start:lnc_start + lnc_step],
+                       mrna_targets[mrna_start:mrna_start + mrna_step])
+
+def block_feature_columns(mir, lnc_idx, mrna_idx, block, keep=None, seq_features=None):
+    """
+    Feature store columns (FEATURE_COLUMNS; IDs as gene indices) for one triplet block
+    and its mirna_block_features; with keep (see pair_mask) only the triplets of allowed
+    lncRNA-mRNA pairs. Sequence features come from seq_features (see
+    sequence_features), NaN without it.
+    """
+    n_triplets = len(lnc_idx) * len(mrna_idx)
+    if seq_features is not None:
+        sequence = seq_features.block_columns(mir, lnc_idx, mrna_idx)
+    else:
+        sequence = {k: np.full(n_triplets, np.nan, dtype=np.float32)
+                    for k in ("mre_counts", "seed_match_energy", "cytoplasmic_localization")}
+    columns = {
+        "lncRNA": np.repeat(lnc_idx, len(mrna_idx)),
+        "miRNA": np.full(n_triplets, mir),
+        "mRNA": np.tile(mrna_idx, len(lnc_idx)),
+        **block,
+        **sequence,
+    }
+    if keep is not None:
+        columns = {k: v[keep] for k, v in columns.items()}
+    return columns
+
+def plan_parts(blocks, n_parts):
+    """
+    Split the block sequence into at most n_parts contiguous runs of roughly equal
+    triplet counts. Parts are written independently and read back in order, so the
+    store's row order does not depend on how many parts there are.
+    """
+    sizes = np.array([len(lnc_idx) * len(mrna_idx) for _, lnc_idx, mrna_idx in blocks], dtype=np.int64)
+    if len(blocks) == 0:
+        return [[]]
+    bounds = np.searchsorted(np.cumsum(sizes), np.linspace(0, sizes.sum(), n_parts + 1)[1:-1], side="right")
+    bounds = np.unique(np.concatenate([[0], bounds, [len(blocks)]]))
+    return [blocks[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+def write_feature_part(path, unit, gene_names, blocks, pairs=None, seq_features=None):
+    """
+    Compute the features of a run of triplet blocks and write them as one Parquet part.
+    With pairs (pre-screened lncRNA x mRNA pairs) blocks without an allowed pair are
+    skipped and the rest keep only their allowed pairs. Returns the rows written.
+    """
+    with FeatureStoreWriter(path, FEATURE_COLUMNS, gene_names) as store:
+        for mir, lnc_idx, mrna_idx in blocks:
+            keep = None
+            if pairs is not None:
+                keep = pair_mask(pairs, lnc_idx, mrna_idx)
+                if not keep.any():
+                    continue
+            with phase("correlation"):
+                block = mirna_block_features(unit, mir, lnc_idx, mrna_idx)
+            with phase("writing"):
+                store.write(block_feature_columns(mir, lnc_idx, mrna_idx, block, keep, seq_features))
+    return store.num_rows
+
+# Worker-side state: the standardized expression matrix in shared memory, plus the
+# read-only inputs every part needs (inherited under fork, pickled once otherwise)
+_worker_shm = None
+_worker_unit = None
+_worker_inputs = None
+
+def _attach_shared_unit(shm_name, shape, gene_names, pairs, seq_features):
+    """Pool initializer: map the shared standardized matrix without copying it"""
+    global _worker_shm, _worker_unit, _worker_inputs
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_unit = np.ndarray(shape, dtype=np.float64, buffer=_worker_shm.buf)
+    _worker_inputs = (gene_names, pairs, seq_features)
+    # One BLAS thread per worker process; the pool itself provides the parallelism
+    threadpool_limits(1)
+
+def _write_worker_part(task):
+    """Build and encode one part entirely in a worker; only its row count returns"""
+    path, blocks = task
+    gene_names, pairs, seq_features = _worker_inputs
+    return write_feature_part(path, _worker_unit, gene_names, blocks, pairs, seq_features)
+
+def write_feature_store(path, unit, gene_names, mir_lnc, mir_mrna, threads=1, pairs=None, seq_features=None):
+    """
+    Compute every triplet's features into a partitioned feature store at path.
+    The triplet blocks are split into contiguous parts of at most about one row group,
+    and with threads > 1 into at least PARTS_PER_WORKER parts per worker; each worker
+    computes, builds and zstd-encodes whole parts into their own files, so the parent
+    only plans parts and collects row counts. The standardized matrix is copied into
+    shared memory once and mapped by every worker. The store is built in a temporary
+    directory and swapped in. Returns the row count.
+    """
+    # Blocks no larger than a part's share of the work, but never splitting a miRNA's
+    # mRNA targets, so triplets stay lncRNA-major whatever the thread count
+    total = int(np.dot(mir_lnc.getnnz(axis=1).astype(np.int64), mir_mrna.getnnz(axis=1)))
+    n_parts = max(-(-total // ROW_GROUP_SIZE), 1 if threads <= 1 else threads * PARTS_PER_WORKER)
+    max_mrna = int(mir_mrna.getnnz(axis=1).max()) if mir_mrna.nnz else 1
+    chunk_size = min(TRIPLET_CHUNK_SIZE, max(max_mrna, -(-total // n_parts)))
+    with phase("triplet_enumeration"):
+        blocks = list(iter_triplet_blocks(mir_lnc, mir_mrna, chunk_size))
+        parts = plan_parts(blocks, n_parts)
+    count("feature_parts", len(parts))
+
+    tmp_dir = f"{path}.{os.getpid()}.tmp"
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    tasks = [(part_path(tmp_dir, i), part) for i, part in enumerate(parts)]
+    if threads <= 1 or len(tasks) == 1:
+        num_rows = sum(write_feature_part(p, unit, gene_names, part, pairs, seq_features) for p, part in tasks)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=max(unit.nbytes, 1))
+        try:
+            np.ndarray(unit.shape, dtype=np.float64, buffer=shm.buf)[:] = unit
+            ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else mp.get_context()
+            workers = min(threads, len(tasks))
+            with ctx.Pool(workers, initializer=_attach_shared_unit,
+                          initargs=(shm.name, unit.shape, gene_names, pairs, seq_features)) as pool:
+                chunksize = max(1, len(tasks) // (workers * PARTS_PER_WORKER))
+                with phase("workers"):
+                    num_rows = sum(pool.imap_unordered(_write_worker_part, tasks, chunksize=chunksize))
+        finally:
+            shm.close()
+            shm.unlink()
+    replace_store(tmp_dir, path)
+    return num_rows
+
+def configured_threads():
+    """Thread budget: the rule's threads under Snakemake, otherwise all available cores"""
+    try:
+        return int(snakemake.threads)
+    except NameError:
+        return os.cpu_count() or 1
+
+def feature_engineering_main(threads=None):
+    # Load config parameters
+    cfg_path = "config/config.yaml"
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r") as f:
+            cfg = yaml.safe_load(f)
+    else:
+        cfg = {}
+
+    if threads is None:
+        threads = configured_threads()
+    paths = stage_paths(stage_inputs(cfg), OUTPUTS)
+
+    print("Loading normalized expression data...")
+    norm_counts = open_expression_matrix(os.path.splitext(paths["counts"])[0])
+    genes = norm_counts.genes
+    count("input_genes", len(genes))
+
+    # Candidate interactions: pruned by the prescreen stage when its candidate file
+    # exists, otherwise every database-supported triplet
+    pairs = None
+    if os.path.exists(paths["prescreen"]):
+        print(f"Loading pre-screened candidates from {paths['prescreen']}...")
+        with phase("load_candidates"):
+            mir_mrna, mir_lnc, pairs = load_candidates(paths["prescreen"], len(genes))
+        count("input_mirna_mrna_pairs", mir_mrna.nnz)
+        count("input_mirna_lncrna_pairs", mir_lnc.nnz)
+    else:
+        mir_mrna, mir_lnc = build_incidences(cfg, genes, paths)
+
+    n_mirnas = np.count_nonzero(mir_mrna.getnnz(axis=1) + mir_lnc.getnnz(axis=1))
+    print(f"Number of miRNAs: {n_mirnas}")
+    print(f"Number of mRNAs: {np.count_nonzero(mir_mrna.getnnz(axis=0))}")
+    print(f"Number of lncRNAs: {np.count_nonzero(mir_lnc.getnnz(axis=0))}")
+
+    # Seed-site counts, duplex energies and localization from local sequence files
+    with phase("sequence_features"):
+        seq_features = sequence_features(cfg, paths, genes, mir_lnc, mir_mrna, threads)
+    if seq_features is None:
+        print("No transcript/miRNA FASTA or localization table; sequence features left empty")
+
+    # Standardize the expression matrix once; every r below is a dot product
+    with phase("standardize"):
+        unit = standardize_rows(norm_counts.values)
+    gene_names = genes.to_numpy()
+
+    # Triplets: (lncRNA, miRNA, mRNA) where miRNA targets both lncRNA and mRNA,
+    # consumed block by block from the incidence matrices and written straight
+    # to the columnar feature store
+    print(f"Computing triplet features with {threads} worker process(es)...")
+    features_path = paths["features"]
+    num_rows = write_feature_store(features_path, unit, gene_names, mir_lnc, mir_mrna, threads, pairs, seq_features)
+    count("output_rows", num_rows)
+    print(f"Total candidate triplets: {num_rows}")
+    print(f"Feature engineering completed and saved to {features_path}")
 
 if __name__ == "__main__":
-    feature_engineering_main()
\ No newline at end of file
+    run_stage("feature_engineering", cached("feature_engineering", feature_engineering_main, stage_inputs,
+                                            OUTPUTS, CONFIG_KEYS,
+                                            modules=["expression_matrix.py", "feature_store.py",
+                                                     "interaction_index.py", "id_resolver.py",
+                                                     "sequence_index.py", "sequence_features.py"]))
\ No newline at end of file
@@ -0,0 +1,150 @@
+# modules/feature_store.py
+
+import os
+import shutil
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Triplet identifier columns; stored dictionary-encoded, everything else as float32
+ID_COLUMNS = ["lncRNA", "miRNA", "mRNA"]
+
+# Rows per Parquet row group (the unit downstream stages read back)
+ROW_GROUP_SIZE = 1_000_000
+
+# Part files of a partitioned store directory, numbered in row order
+PART_TEMPLATE = "part-{:05d}.parquet"
+
+def feature_schema(columns):
+    """Arrow schema for a feature store: dictionary-encoded IDs, float32 features"""
+    fields = []
+    for col in columns:
+        if col in ID_COLUMNS:
+            fields.append(pa.field(col, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(col, pa.float32()))
+    return pa.schema(fields)
+
+class FeatureStoreWriter:
+    """
+    Incrementally write feature blocks to a Parquet file.
+    Blocks are buffered until row_group_size rows are pending and then flushed as one
+    row group, so memory holds at most one row group regardless of the total row count.
+    ID columns are written as integer indices into names; each row group stores only
+    the names it uses as its dictionary.
+    """
+
+    def __init__(self, path, columns, names, row_group_size=ROW_GROUP_SIZE):
+        self.path = path
+        self.columns = list(columns)
+        self.names = np.asarray(names, dtype=object)
+        self.schema = feature_schema(self.columns)
+        self.row_group_size = row_group_size
+        self.num_rows = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, block):
+        """Queue a block: {column: array}, ID columns as indices into names"""
+        n_rows = len(block[self.columns[0]])
+        if n_rows == 0:
+            return
+        self._pending.append(block)
+        self._pending_rows += n_rows
+        if self._pending_rows >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        arrays = []
+        for col in self.columns:
+            values = np.concatenate([np.asarray(block[col]) for block in self._pending])
+            if col in ID_COLUMNS:
+                used, codes = np.unique(values, return_inverse=True)
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    pa.array(codes.astype(np.int32), pa.int32()), pa.array(self.names[used], pa.string())))
+            else:
+                arrays.append(pa.array(values.astype(np.float32, copy=False), pa.float32()))
+        table = pa.Table.from_arrays(arrays, schema=self.schema)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self.num_rows += self._pending_rows
+        self._pending = []
+        self._pending_rows = 0
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def part_path(store_dir, part):
+    """Path of part file number part in a partitioned store directory"""
+    return os.path.join(store_dir, PART_TEMPLATE.format(part))
+
+def replace_store(tmp_path, path):
+    """Swap a fully written store (file or part directory) in for path"""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    os.replace(tmp_path, path)
+
+def store_files(path):
+    """
+    Parquet files of a feature store in row order: the file itself, or the part files
+    of a partitioned store directory (written in parallel, one per worker task).
+    """
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.startswith("part-") and name.endswith(".parquet")]
+    return [path]
+
+def _row_group_locations(path):
+    """(file, row group within file) of every row group, in store order"""
+    return [(f, rg) for f in store_files(path) for rg in range(pq.ParquetFile(f).num_row_groups)]
+
+def store_columns(path):
+    """All column names in a feature store"""
+    return pq.read_schema(store_files(path)[0]).names
+
+def store_feature_columns(path):
+    """Numeric feature column names (everything except the triplet IDs)"""
+    return [c for c in store_columns(path) if c not in ID_COLUMNS]
+
+def store_num_rows(path):
+    """Number of triplets in a feature store, from the footers only"""
+    return sum(pq.ParquetFile(f).metadata.num_rows for f in store_files(path))
+
+def store_num_row_groups(path):
+    """Number of row groups (fixed-size partitions) in a feature store, over all its files"""
+    return sum(pq.ParquetFile(f).num_row_groups for f in store_files(path))
+
+def iter_feature_batches(path, columns=None, batch_size=ROW_GROUP_SIZE):
+    """Yield DataFrames of at most batch_size rows, reading only the requested columns"""
+    for f in store_files(path):
+        pf = pq.ParquetFile(f)
+        for batch in pf.iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+
+def read_features(path, columns=None, row_groups=None):
+    """
+    Read the requested columns (and optionally only some row groups, numbered over the
+    whole store) into one DataFrame
+    """
+    locations = _row_group_locations(path)
+    if row_groups is None:
+        row_groups = range(len(locations))
+    row_groups = list(row_groups)
+    if not row_groups:
+        table = pq.ParquetFile(store_files(path)[0]).schema_arrow.empty_table()
+        return table.select(columns).to_pandas() if columns else table.to_pandas()
+    tables = [pq.ParquetFile(f).read_row_group(rg, columns=columns)
+              for f, rg in (locations[i] for i in row_groups)]
+    # Row groups of different parts carry different dictionaries
+    return pa.concat_tables(tables).unify_dictionaries().to_pandas()
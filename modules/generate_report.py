@@ -1,70 +1,181 @@
 # modules/generate_report.py
 
+import base64
+import gzip
+import numpy as np
 import pandas as pd
-import networkx as nx
 import plotly.graph_objects as go
-from plotly.offline import plot
+from plotly.offline import get_plotlyjs, plot
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 import os
+import yaml
+
+from network_analysis import build_network
+from network_layout import cached_layout
+from instrumentation import count, phase, run_stage
+from stage_cache import cached
+from stage_io import stage_paths
+
+TEMPLATE_DIR = "templates"
+TEMPLATE_NAME = "report_template.html"
+
+# Named stage files (Snakemake rule input/output names) with their standalone paths
+INPUTS = {
+    "triplets": "results/validated_triplets.csv",
+    "centrality": "results/centrality_scores.csv",
+    "template": os.path.join(TEMPLATE_DIR, TEMPLATE_NAME),
+}
+OUTPUTS = {"report": "results/cerna_analysis_report.html"}
+# Config keys that change the report (stage cache)
+CONFIG_KEYS = ["random_seed", "report_label_top_n", "report_max_network_edges", "report_max_table_rows",
+               "report_page_size"]
+
+# Size budgets that keep the report roughly constant as the triplet count grows
+MAX_TABLE_ROWS = 100_000
+MAX_NETWORK_EDGES = 50_000
+TABLE_PAGE_SIZE = 50
+
+def network_figure(genes, edges, pos, centrality, label_top_n=20):
+    """
+    WebGL network plot: one Scattergl trace for all edges (NaN-separated segments),
+    one for the nodes coloured by degree, and text labels for the top hubs only.
+    """
+    segments = np.full((len(edges), 3, 2), np.nan)
+    segments[:, 0] = pos[edges['u'].to_numpy()]
+    segments[:, 1] = pos[edges['v'].to_numpy()]
+    segments = segments.reshape(-1, 2)
+    edge_trace = go.Scattergl(x=segments[:, 0], y=segments[:, 1], line=dict(width=0.5, color='#888'),
+                              hoverinfo='none', mode='lines')
+
+    degree = centrality.set_index('gene')['degree_centrality'].reindex(genes).fillna(0).to_numpy()
+    node_trace = go.Scattergl(x=pos[:, 0], y=pos[:, 1], mode='markers', hovertext=np.asarray(genes, dtype=str),
+                              hoverinfo='text',
+                              marker=dict(size=8, color=degree, showscale=True, colorscale='YlGnBu',
+                                          colorbar=dict(thickness=15, title='Degree centrality', xanchor='left')))
+
+    # Gene name labels for the best-connected hubs; rendering every label does not scale
+    hubs = centrality[centrality['gene'].isin(genes)]
+    hubs = hubs.sort_values('degree_centrality', ascending=False)['gene'].head(label_top_n)
+    hub_pos = pos[genes.get_indexer(hubs)]
+    label_trace = go.Scatter(x=hub_pos[:, 0], y=hub_pos[:, 1], mode='text', text=hubs.to_numpy(),
+                             textposition='top center', hoverinfo='skip')
+
+    return go.Figure(data=[edge_trace, node_trace, label_trace],
+                     layout=go.Layout(showlegend=False, hovermode='closest', margin=dict(b=20, l=5, r=5, t=40),
+                                      xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+                                      yaxis=dict(showgrid=False, zeroline=False, showticklabels=False)))
+
+def hub_subnetwork(genes, edges, pos, centrality, max_edges=MAX_NETWORK_EDGES):
+    """
+    Restrict the plotted network to at most max_edges edges, keeping those between
+    the best-connected genes (ranked by summed endpoint degree centrality).
+    Returns (genes, edges, pos) with edge codes re-indexed to the kept genes.
+    """
+    if len(edges) <= max_edges:
+        return genes, edges, pos
+    degree = centrality.set_index('gene')['degree_centrality'].reindex(genes).fillna(0).to_numpy()
+    rank = degree[edges['u'].to_numpy()] + degree[edges['v'].to_numpy()]
+    kept = edges.iloc[np.argsort(-rank, kind='stable')[:max_edges]]
+    used, codes = np.unique(np.concatenate([kept['u'], kept['v']]), return_inverse=True)
+    kept = kept.assign(u=codes[:len(kept)], v=codes[len(kept):])
+    return genes[used], kept, pos[used]
+
+def degree_figure(centrality, n_genes):
+    """Number of genes per node degree"""
+    degree = np.rint(centrality['degree_centrality'].to_numpy() * max(n_genes - 1, 1)).astype(np.int64)
+    counts = np.bincount(degree) if len(degree) else np.zeros(0, dtype=np.int64)
+    present = np.flatnonzero(counts)
+    fig = go.Figure(go.Bar(x=present, y=counts[present], marker_color='skyblue'))
+    fig.update_layout(xaxis_title='Degree', yaxis_title='Genes', yaxis_type='log', margin=dict(t=20))
+    return fig
+
+def top_triplets_figure(validated, top_n=20):
+    """Highest-scoring triplets by sensitivity correlation (ML score if absent)"""
+    column = 'sensitivity' if 'sensitivity' in validated.columns else 'score'
+    top = validated.loc[pd.to_numeric(validated[column], errors='coerce').nlargest(top_n).index]
+    labels = top['lncRNA'].astype(str) + ' / ' + top['miRNA'].astype(str) + ' / ' + top['mRNA'].astype(str)
+    fig = go.Figure(go.Bar(x=top[column], y=labels, orientation='h', marker_color='skyblue'))
+    fig.update_layout(xaxis_title=column, yaxis=dict(autorange='reversed'), margin=dict(t=20, l=250))
+    return fig
+
+def encode_table(df):
+    """Compact table payload: split-orient JSON, gzip-compressed, base64 text"""
+    payload = df.to_json(orient='split', index=False, double_precision=6)
+    return base64.b64encode(gzip.compress(payload.encode('utf-8'), compresslevel=6)).decode('ascii')
+
+def figure_div(fig):
+    """Figure markup without the Plotly library (the template includes it once)"""
+    return plot(fig, output_type='div', include_plotlyjs=False)
 
 def main():
-    validated_path = "results/validated_triplets.csv"
-    network_path = "results/cerna_network.graphml"
-    report_path = "results/cerna_analysis_report.html"
+    cfg_path = "config/config.yaml"
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r") as f:
+            cfg = yaml.safe_load(f)
+    else:
+        cfg = {}
+
+    paths = stage_paths(INPUTS, OUTPUTS)
+    validated_path = paths["triplets"]
+    centrality_path = paths["centrality"]
+    report_path = paths["report"]
 
     # Load validated triplets
     validated = pd.read_csv(validated_path)
+    count("input_rows", len(validated))
 
-    # Load network
-    G = nx.read_graphml(network_path)
-
-    # Generate interactive network visualization with gene names as labels
-    pos = nx.spring_layout(G)
-    edge_x = []
-    edge_y = []
-    for edge in G.edges():
-        x0, y0 = pos[edge[0]]
-        x1, y1 = pos[edge[1]]
-        edge_x.extend([x0, x1, None])
-        edge_y.extend([y0, y1, None])
-
-    edge_trace = go.Scatter(x=edge_x, y=edge_y, line=dict(width=0.5, color='#888'), hoverinfo='none', mode='lines')
-
-    node_x = []
-    node_y = []
-    node_text = []
-    for node in G.nodes():
-        x, y = pos[node]
-        node_x.append(x)
-        node_y.append(y)
-        node_text.append(node)  # Gene name as label
-
-    node_trace = go.Scatter(x=node_x, y=node_y, mode='markers+text', text=node_text, textposition='top center',
-                            hoverinfo='text', marker=dict(size=10, color='skyblue'))  # Simplified marker without colorbar
-
-    fig = go.Figure(data=[edge_trace, node_trace], layout=go.Layout(showlegend=False, hovermode='closest', margin=dict(b=20, l=5, r=5, t=40), xaxis=dict(showgrid=False, zeroline=False, showticklabels=False), yaxis=dict(showgrid=False, zeroline=False, showticklabels=False)))
-    
-    # Embed full Plotly JS
-    network_html = plot(fig, output_type='div', include_plotlyjs=True)
-
-    # Generate HTML report
-    html_content = """
-    <html>
-    <head><title>ceRNA Analysis Report</title></head>
-    <body>
-    <h1>ceRNA Analysis Report</h1>
-    <h2>Validated Triplets</h2>
-    {table}
-    <h2>ceRNA Network</h2>
-    {network}
-    </body>
-    </html>
-    """
-    table_html = validated.to_html(index=False)
-    full_html = html_content.format(table=table_html, network=network_html)
+    # Rebuild the network from the triplets (the same table network_analysis exported);
+    # cheaper than parsing GraphML for large networks
+    with phase("build_network"):
+        genes, edges, _ = build_network(validated)
+    centrality = pd.read_csv(centrality_path, dtype={'gene': str})
+
+    # Force layout, reused across runs while the network is unchanged
+    print(f"Laying out {len(genes)} genes and {len(edges)} edges...")
+    with phase("layout"):
+        pos = cached_layout(genes, edges['u'].to_numpy(), edges['v'].to_numpy(), seed=cfg.get("random_seed", 42))
+
+    # Generate interactive network visualization with hub gene names as labels
+    max_edges = int(cfg.get("report_max_network_edges", MAX_NETWORK_EDGES))
+    plot_genes, plot_edges, plot_pos = hub_subnetwork(genes, edges, pos, centrality, max_edges)
+    network_note = ""
+    if len(plot_edges) < len(edges):
+        network_note = (f"Showing the {len(plot_edges)} edges between the best-connected genes "
+                        f"({len(edges)} in total; see results/cerna_network.graphml).")
+    fig = network_figure(plot_genes, plot_edges, plot_pos, centrality, int(cfg.get("report_label_top_n", 20)))
+
+    # Triplet table payload, decoded and paginated in the browser
+    max_rows = int(cfg.get("report_max_table_rows", MAX_TABLE_ROWS))
+    table_note = ""
+    if len(validated) > max_rows:
+        table_note = f"Showing the first {max_rows} of {len(validated)} triplets; see {validated_path} for all."
+
+    with phase("figures"):
+        context = {
+            "plotly_js": get_plotlyjs(),
+            "num_triplets": len(validated),
+            "network_summary": {
+                "num_nodes": len(genes),
+                "num_edges": len(edges),
+                "num_lncRNA": validated['lncRNA'].nunique(),
+                "num_miRNA": validated['miRNA'].nunique(),
+                "num_mRNA": validated['mRNA'].nunique(),
+            },
+            "network_note": network_note,
+            "network_div": figure_div(fig),
+            "degree_dist_div": figure_div(degree_figure(centrality, len(genes))),
+            "top_triplets_div": figure_div(top_triplets_figure(validated)),
+            "table_note": table_note,
+            "triplets_b64": encode_table(validated.head(max_rows)),
+            "page_size": int(cfg.get("report_page_size", TABLE_PAGE_SIZE)),
+        }
 
-    with open(report_path, "w") as f:
-        f.write(full_html)
+    # Render the template straight to disk, chunk by chunk
+    with phase("render"):
+        env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(["html"]))
+        env.get_template(TEMPLATE_NAME).stream(**context).dump(report_path, encoding="utf-8")
     print(f"Report generated at {report_path}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_stage("generate_report", cached("generate_report", main, INPUTS, OUTPUTS, CONFIG_KEYS,
+                                        modules=["network_analysis.py", "network_layout.py"]))
@@ -0,0 +1,274 @@
+# modules/id_resolver.py
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+from interaction_index import file_checksum
+
+LOOKUP_VERSION = 2
+ANNOTATION_FILE = "databases/gene_annotation.csv"
+ALIAS_FILE = "databases/id_aliases.tsv"
+
+MIRNA_BIOTYPES = ("miRNA",)
+
+def default_lookup_dir(annotation_path=ANNOTATION_FILE):
+    """databases/gene_annotation.csv -> databases/gene_annotation.ids.index"""
+    return os.path.splitext(annotation_path)[0] + ".ids.index"
+
+def strip_ensembl_version(names):
+    """ENSG00000142611.17 -> ENSG00000142611 (other names unchanged)"""
+    return names.str.replace(r'^(ENS\w*[GT]\d+)\.\d+$', r'\1', regex=True)
+
+def canonical_mirna_names(names):
+    """
+    Rewrite miRNA spellings to miRBase style, vectorized:
+      MIR21 / hsa-mir-21 / miR-21 -> hsa-miR-21,  MIR181A1 -> hsa-miR-181a-1,
+      MIRLET7A1 -> hsa-let-7a-1,  hsa-mir-21-5p -> hsa-miR-21-5p.
+    Names that are not miRNA-like are returned unchanged.
+    """
+    names = pd.Series(names, dtype=object).astype(str)
+    out = names.copy()
+
+    # HGNC gene symbols: MIR<number><letter?><copy?>, MIRLET7<letter><copy?>
+    hgnc = names.str.extract(r'^MIR(LET)?(\d+)([A-Z]?)(\d*)(?:-(\d+))?$')
+    is_hgnc = hgnc[1].notna()
+    if is_hgnc.any():
+        h = hgnc[is_hgnc].fillna('')
+        family = np.where(h[0] == 'LET', 'let', 'miR')
+        copy = h[3].where(h[3] != '', h[4])
+        out[is_hgnc] = ('hsa-' + pd.Series(family, index=h.index) + '-' + h[1] + h[2].str.lower()
+                        + np.where(copy != '', '-' + copy, ''))
+
+    # miRBase-like spellings with a missing species prefix or precursor-style casing
+    mirbase = names.str.extract(r'^(?:hsa-)?(mir|miR|MIR|let|Let)-(.+)$')
+    is_mirbase = mirbase[0].notna() & ~is_hgnc
+    if is_mirbase.any():
+        m = mirbase[is_mirbase]
+        family = np.where(m[0].str.lower() == 'let', 'let', 'miR')
+        out[is_mirbase] = 'hsa-' + pd.Series(family, index=m.index) + '-' + m[1]
+    return out
+
+def mirna_locus_names(names):
+    """
+    Precursor locus of miRNA names, shared by a precursor and its mature arms:
+      hsa-miR-21-5p / hsa-miR-21-3p / hsa-mir-21 / MIR21 -> hsa-miR-21,
+      hsa-miR-181a-5p / MIR181A1 / hsa-mir-181a-2 -> hsa-miR-181a.
+    Names are canonicalized first (canonical_mirna_names), then the arm (-5p, -3p, *)
+    and the precursor copy number are dropped. Non-miRNA names are returned unchanged.
+    """
+    names = canonical_mirna_names(names)
+    is_mirna = names.str.match(r'^hsa-(?:miR|let)-')
+    loci = names[is_mirna].str.replace(r'(?:-[35]p)?\*?$', '', regex=True)
+    loci = loci.str.replace(r'^(hsa-(?:miR|let)-\d+[a-z]*)-\d+$', r'\1', regex=True)
+    out = names.copy()
+    out[is_mirna] = loci
+    return out
+
+def is_mature_arm(names):
+    """True for arm-specific miRNA names (-5p, -3p or * suffix)"""
+    return pd.Series(names, dtype=object).astype(str).str.contains(r'^hsa-(?:miR|let)-.*(?:-[35]p|\*)$', regex=True)
+
+def mirna_locus_matches(names, genes):
+    """
+    Link miRNA names to the precursor-level miRNA rows of genes at the same locus.
+    When the counts only carry MIR21 / hsa-mir-21, the database side collapses: the
+    hsa-miR-21-5p and -3p entries both link to that row. A mature name links to every
+    precursor copy of its locus (hsa-miR-181a-5p to hsa-mir-181a-1 and -2). Arm-specific
+    rows in genes are never targets of the fallback, so they stay arm-specific.
+    Returns (positions in names, rows of genes) arrays of the links.
+    """
+    genes = pd.Series(pd.Index(genes).astype(str))
+    precursor = np.flatnonzero(genes.str.match(r'^hsa-(?:miR|let)-').to_numpy()
+                               & ~is_mature_arm(genes).to_numpy() & ~genes.duplicated().to_numpy())
+    by_locus = pd.DataFrame({"locus": mirna_locus_names(genes.iloc[precursor]).to_numpy(), "row": precursor})
+    wanted = pd.DataFrame({"locus": mirna_locus_names(pd.Index(names).astype(str)).to_numpy(),
+                           "position": np.arange(len(names))})
+    links = wanted.merge(by_locus, on="locus")
+    return links["position"].to_numpy(), links["row"].to_numpy()
+
+def _read_annotation(path):
+    if path.endswith('.parquet'):
+        ann = pd.read_parquet(path, columns=['gene_id', 'gene_name', 'gene_biotype'])
+    else:
+        ann = pd.read_csv(path, usecols=['gene_id', 'gene_name', 'gene_biotype'], dtype=str)
+    return ann.fillna('').astype(str)
+
+def _read_aliases(path):
+    """Local alias table: tab-separated alias, canonical (extra columns ignored)"""
+    aliases = pd.read_csv(path, sep='\t', dtype=str, comment='#').iloc[:, :2].dropna()
+    aliases.columns = ['alias', 'canonical']
+    return aliases.apply(lambda col: col.str.strip())
+
+def _source_stamp(path):
+    """Checksum plus the size and mtime it was taken at"""
+    stat = os.stat(path)
+    return {"sha256": file_checksum(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def _sources(annotation_path, alias_path):
+    sources = [annotation_path]
+    if alias_path and os.path.exists(alias_path):
+        sources.append(alias_path)
+    return sources
+
+def build_id_lookup(annotation_path=ANNOTATION_FILE, alias_path=ALIAS_FILE, lookup_dir=None):
+    """
+    Precompute the alias -> canonical ID table.
+    The canonical ID of a gene is its annotated symbol (version-less Ensembl ID when it
+    has none); miRNA genes use the miRBase spelling (MIR21 -> hsa-miR-21). Keys are
+    Ensembl IDs, symbols, upper-cased symbols, miRBase spellings and the alias table,
+    which wins over the annotation for any key it lists.
+    """
+    lookup_dir = lookup_dir or default_lookup_dir(annotation_path)
+    print(f"Building identifier lookup from {annotation_path} ...")
+    ann = _read_annotation(annotation_path)
+    gene_ids = strip_ensembl_version(ann['gene_id'])
+    canonical = ann['gene_name'].where(ann['gene_name'] != '', gene_ids)
+    is_mirna = ann['gene_biotype'].isin(MIRNA_BIOTYPES) & (ann['gene_name'] != '')
+    canonical[is_mirna] = canonical_mirna_names(canonical[is_mirna]).to_numpy()
+
+    named = ann['gene_name'] != ''
+    keys = pd.concat([
+        pd.DataFrame({'key': gene_ids, 'canonical': canonical}),
+        pd.DataFrame({'key': ann['gene_name'][named], 'canonical': canonical[named]}),
+        pd.DataFrame({'key': ann['gene_name'][named].str.upper(), 'canonical': canonical[named]}),
+        pd.DataFrame({'key': canonical, 'canonical': canonical}),
+    ], ignore_index=True)
+    # First annotation entry wins for symbols shared by several Ensembl genes
+    keys = keys.drop_duplicates('key', keep='first')
+
+    if alias_path and os.path.exists(alias_path):
+        aliases = _read_aliases(alias_path)
+        # Aliases may point at any known spelling; chase them to the canonical ID
+        by_key = keys.set_index('key')['canonical']
+        target = by_key.reindex(aliases['canonical']).to_numpy()
+        target = np.where(pd.isna(target), aliases['canonical'].to_numpy(), target)
+        alias_keys = pd.DataFrame({'key': aliases['alias'].to_numpy(), 'canonical': target})
+        alias_keys = pd.concat([alias_keys, alias_keys.assign(key=alias_keys['key'].str.upper())])
+        keys = pd.concat([alias_keys, keys], ignore_index=True).drop_duplicates('key', keep='first')
+        print(f"Applied {len(aliases)} aliases from {alias_path}")
+
+    codes, vocabulary = pd.factorize(keys['canonical'], sort=True)
+
+    tmp_dir = f"{lookup_dir}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    _write_names(os.path.join(tmp_dir, "keys.txt"), keys['key'])
+    _write_names(os.path.join(tmp_dir, "canonical.txt"), vocabulary)
+    np.save(os.path.join(tmp_dir, "codes.npy"), codes.astype(np.int32))
+    meta = {
+        "version": LOOKUP_VERSION,
+        "sources": {os.path.abspath(p): _source_stamp(p) for p in _sources(annotation_path, alias_path)},
+        "n_keys": len(keys),
+        "n_canonical": len(vocabulary),
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.isdir(lookup_dir):
+        shutil.rmtree(lookup_dir)
+    os.replace(tmp_dir, lookup_dir)
+    print(f"Indexed {len(keys)} identifiers onto {len(vocabulary)} canonical IDs in {lookup_dir}")
+    return lookup_dir
+
+def lookup_is_current(annotation_path, alias_path, lookup_dir, refresh_stat=False):
+    """
+    True if lookup_dir was built from the current annotation and alias files.
+    Like interaction_index.index_is_current, size and mtime are compared first and a
+    file is only re-hashed when they differ; with refresh_stat (download_databases
+    only) a re-copied but unchanged file has its new size and mtime recorded.
+    """
+    meta_path = os.path.join(lookup_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    if meta.get("version") != LOOKUP_VERSION:
+        return False
+    sources = _sources(annotation_path, alias_path)
+    if sorted(meta["sources"]) != sorted(os.path.abspath(p) for p in sources):
+        return False
+    restamped = False
+    for p in sources:
+        recorded = meta["sources"][os.path.abspath(p)]
+        stat = os.stat(p)
+        if stat.st_size == recorded["size"] and stat.st_mtime_ns == recorded["mtime_ns"]:
+            continue
+        if file_checksum(p) != recorded["sha256"]:
+            return False
+        recorded["size"], recorded["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+        restamped = True
+    if restamped and refresh_stat:
+        # Other processes may be reading meta.json; swap the update in atomically
+        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, meta_path)
+    return True
+
+def _write_names(path, names):
+    with open(path, "w") as f:
+        for name in names:
+            f.write(f"{name}\n")
+
+def _read_names(path):
+    with open(path, "r") as f:
+        return pd.Index([line.rstrip("\n") for line in f])
+
+class IdResolver:
+    """
+    Vectorized mapping of gene/miRNA identifiers onto canonical IDs.
+    Lookups are hash-index probes over whole arrays: exact spelling first, then the
+    normalized spelling (Ensembl version stripped, miRBase casing, upper-cased symbol).
+    """
+
+    def __init__(self, keys, codes, canonical):
+        self.keys = keys
+        self.codes = codes
+        self.canonical = canonical
+
+    def _probe(self, names):
+        pos = self.keys.get_indexer(names)
+        found = pos >= 0
+        out = np.full(len(pos), None, dtype=object)
+        out[found] = self.canonical.to_numpy()[self.codes[pos[found]]]
+        return out
+
+    def resolve(self, names, keep_unresolved=True):
+        """
+        Canonical ID for every name. Unresolved names are kept as they are
+        (keep_unresolved=True) or returned as None.
+        """
+        names = pd.Series(np.asarray(names, dtype=object)).astype(str)
+        out = self._probe(names)
+        for normalize in (strip_ensembl_version, canonical_mirna_names, lambda s: s.str.upper()):
+            missing = pd.isna(out)
+            if not missing.any():
+                break
+            out[missing] = self._probe(normalize(names[missing]))
+        missing = pd.isna(out)
+        if keep_unresolved and missing.any():
+            # Still canonicalize miRNA spellings so both sides of a join agree
+            out[missing] = canonical_mirna_names(names[missing]).to_numpy()
+        return pd.Index(out)
+
+    def resolve_index(self, df):
+        """
+        Re-key a genes x samples DataFrame on canonical IDs; rows collapsing onto an
+        ID already present are dropped (first kept). Returns (frame, n_dropped).
+        """
+        index = self.resolve(df.index).rename(df.index.name)
+        keep = ~index.duplicated(keep='first')
+        return df.set_axis(index, axis=0)[keep], int((~keep).sum())
+
+def load_id_resolver(annotation_path=ANNOTATION_FILE, alias_path=ALIAS_FILE, lookup_dir=None):
+    """Open the precomputed lookup, rebuilding it first if the annotation or aliases changed"""
+    lookup_dir = lookup_dir or default_lookup_dir(annotation_path)
+    if not lookup_is_current(annotation_path, alias_path, lookup_dir):
+        build_id_lookup(annotation_path, alias_path, lookup_dir)
+    return IdResolver(
+        _read_names(os.path.join(lookup_dir, "keys.txt")),
+        np.load(os.path.join(lookup_dir, "codes.npy"), mmap_mode="r"),
+        _read_names(os.path.join(lookup_dir, "canonical.txt")),
+    )
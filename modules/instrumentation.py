@@ -0,0 +1,186 @@
+# modules/instrumentation.py
+
+import os
+import sys
+import json
+import time
+import datetime
+from contextlib import contextmanager
+
+from stage_io import stage_label
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRICS_DIR = "results/metrics"
+
+# Set by cerna_pipeline_main for every stage of one run
+RUN_ID_ENV = "CERNA_RUN_ID"
+# Comma-separated stage names to run under cProfile ("all" for every stage)
+PROFILE_ENV = "CERNA_PROFILE"
+
+# Metrics of the stage running in this process (None outside run_stage)
+_active = None
+
+def run_id():
+    """Identifier grouping the stages of one pipeline run"""
+    return os.environ.get(RUN_ID_ENV) or "adhoc"
+
+def new_run_id():
+    return datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+
+def run_metrics_dir(run=None, metrics_dir=METRICS_DIR):
+    return os.path.join(metrics_dir, run or run_id())
+
+def _profiled_stages():
+    value = os.environ.get(PROFILE_ENV, "")
+    return {s.strip() for s in value.split(",") if s.strip()}
+
+def _peak_rss_mb():
+    """Peak resident set size of this process and of its finished children (worker pools)"""
+    if resource is None:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # bytes on macOS, KiB elsewhere
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+def _cpu_seconds():
+    times = os.times()
+    return times.user + times.system, times.children_user + times.children_system
+
+class StageMetrics:
+    """Wall/CPU time, peak RSS, counters and accumulated phase timings of one stage"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.phases = {}
+        self.counts = {}
+        self.started = datetime.datetime.now().isoformat(timespec="seconds")
+        self._start_wall = time.perf_counter()
+        self._start_cpu = _cpu_seconds()
+
+    def add_phase_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def to_dict(self, status):
+        cpu, children_cpu = _cpu_seconds()
+        rss, children_rss = _peak_rss_mb()
+        return {
+            "run_id": run_id(),
+            "stage": self.stage,
+            "status": status,
+            "started": self.started,
+            "wall_s": time.perf_counter() - self._start_wall,
+            "cpu_s": cpu - self._start_cpu[0],
+            "children_cpu_s": children_cpu - self._start_cpu[1],
+            "peak_rss_mb": rss,
+            "children_peak_rss_mb": children_rss,
+            "counts": self.counts,
+            "phases": self.phases,
+        }
+
+@contextmanager
+def phase(name):
+    """Time a block as a named phase of the active stage; repeated entries accumulate"""
+    if _active is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _active.add_phase_time(name, time.perf_counter() - start)
+
+def timed_iter(iterable, name):
+    """Iterate while charging the time spent producing each item to a phase"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            if _active is not None:
+                _active.add_phase_time(name, time.perf_counter() - start)
+        yield item
+
+def count(name, value):
+    """Record a counter (e.g. input_rows, output_rows) for the active stage"""
+    if _active is not None:
+        _active.counts[name] = int(value)
+
+def run_stage(stage, main, *args, **kwargs):
+    """
+    Run a module's main() as an instrumented pipeline stage.
+    Writes results/metrics/<run_id>/<stage>.json (also when main raises) and, if the
+    stage is selected via CERNA_PROFILE, a cProfile dump plus a text summary.
+    In batch mode the stage name carries the cohort (<stage>.<cohort>).
+    """
+    global _active
+    out_dir = run_metrics_dir()
+    os.makedirs(out_dir, exist_ok=True)
+    profiled = stage in _profiled_stages() or "all" in _profiled_stages()
+    stage = stage_label(stage)
+    profiler = None
+    if profiled:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    _active = StageMetrics(stage)
+    status = "failed"
+    try:
+        if profiler is not None:
+            profiler.enable()
+        result = main(*args, **kwargs)
+        status = "ok"
+        return result
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _write_profile(profiler, os.path.join(out_dir, stage))
+        metrics = _active.to_dict(status)
+        _active = None
+        with open(os.path.join(out_dir, f"{stage}.json"), "w") as f:
+            json.dump(metrics, f, indent=2)
+        print(f"[{stage}] {status} in {metrics['wall_s']:.2f}s, peak RSS {metrics['peak_rss_mb'] or 0:.0f} MB")
+
+def _write_profile(profiler, prefix, top_n=40):
+    import pstats
+    profiler.dump_stats(f"{prefix}.prof")
+    with open(f"{prefix}.profile.txt", "w") as f:
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats("cumulative").print_stats(top_n)
+    print(f"Profile written to {prefix}.prof")
+
+def collect_run_metrics(run=None, metrics_dir=METRICS_DIR):
+    """
+    Merge the per-stage JSON files of a run into <metrics_dir>/<run_id>.json and a flat
+    <run_id>.csv (one row per stage and phase). Returns the list of stage records.
+    """
+    import pandas as pd
+
+    run = run or run_id()
+    stage_dir = run_metrics_dir(run, metrics_dir)
+    if not os.path.isdir(stage_dir):
+        return []
+    records = []
+    for name in sorted(os.listdir(stage_dir)):
+        if name.endswith(".json"):
+            with open(os.path.join(stage_dir, name), "r") as f:
+                records.append(json.load(f))
+    records.sort(key=lambda r: r.get("started") or "")
+    with open(os.path.join(metrics_dir, f"{run}.json"), "w") as f:
+        json.dump({"run_id": run, "stages": records}, f, indent=2)
+
+    rows = []
+    for r in records:
+        base = {k: r[k] for k in ("run_id", "stage", "status", "started", "wall_s", "cpu_s", "children_cpu_s",
+                                  "peak_rss_mb", "children_peak_rss_mb")}
+        base.update({f"count_{k}": v for k, v in r["counts"].items()})
+        rows.append(dict(base, phase="", phase_s=None))
+        rows.extend(dict(base, phase=p, phase_s=s) for p, s in r["phases"].items())
+    pd.DataFrame(rows).to_csv(os.path.join(metrics_dir, f"{run}.csv"), index=False)
+    return records
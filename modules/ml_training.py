@@ -1,49 +1,136 @@
 # modules/ml_training.py
 
-import pickle
-import pandas as pd
 import os
+import shutil
+import yaml
 
-from xgboost import XGBClassifier  # Assuming XGBoost; adjust if using another library
+import xgboost as xgb
 
-def main():
-    features_path = "results/features.pkl"
-    models_path = "results/models.pkl"
+from feature_store import ROW_GROUP_SIZE, iter_feature_batches, store_num_rows, store_feature_columns
+from instrumentation import count, phase, run_stage
+from stage_cache import cached
+from stage_io import stage_paths
 
-    # Load features
-    with open(features_path, "rb") as f:
-        features = pickle.load(f)
+# Native XGBoost model (UBJSON); an empty file means no model could be trained
+MODEL_PATH = "results/model.ubj"
 
-    print(f"Loaded {features.shape[0]} feature rows")
+# Named stage files (Snakemake rule input/output names) with their standalone paths
+INPUTS = {"features": "results/features.parquet"}
+OUTPUTS = {"model": MODEL_PATH}
+# Config keys that change the model (stage cache)
+CONFIG_KEYS = ["random_seed"]
+
+# Boosting rounds and label threshold of the former default XGBClassifier setup
+NUM_BOOST_ROUND = 100
+LABEL_THRESHOLD = 0.7
+
+class FeatureStoreIter(xgb.DataIter):
+    """
+    Feed the feature store to XGBoost one Parquet batch at a time.
+    XGBoost calls next() repeatedly and reset() between passes, so only one batch
+    of rows is held in memory; quantized pages are cached under cache_dir.
+    """
+
+    def __init__(self, path, columns, cache_dir, batch_size=ROW_GROUP_SIZE):
+        self._path = path
+        self._columns = columns
+        self._batch_size = batch_size
+        self._batches = None
+        super().__init__(cache_prefix=os.path.join(cache_dir, "train"))
+
+    def next(self, input_data):
+        if self._batches is None:
+            self._batches = iter_feature_batches(self._path, columns=self._columns, batch_size=self._batch_size)
+        batch = next(self._batches, None)
+        if batch is None:
+            return False
+        # Prepare labels (example; adjust threshold/column as needed)
+        label = (batch['sponge_score'] > LABEL_THRESHOLD).astype(int)
+        input_data(data=batch, label=label)
+        return True
+
+    def reset(self):
+        self._batches = None
+
+def external_memory_dmatrix(data_iter, threads):
+    """External-memory quantile DMatrix (XGBoost >= 3.0), or a paged DMatrix on older releases"""
+    if hasattr(xgb, "ExtMemQuantileDMatrix"):
+        return xgb.ExtMemQuantileDMatrix(data_iter, nthread=threads)
+    return xgb.DMatrix(data_iter, nthread=threads)
+
+def load_model(path=MODEL_PATH, threads=None):
+    """Load a saved Booster, or None for the empty placeholder"""
+    if os.path.getsize(path) == 0:
+        return None
+    booster = xgb.Booster(model_file=path)
+    if threads:
+        booster.set_param({"nthread": threads})
+    return booster
+
+def configured_threads():
+    """Thread budget: the rule's threads under Snakemake, otherwise all available cores"""
+    try:
+        return int(snakemake.threads)
+    except NameError:
+        return os.cpu_count() or 1
+
+def main(threads=None):
+    cfg_path = "config/config.yaml"
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r") as f:
+            cfg = yaml.safe_load(f)
+    else:
+        cfg = {}
+
+    if threads is None:
+        threads = configured_threads()
+
+    paths = stage_paths(INPUTS, OUTPUTS)
+    features_path = paths["features"]
+    models_path = paths["model"]
+
+    n_rows = store_num_rows(features_path)
+    print(f"Loaded {n_rows} feature rows")
+    count("input_rows", n_rows)
 
     # Handle empty features
-    if features.empty:
+    if n_rows == 0:
         print("No features available. Saving placeholder model.")
-        with open(models_path, "wb") as f:
-            pickle.dump(None, f)  # Placeholder for empty model
+        open(models_path, "wb").close()  # Placeholder for empty model
         return
 
-    # Prepare labels (example; adjust threshold/column as needed)
-    y = (features['sponge_score'] > 0.7).astype(int)  # Assuming 'sponge_score' exists
-
-    # Select only numeric columns for features (drop strings like 'lncRNA', 'miRNA', 'mRNA')
-    numeric_cols = features.select_dtypes(include=['int', 'float', 'bool']).columns
-    if len(numeric_cols) == 0:
+    # Only the numeric feature columns; triplet IDs are not needed for training
+    feature_cols = store_feature_columns(features_path)
+    if len(feature_cols) == 0:
         print("No numeric features found. Saving placeholder model.")
-        with open(models_path, "wb") as f:
-            pickle.dump(None, f)
+        open(models_path, "wb").close()
         return
 
-    X = features[numeric_cols]
+    # Stream the store through an external-memory DMatrix; memory stays bounded by one batch
+    cache_dir = os.path.join(os.path.dirname(models_path), ".xgb_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        with phase("build_dmatrix"):
+            dtrain = external_memory_dmatrix(FeatureStoreIter(features_path, feature_cols, cache_dir), threads)
 
-    # Train model
-    model = XGBClassifier()
-    model.fit(X, y)
+        # Train model
+        print(f"Training with {threads} thread(s)...")
+        params = {
+            "objective": "binary:logistic",
+            "tree_method": "hist",
+            "nthread": threads,
+            "seed": cfg.get("random_seed", 42),
+        }
+        with phase("train"):
+            booster = xgb.train(params, dtrain, num_boost_round=NUM_BOOST_ROUND)
+        del dtrain
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
 
-    # Save model
-    with open(models_path, "wb") as f:
-        pickle.dump(model, f)
+    # Save model in XGBoost's native format
+    booster.save_model(models_path)
     print(f"Model saved to {models_path}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_stage("ml_training", cached("ml_training", main, INPUTS, OUTPUTS, CONFIG_KEYS,
+                                    modules=["feature_store.py"]))
@@ -1,56 +1,320 @@
 # modules/network_analysis.py
 
-import pandas as pd
-import networkx as nx
 import os
+import yaml
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+from scipy import sparse
+from threadpoolctl import threadpool_limits
+
+from instrumentation import count, phase, run_stage
+from stage_cache import cached
+from stage_io import stage_paths
+
+# Named stage files (Snakemake rule input/output names) with their standalone paths
+INPUTS = {"triplets": "results/validated_triplets.csv"}
+OUTPUTS = {
+    "network": "results/cerna_network.graphml",
+    "sif": "results/cerna_network.sif",
+    "centrality": "results/centrality_scores.csv",
+    "nodes": "results/cerna_network_nodes.csv",
+    "edges": "results/cerna_network_edges.csv",
+}
+# Config keys that change the results (stage cache)
+CONFIG_KEYS = ["betweenness_samples", "random_seed"]
+
+# Dense (nodes x sources) values per betweenness BFS block; bounds worker memory
+BETWEENNESS_BLOCK_VALUES = 20_000_000
+
+# Power-iteration settings (NetworkX defaults)
+MAX_ITER = 100
+TOL = 1.0e-6
+
+def build_network(validated):
+    """
+    Vectorized undirected lncRNA-mRNA network from the triplet table.
+    Returns (genes, edges, adjacency): genes in first-appearance order, one edge row
+    per gene pair (source/target codes plus the miRNA and score of the last triplet
+    for that pair) and the symmetric 0/1 CSR adjacency matrix.
+    """
+    n_rows = len(validated)
+    # Interleave lncRNA/mRNA so codes follow first appearance, as in row-by-row insertion
+    endpoints = np.empty(2 * n_rows, dtype=object)
+    endpoints[0::2] = validated['lncRNA'].astype(str).to_numpy()
+    endpoints[1::2] = validated['mRNA'].astype(str).to_numpy()
+    codes, genes = pd.factorize(endpoints)
+    u, v = codes[0::2], codes[1::2]
+
+    edges = pd.DataFrame({
+        'u': np.minimum(u, v),
+        'v': np.maximum(u, v),
+        'source': validated['lncRNA'].astype(str).to_numpy(),
+        'target': validated['mRNA'].astype(str).to_numpy(),
+        'miRNA': validated['miRNA'].astype(str).to_numpy(),
+        'score': validated['score'].to_numpy(dtype=np.float64),
+    })
+    # A repeated pair keeps the attributes of its last triplet; lncRNA == mRNA is not an edge
+    edges = edges.drop_duplicates(['u', 'v'], keep='last')
+    edges = edges[edges['u'] != edges['v']].reset_index(drop=True)
+
+    n = len(genes)
+    adjacency = sparse.csr_matrix(
+        (np.ones(2 * len(edges)), (np.concatenate([edges['u'], edges['v']]), np.concatenate([edges['v'], edges['u']]))),
+        shape=(n, n)
+    )
+    return pd.Index(genes), edges, adjacency
+
+def degree_centrality(adjacency):
+    """Degree divided by n - 1"""
+    n = adjacency.shape[0]
+    degree = np.diff(adjacency.indptr).astype(np.float64)
+    return degree / (n - 1) if n > 1 else np.ones(n)
+
+def eigenvector_centrality(adjacency, max_iter=MAX_ITER, tol=TOL):
+    """Power iteration on A + I from a uniform start, unit L2 norm (as NetworkX)"""
+    n = adjacency.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        x_last = x
+        x = x_last + adjacency @ x_last
+        x = x / (np.linalg.norm(x) or 1.0)
+        if np.abs(x - x_last).sum() < n * tol:
+            return x
+    print(f"WARNING: eigenvector centrality did not converge in {max_iter} iterations")
+    return x
+
+def pagerank(adjacency, alpha=0.85, max_iter=MAX_ITER, tol=TOL):
+    """PageRank with uniform teleport and dangling redistribution (as NetworkX)"""
+    n = adjacency.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    degree = np.diff(adjacency.indptr).astype(np.float64)
+    dangling = degree == 0
+    inv_degree = np.divide(1.0, degree, out=np.zeros(n), where=~dangling)
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        x_last = x
+        x = alpha * (adjacency.T @ (x_last * inv_degree) + x_last[dangling].sum() / n) + (1 - alpha) / n
+        if np.abs(x - x_last).sum() < n * tol:
+            return x
+    print(f"WARNING: PageRank did not converge in {max_iter} iterations")
+    return x
+
+def source_dependencies(adjacency, sources):
+    """
+    Brandes dependency sums for a block of BFS sources, all sources at once.
+    Shortest-path counts advance level by level as sparse x dense products; the
+    backward pass accumulates delta(v) = sum_w sigma(v)/sigma(w) * (1 + delta(w))
+    over the same levels. Returns the per-node sum over the block's sources.
+    """
+    n = adjacency.shape[0]
+    cols = np.arange(len(sources))
+    sigma = np.zeros((n, len(sources)))
+    sigma[sources, cols] = 1.0
+    dist = np.full((n, len(sources)), -1, dtype=np.int32)
+    dist[sources, cols] = 0
+
+    frontier = sigma.copy()
+    depth = 0
+    while True:
+        reached = adjacency @ frontier
+        new = (dist < 0) & (reached > 0)
+        if not new.any():
+            break
+        depth += 1
+        dist[new] = depth
+        sigma[new] = reached[new]
+        frontier = np.where(new, reached, 0.0)
+
+    delta = np.zeros_like(sigma)
+    for d in range(depth, 0, -1):
+        coef = np.where(dist == d, (1.0 + delta) / np.where(sigma > 0, sigma, 1.0), 0.0)
+        delta += np.where(dist == d - 1, sigma * (adjacency @ coef), 0.0)
+    # A source's own dependency is not betweenness
+    delta[sources, cols] = 0.0
+    return delta.sum(axis=1)
+
+# Worker-side adjacency (inherited under fork, pickled once per worker otherwise)
+_worker_adjacency = None
+
+def _set_worker_adjacency(adjacency):
+    global _worker_adjacency
+    _worker_adjacency = adjacency
+    # One BLAS thread per worker process; the pool itself provides the parallelism
+    threadpool_limits(1)
+
+def _worker_dependencies(sources):
+    return source_dependencies(_worker_adjacency, sources)
+
+def betweenness_centrality(adjacency, samples=0, seed=42, threads=1):
+    """
+    Normalized shortest-path betweenness (NetworkX conventions, endpoints excluded).
+    Exact when samples is 0 or >= n; otherwise estimated from `samples` random
+    pivot sources and rescaled. Source blocks are spread over a process pool.
+    """
+    n = adjacency.shape[0]
+    if n <= 2:
+        return np.zeros(n)
+    if samples and samples < n:
+        sources = np.random.default_rng(seed).choice(n, size=samples, replace=False)
+    else:
+        sources = np.arange(n)
 
-def main():
-    validated_path = "results/validated_triplets.csv"
-    network_path = "results/cerna_network.graphml"
-    cytoscape_path = "results/cerna_network.sif"
-    centrality_path = "results/centrality_scores.csv"
-    nodes_path = "results/cerna_network_nodes.csv"  # New: nodes export
-    edges_path = "results/cerna_network_edges.csv"  # New: edges export
+    block = max(1, BETWEENNESS_BLOCK_VALUES // n)
+    blocks = [sources[i:i + block] for i in range(0, len(sources), block)]
+    if threads <= 1 or len(blocks) == 1:
+        dependencies = sum(source_dependencies(adjacency, b) for b in blocks)
+    else:
+        ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else mp.get_context()
+        with ctx.Pool(min(threads, len(blocks)), initializer=_set_worker_adjacency, initargs=(adjacency,)) as pool:
+            dependencies = sum(pool.imap_unordered(_worker_dependencies, blocks))
+
+    k = len(sources)
+    if k == n:
+        return dependencies / ((n - 1) * (n - 2))
+    # Sampled sources never accumulate their own dependency, so they see one pivot fewer
+    scale = np.full(n, 1.0 / (k * (n - 2)))
+    scale[sources] = 1.0 / ((k - 1) * (n - 2)) if k > 1 else np.nan
+    return dependencies * scale
+
+def _xml_escape(values):
+    """Escaped text of every value as an object array (so + concatenates elementwise)"""
+    escaped = (pd.Series(np.asarray(values), dtype=object).astype(str)
+               .str.replace('&', '&amp;', regex=False)
+               .str.replace('<', '&lt;', regex=False)
+               .str.replace('>', '&gt;', regex=False)
+               .str.replace('"', '&quot;', regex=False))
+    return escaped.to_numpy(dtype=object)
+
+def write_graphml(path, nodes, edges):
+    """
+    Write GraphML in one pass from the node and edge tables (NetworkX-compatible).
+    nodes: 'gene' plus attribute columns; edges: 'source', 'target' plus attribute columns.
+    """
+    node_attrs = [c for c in nodes.columns if c != 'gene']
+    edge_attrs = [c for c in edges.columns if c not in ('source', 'target')]
+
+    def key_type(series):
+        return 'double' if pd.api.types.is_float_dtype(series) else 'long' if pd.api.types.is_integer_dtype(series) else 'string'
+
+    keys = {}
+    lines = [
+        '<?xml version=\'1.0\' encoding=\'utf-8\'?>',
+        '<graphml xmlns="http://graphml.graphdrawing.org/xmlns" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">',
+    ]
+    for domain, table, attrs in (('node', nodes, node_attrs), ('edge', edges, edge_attrs)):
+        for attr in attrs:
+            keys[domain, attr] = f"d{len(keys)}"
+            lines.append(f'  <key id="{keys[domain, attr]}" for="{domain}" attr.name="{attr}" attr.type="{key_type(table[attr])}" />')
+    lines.append('  <graph edgedefault="undirected">')
+
+    def data_columns(domain, table, attrs):
+        out = np.full(len(table), '', dtype=object)
+        for attr in attrs:
+            out = out + f'\n      <data key="{keys[domain, attr]}">' + _xml_escape(table[attr]) + '</data>'
+        return out
+
+    node_xml = ('    <node id="' + _xml_escape(nodes['gene']) + '">'
+                + data_columns('node', nodes, node_attrs) + '\n    </node>')
+    edge_xml = ('    <edge source="' + _xml_escape(edges['source']) + '" target="' + _xml_escape(edges['target']) + '">'
+                + data_columns('edge', edges, edge_attrs) + '\n    </edge>')
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('\n'.join(lines) + '\n')
+        if len(node_xml):
+            f.write('\n'.join(node_xml) + '\n')
+        if len(edge_xml):
+            f.write('\n'.join(edge_xml) + '\n')
+        f.write('  </graph>\n</graphml>\n')
+
+def configured_threads():
+    """Thread budget: the rule's threads under Snakemake, otherwise all available cores"""
+    try:
+        return int(snakemake.threads)
+    except NameError:
+        return os.cpu_count() or 1
+
+def main(threads=None):
+    cfg_path = "config/config.yaml"
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r") as f:
+            cfg = yaml.safe_load(f)
+    else:
+        cfg = {}
+
+    if threads is None:
+        threads = configured_threads()
+
+    paths = stage_paths(INPUTS, OUTPUTS)
+    validated_path = paths["triplets"]
+    network_path = paths["network"]
+    cytoscape_path = paths["sif"]
+    centrality_path = paths["centrality"]
+    nodes_path = paths["nodes"]  # New: nodes export
+    edges_path = paths["edges"]  # New: edges export
 
     # Load validated triplets
     validated = pd.read_csv(validated_path)
+    count("input_rows", len(validated))
+
+    # Build network as an edge table plus sparse adjacency
+    with phase("build_network"):
+        genes, edges, adjacency = build_network(validated)
+    print(f"Network: {len(genes)} genes, {len(edges)} edges")
+    count("nodes", len(genes))
+    count("edges", len(edges))
+
+    # Compute centrality scores
+    samples = int(cfg.get("betweenness_samples", 1000) or 0)
+    if samples and samples < len(genes):
+        print(f"Estimating betweenness from {samples} sampled sources with {threads} worker(s)...")
+    else:
+        print(f"Computing exact betweenness with {threads} worker(s)...")
+    with phase("degree"):
+        degree = degree_centrality(adjacency)
+    with phase("betweenness"):
+        betweenness = betweenness_centrality(adjacency, samples, cfg.get("random_seed", 42), threads)
+    with phase("eigenvector"):
+        eigenvector = eigenvector_centrality(adjacency)
+    with phase("pagerank"):
+        rank = pagerank(adjacency)
+    centrality_df = pd.DataFrame({
+        'gene': genes,
+        'degree_centrality': degree,
+        'betweenness_centrality': betweenness,
+        'eigenvector_centrality': eigenvector,
+        'pagerank': rank,
+    })
+
+    with phase("writing"):
+        # Save as GraphML, with gene names and centralities as node attributes
+        nodes = centrality_df.assign(name=centrality_df['gene'])
+        nodes = nodes[['gene', 'name'] + [c for c in centrality_df.columns if c != 'gene']]
+        edge_table = edges[['source', 'target', 'miRNA', 'score']]
+        write_graphml(network_path, nodes, edge_table)
+        print(f"Network saved to {network_path}")
+
+        # Save as SIF for Cytoscape
+        with open(cytoscape_path, "w") as f:
+            if len(edge_table):
+                f.write('\n'.join(edge_table['source'] + ' interacts ' + edge_table['target']) + '\n')
+        print(f"Cytoscape SIF file saved to {cytoscape_path}")
+
+        centrality_df = centrality_df.sort_values('degree_centrality', ascending=False)
+        centrality_df.to_csv(centrality_path, index=False)
+        print(f"Centrality scores saved to {centrality_path}")
+
+        # Export nodes to CSV
+        nodes.to_csv(nodes_path, index=False)
+        print(f"Nodes exported to {nodes_path}")
 
-    # Build network
-    G = nx.Graph()
-    for _, row in validated.iterrows():
-        G.add_edge(row['lncRNA'], row['mRNA'], miRNA=row['miRNA'], score=row['score'])
-
-    # Add gene names as node attributes
-    all_genes = set(validated['lncRNA']) | set(validated['mRNA'])
-    for gene in all_genes:
-        G.nodes[gene]['name'] = gene
-
-    # Save as GraphML
-    nx.write_graphml(G, network_path)
-    print(f"Network saved to {network_path}")
-
-    # Save as SIF for Cytoscape
-    with open(cytoscape_path, "w") as f:
-        for u, v, data in G.edges(data=True):
-            f.write(f"{u} interacts {v}\n")
-    print(f"Cytoscape SIF file saved to {cytoscape_path}")
-
-    # Compute and save centrality scores
-    centrality = nx.degree_centrality(G)
-    centrality_df = pd.DataFrame(list(centrality.items()), columns=['gene', 'degree_centrality'])
-    centrality_df = centrality_df.sort_values('degree_centrality', ascending=False)
-    centrality_df.to_csv(centrality_path, index=False)
-    print(f"Centrality scores saved to {centrality_path}")
-
-    # Export nodes to CSV
-    nodes = pd.DataFrame(G.nodes(data=True), columns=['gene', 'attributes'])
-    nodes.to_csv(nodes_path, index=False)
-    print(f"Nodes exported to {nodes_path}")
-
-    # Export edges to CSV
-    edges = pd.DataFrame(G.edges(data=True), columns=['source', 'target', 'attributes'])
-    edges.to_csv(edges_path, index=False)
-    print(f"Edges exported to {edges_path}")
+        # Export edges to CSV
+        edge_table.to_csv(edges_path, index=False)
+        print(f"Edges exported to {edges_path}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_stage("network_analysis", cached("network_analysis", main, INPUTS, OUTPUTS, CONFIG_KEYS))
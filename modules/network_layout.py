@@ -0,0 +1,96 @@
+# modules/network_layout.py
+
+import os
+import hashlib
+import numpy as np
+from scipy.signal import fftconvolve
+
+LAYOUT_VERSION = 1
+LAYOUT_CACHE_DIR = "results/.layout_cache"
+
+# Force-layout settings
+LAYOUT_ITERATIONS = 50
+GRID_SIZE = 128  # Repulsion mesh resolution (cells per side)
+
+def layout_key(genes, edges_u, edges_v, seed, iterations=LAYOUT_ITERATIONS):
+    """Content hash of a graph (node names and edge codes) plus the layout settings"""
+    digest = hashlib.sha256()
+    digest.update(f"v{LAYOUT_VERSION}|{seed}|{iterations}|{GRID_SIZE}|".encode())
+    digest.update("\n".join(map(str, genes)).encode())
+    digest.update(np.asarray(edges_u, dtype=np.int64).tobytes())
+    digest.update(np.asarray(edges_v, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+def _repulsion_kernels(grid, cell):
+    """Fruchterman-Reingold repulsion (k^2 / d along the offset) per unit k^2, on the mesh"""
+    offsets = (np.arange(2 * grid - 1) - (grid - 1)) * cell
+    dx, dy = np.meshgrid(offsets, offsets, indexing="ij")
+    d2 = dx ** 2 + dy ** 2
+    d2[grid - 1, grid - 1] = np.inf  # no self-force
+    return dx / d2, dy / d2
+
+def force_layout(n, edges_u, edges_v, seed=42, iterations=LAYOUT_ITERATIONS, grid=GRID_SIZE):
+    """
+    Fruchterman-Reingold layout in O(n + E + grid^2 log grid) per iteration.
+    Attraction runs over the sparse edge list; repulsion is a particle-mesh
+    approximation: node mass is binned onto a grid and convolved (FFT) with the
+    repulsion kernel, so no pairwise n x n distances are formed. Positions are
+    returned as an (n, 2) array scaled to [-1, 1].
+    """
+    if n == 0:
+        return np.zeros((0, 2))
+    if n == 1:
+        return np.zeros((1, 2))
+    rng = np.random.default_rng(seed)
+    pos = rng.random((n, 2))
+    k = np.sqrt(1.0 / n)
+    t = 0.1  # Initial temperature, cooled linearly (as NetworkX)
+    dt = t / (iterations + 1)
+    cell = 1.0 / grid
+    kx, ky = _repulsion_kernels(grid, cell)
+
+    for _ in range(iterations):
+        # Repulsion from the mesh, sampled at each node's cell
+        lo = pos.min(axis=0)
+        span = max((pos.max(axis=0) - lo).max(), 1e-9)
+        idx = np.minimum(((pos - lo) / span * grid).astype(np.int64), grid - 1)
+        mass = np.zeros((grid, grid))
+        np.add.at(mass, (idx[:, 0], idx[:, 1]), 1.0)
+        # Kernels are built on a unit square; 1 / span rescales them to the current extent
+        fx = fftconvolve(mass, kx, mode="same")
+        fy = fftconvolve(mass, ky, mode="same")
+        disp = k * k * np.column_stack([fx[idx[:, 0], idx[:, 1]], fy[idx[:, 0], idx[:, 1]]]) / span
+
+        # Attraction along edges: d^2 / k towards each neighbour
+        delta = pos[edges_u] - pos[edges_v]
+        dist = np.maximum(np.sqrt((delta ** 2).sum(axis=1)), 0.01)
+        pull = delta * (dist / k)[:, None]
+        for axis in range(2):
+            disp[:, axis] -= np.bincount(edges_u, weights=pull[:, axis], minlength=n)
+            disp[:, axis] += np.bincount(edges_v, weights=pull[:, axis], minlength=n)
+
+        # Move at most t per iteration
+        length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 0.01)
+        pos += disp * (t / length)[:, None]
+        t -= dt
+
+    pos -= pos.mean(axis=0)
+    scale = np.abs(pos).max()
+    return pos / scale if scale > 0 else pos
+
+def cached_layout(genes, edges_u, edges_v, seed=42, cache_dir=LAYOUT_CACHE_DIR):
+    """
+    Node positions for the graph, reusing a previous layout of the identical graph.
+    Layouts are stored as <cache_dir>/<layout_key>.npy.
+    """
+    key = layout_key(genes, edges_u, edges_v, seed)
+    path = os.path.join(cache_dir, f"{key}.npy")
+    if os.path.exists(path):
+        print(f"Reusing cached layout {path}")
+        return np.load(path)
+    pos = force_layout(len(genes), np.asarray(edges_u), np.asarray(edges_v), seed)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, pos)
+    os.replace(tmp_path, path)
+    return pos
@@ -1,49 +1,159 @@
 # modules/predict_triplets.py
 
-import pickle
+import numpy as np
 import pandas as pd
 import os
+import yaml
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def main():
-    features_path = "results/features.pkl"
-    models_path = "results/models.pkl"
-    predictions_path = "results/predicted_triplets.csv"
+from feature_store import ID_COLUMNS, read_features, store_num_row_groups, store_num_rows, store_feature_columns
+from ml_training import MODEL_PATH, load_model
+from instrumentation import count, phase, run_stage, timed_iter
+from stage_cache import cached
+from stage_io import stage_paths
 
-    # Load model (single XGBClassifier object)
-    with open(models_path, "rb") as f:
-        model = pickle.load(f)
+PREDICTION_COLUMNS = ID_COLUMNS + ["score"]
 
-    # Load features
-    with open(features_path, "rb") as f:
-        features = pickle.load(f)
+# Named stage files (Snakemake rule input/output names) with their standalone paths
+INPUTS = {"features": "results/features.parquet", "model": MODEL_PATH}
+OUTPUTS = {"predictions": "results/predicted_triplets.csv"}
+# Config keys that change the predictions (stage cache)
+CONFIG_KEYS = ["confidence_threshold", "prediction_top_k"]
+
+def configured_threads():
+    """Thread budget: the rule's threads under Snakemake, otherwise all available cores"""
+    try:
+        return int(snakemake.threads)
+    except NameError:
+        return os.cpu_count() or 1
+
+def score_partition(model, features_path, row_group, feature_cols, min_score=-np.inf):
+    """Score one feature-store row group; only rows with score >= min_score are returned"""
+    batch = read_features(features_path, columns=ID_COLUMNS + feature_cols, row_groups=[row_group])
+    probs = model.inplace_predict(batch[feature_cols])  # Probability of positive class
+    keep = probs >= min_score
+    # Keep only identifiers and score from each batch
+    batch_predictions = batch.loc[keep, ID_COLUMNS].astype(str)
+    batch_predictions["score"] = probs[keep]
+    return batch_predictions
+
+def iter_scored_partitions(model, features_path, feature_cols, min_score=-np.inf, workers=1):
+    """
+    Yield scored row groups in order. With workers > 1, row groups are read and scored
+    on a thread pool (XGBoost releases the GIL while predicting) with at most
+    2 * workers partitions in flight, so memory stays bounded.
+    """
+    n_partitions = store_num_row_groups(features_path)
+    if workers <= 1:
+        for rg in range(n_partitions):
+            yield score_partition(model, features_path, rg, feature_cols, min_score)
+        return
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        for rg in range(n_partitions):
+            pending.append(pool.submit(score_partition, model, features_path, rg, feature_cols, min_score))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+class TopKTriplets:
+    """
+    Bounded top-K selection over streamed predictions.
+    Acts as a min-heap of size k: once k rows are held, a new row is only kept if
+    it beats the current k-th best score, so memory is O(k) and no full sort of all
+    candidates is ever needed. k <= 0 keeps every row pushed.
+    """
+
+    def __init__(self, k=0):
+        self.k = k
+        self._kept = []
+        self._n_kept = 0
+        self.floor = -np.inf  # k-th best score once the buffer is full
+
+    def push(self, df):
+        if self.k > 0:
+            df = df[df["score"] > self.floor]
+        if df.empty:
+            return
+        self._kept.append(df)
+        self._n_kept += len(df)
+        if self.k > 0 and self._n_kept > 2 * self.k:
+            self._shrink()
+
+    def _shrink(self):
+        merged = pd.concat(self._kept, ignore_index=True)
+        if len(merged) > self.k:
+            top = np.argpartition(-merged["score"].to_numpy(), self.k - 1)[:self.k]
+            merged = merged.iloc[top]
+            self.floor = merged["score"].min()
+        self._kept = [merged]
+        self._n_kept = len(merged)
+
+    def result(self):
+        """Kept rows, best score first"""
+        if not self._kept:
+            return pd.DataFrame(columns=PREDICTION_COLUMNS)
+        if self.k > 0:
+            self._shrink()
+        merged = pd.concat(self._kept, ignore_index=True)
+        return merged.sort_values("score", ascending=False)
+
+def main(threads=None):
+    cfg_path = "config/config.yaml"
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r") as f:
+            cfg = yaml.safe_load(f)
+    else:
+        cfg = {}
+
+    if threads is None:
+        threads = configured_threads()
+    workers = max(1, min(int(cfg.get("prediction_workers", 1)), threads))
+    top_k = int(cfg.get("prediction_top_k") or 0)
+    threshold = cfg.get("confidence_threshold")
+    min_score = -np.inf if threshold is None else float(threshold)
+
+    paths = stage_paths(INPUTS, OUTPUTS)
+    features_path = paths["features"]
+    models_path = paths["model"]
+    predictions_path = paths["predictions"]
+
+    # Load model (native XGBoost Booster); threads are shared between scoring workers
+    model = load_model(models_path, max(1, threads // workers))
+    count("input_rows", store_num_rows(features_path))
 
     # Handle empty or placeholder model
-    if features.empty or model is None:
+    if store_num_rows(features_path) == 0 or model is None:
         print("No model or features available. Saving empty predictions.")
-        pd.DataFrame(columns=["lncRNA", "miRNA", "mRNA", "score"]).to_csv(predictions_path, index=False)
+        pd.DataFrame(columns=PREDICTION_COLUMNS).to_csv(predictions_path, index=False)
         return
 
-    # Select only numeric columns for prediction
-    numeric_cols = features.select_dtypes(include=['int', 'float', 'bool']).columns
-    if len(numeric_cols) == 0:
+    feature_cols = store_feature_columns(features_path)
+    if len(feature_cols) == 0:
         print("No numeric features found. Saving empty predictions.")
-        pd.DataFrame(columns=["lncRNA", "miRNA", "mRNA", "score"]).to_csv(predictions_path, index=False)
+        pd.DataFrame(columns=PREDICTION_COLUMNS).to_csv(predictions_path, index=False)
         return
 
-    X = features[numeric_cols]
-
-    # Generate predictions
-    print("Generating predictions...")
-    probs = model.predict_proba(X)[:, 1]  # Probability of positive class
-
-    # Add predictions to the original features (with identifiers)
-    predictions = features[["lncRNA", "miRNA", "mRNA"]].copy()
-    predictions["score"] = probs
-    predictions = predictions.sort_values("score", ascending=False)
+    # Stream row groups through the model, keeping only confident / top-K triplets
+    print(f"Generating predictions with {workers} scoring worker(s)...")
+    print(f"Keeping triplets with score >= {min_score}" + (f", top {top_k}" if top_k > 0 else ""))
+    selected = TopKTriplets(top_k)
+    scored = iter_scored_partitions(model, features_path, feature_cols, min_score, workers)
+    for batch_predictions in timed_iter(scored, "scoring"):
+        with phase("selection"):
+            selected.push(batch_predictions)
+    with phase("selection"):
+        predictions = selected.result()
 
     # Save
-    predictions.to_csv(predictions_path, index=False)
+    with phase("writing"):
+        predictions.to_csv(predictions_path, index=False)
+    count("output_rows", len(predictions))
+    print(f"Saved {len(predictions)} of {store_num_rows(features_path)} scored triplets")
     print(f"Predictions saved to {predictions_path}")
 
 if __name__ == "__main__":
-    main()
+    run_stage("predict_triplets", cached("predict_triplets", main, INPUTS, OUTPUTS, CONFIG_KEYS,
+                                         modules=["feature_store.py", "ml_training.py"]))
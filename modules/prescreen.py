@@ -0,0 +1,193 @@
+# modules/prescreen.py
+
+import os
+import json
+import yaml
+import numpy as np
+from scipy import sparse
+from threadpoolctl import threadpool_limits
+
+from expression_matrix import open_expression_matrix
+from feature_engineering import build_incidences, save_candidates, standardize_rows
+from instrumentation import count, phase, run_stage
+from stage_cache import cached
+from stage_io import ensure_parent, stage_paths
+
+# Named stage files (Snakemake rule input/output names) with their standalone paths
+OUTPUTS = {
+    "candidates": "results/prescreen.npz",
+    "summary": "results/prescreen_summary.json",
+}
+# Config keys that change the candidates (stage cache)
+CONFIG_KEYS = ["id_resolution", "biotype_filter", "annotation_file", "alias_file", "prescreen",
+               "prescreen_lnc_mrna_cutoff", "prescreen_lnc_mrna_sign", "prescreen_target_mirna_sign",
+               "prescreen_target_mirna_cutoff"]
+
+# Upper bound on correlation values held at once by a dense tile
+TILE_VALUES = 20_000_000
+
+SIGNS = ("positive", "negative", "any")
+
+def stage_inputs(cfg):
+    """Files the pre-screen reads: the feature engineering inputs without the candidates"""
+    return {
+        "counts": "results/norm_counts.npy",
+        "genes": "results/norm_counts.genes.txt",
+        "mirna_mrna_db": "databases/miRTarBase.txt",
+        "mirna_lncrna_db": "databases/LncBase.txt",
+        "annotation_file": cfg.get("annotation_file", "databases/gene_annotation.csv"),
+        "alias_file": cfg.get("alias_file", "databases/id_aliases.tsv"),
+    }
+
+def passes(r, sign, cutoff):
+    """
+    Sign and magnitude rule: positive keeps r >= cutoff, negative keeps r <= -cutoff,
+    any keeps |r| >= cutoff. NaN correlations (constant rows) never pass.
+    """
+    if sign == "positive":
+        return r >= cutoff
+    if sign == "negative":
+        return r <= -cutoff
+    if sign == "any":
+        return np.abs(r) >= cutoff
+    raise ValueError(f"Unknown correlation sign {sign!r}; expected one of {', '.join(SIGNS)}")
+
+def row_tiles(n_rows, n_cols, tile_values=TILE_VALUES):
+    """Row slices of an n_rows x n_cols dense block holding at most tile_values each"""
+    step = max(1, tile_values // max(n_cols, 1))
+    for start in range(0, n_rows, step):
+        yield slice(start, min(start + step, n_rows))
+
+def screen_targets(unit, incidence, sign, cutoff, tile_values=TILE_VALUES):
+    """
+    Drop miRNA -> target edges whose miRNA-target correlation fails the rule.
+    The miRNA x gene correlations are computed once, a tile of miRNAs at a time,
+    and read off at the incidence's nonzeros.
+    """
+    incidence = incidence.tocsr()
+    mirs = np.flatnonzero(incidence.getnnz(axis=1))
+    keep = np.zeros(incidence.nnz, dtype=bool)
+    for tile in row_tiles(len(mirs), unit.shape[0], tile_values):
+        tile_mirs = mirs[tile]
+        r_tile = (unit[tile_mirs] @ unit.T).astype(np.float32)
+        for row, mir in enumerate(tile_mirs):
+            start, end = incidence.indptr[mir], incidence.indptr[mir + 1]
+            keep[start:end] = passes(r_tile[row, incidence.indices[start:end]], sign, cutoff)
+    screened = sparse.csr_matrix((incidence.data * keep, incidence.indices, incidence.indptr),
+                                 shape=incidence.shape)
+    screened.eliminate_zeros()
+    return screened
+
+def screen_pairs(unit, mir_lnc, mir_mrna, sign, cutoff, tile_values=TILE_VALUES):
+    """
+    lncRNA x mRNA pairs that share at least one miRNA and whose correlation passes the
+    rule, as a gene-indexed sparse matrix, plus the number of triplets they span.
+    The lncRNA x mRNA correlation block is computed in tiles of lncRNAs; shared-miRNA
+    counts for a tile come from one sparse product of the incidences.
+    """
+    n_genes = mir_lnc.shape[1]
+    lnc_genes = np.flatnonzero(mir_lnc.getnnz(axis=0))
+    mrna_genes = np.flatnonzero(mir_mrna.getnnz(axis=0))
+    lnc_by_mir = mir_lnc[:, lnc_genes].T.tocsr().astype(np.int32)
+    mir_by_mrna = mir_mrna[:, mrna_genes].tocsc().astype(np.int32)
+    mrna_unit_t = np.ascontiguousarray(unit[mrna_genes].T)
+
+    rows, cols = [], []
+    n_triplets = 0
+    for tile in row_tiles(len(lnc_genes), len(mrna_genes), tile_values):
+        shared = (lnc_by_mir[tile] @ mir_by_mrna).tocoo()
+        if shared.nnz == 0:
+            continue
+        r_tile = unit[lnc_genes[tile]] @ mrna_unit_t
+        keep = passes(r_tile[shared.row, shared.col], sign, cutoff)
+        rows.append(lnc_genes[tile][shared.row[keep]])
+        cols.append(mrna_genes[shared.col[keep]])
+        n_triplets += int(shared.data[keep].sum())
+    rows = np.concatenate(rows) if rows else np.array([], dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.array([], dtype=np.int64)
+    pairs = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_genes, n_genes))
+    return pairs, n_triplets
+
+def triplet_count(mir_lnc, mir_mrna):
+    """Number of (lncRNA, miRNA, mRNA) triplets the incidences span"""
+    return int(np.dot(mir_lnc.getnnz(axis=1).astype(np.int64), mir_mrna.getnnz(axis=1)))
+
+def configured_threads():
+    """Thread budget: the rule's threads under Snakemake, otherwise all available cores"""
+    try:
+        return int(snakemake.threads)
+    except NameError:
+        return os.cpu_count() or 1
+
+def prescreen_main(threads=None):
+    # Load config parameters
+    cfg_path = "config/config.yaml"
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r") as f:
+            cfg = yaml.safe_load(f)
+    else:
+        cfg = {}
+
+    if threads is None:
+        threads = configured_threads()
+    paths = stage_paths(stage_inputs(cfg), OUTPUTS)
+
+    print("Loading normalized expression data...")
+    norm_counts = open_expression_matrix(os.path.splitext(paths["counts"])[0])
+    genes = norm_counts.genes
+    count("input_genes", len(genes))
+
+    mir_mrna, mir_lnc = build_incidences(cfg, genes, paths)
+    summary = {
+        "mirna_mrna_edges_before": int(mir_mrna.nnz),
+        "mirna_lncrna_edges_before": int(mir_lnc.nnz),
+        "triplets_before": triplet_count(mir_lnc, mir_mrna),
+    }
+
+    pairs = None
+    if cfg.get("prescreen", True):
+        target_sign = cfg.get("prescreen_target_mirna_sign", "negative")
+        target_cutoff = float(cfg.get("prescreen_target_mirna_cutoff", 0.0))
+        pair_sign = cfg.get("prescreen_lnc_mrna_sign", "positive")
+        pair_cutoff = float(cfg.get("prescreen_lnc_mrna_cutoff", 0.15))
+
+        with phase("standardize"):
+            unit = standardize_rows(norm_counts.values)
+        with threadpool_limits(threads):
+            print(f"Screening miRNA-target edges (miRNA-target r {target_sign}, cutoff {target_cutoff})...")
+            with phase("target_screen"):
+                mir_mrna = screen_targets(unit, mir_mrna, target_sign, target_cutoff)
+                mir_lnc = screen_targets(unit, mir_lnc, target_sign, target_cutoff)
+            print(f"Screening lncRNA-mRNA pairs (r {pair_sign}, cutoff {pair_cutoff})...")
+            with phase("pair_screen"):
+                pairs, triplets_after = screen_pairs(unit, mir_lnc, mir_mrna, pair_sign, pair_cutoff)
+        summary["lnc_mrna_pairs_after"] = int(pairs.nnz)
+    else:
+        print("Pre-screening disabled (prescreen: false); keeping every candidate triplet")
+        triplets_after = summary["triplets_before"]
+
+    summary.update({
+        "mirna_mrna_edges_after": int(mir_mrna.nnz),
+        "mirna_lncrna_edges_after": int(mir_lnc.nnz),
+        "triplets_after": triplets_after,
+    })
+    pruned = summary["triplets_before"] - triplets_after
+    summary["triplets_pruned"] = pruned
+    summary["pruned_fraction"] = pruned / summary["triplets_before"] if summary["triplets_before"] else 0.0
+    for name in ("triplets_before", "triplets_after", "triplets_pruned"):
+        count(name, summary[name])
+
+    with phase("writing"):
+        ensure_parent(paths["candidates"])
+        save_candidates(paths["candidates"], mir_mrna, mir_lnc, pairs)
+        ensure_parent(paths["summary"])
+        with open(paths["summary"], "w") as f:
+            json.dump(summary, f, indent=2)
+    print(f"Pre-screen kept {triplets_after} of {summary['triplets_before']} candidate triplets "
+          f"({pruned} pruned, {summary['pruned_fraction']:.1%})")
+    print(f"Candidates saved to {paths['candidates']}")
+
+if __name__ == "__main__":
+    run_stage("prescreen", cached("prescreen", prescreen_main, stage_inputs, OUTPUTS, CONFIG_KEYS,
+                                  modules=["feature_engineering.py", "expression_matrix.py",
+                                           "interaction_index.py", "id_resolver.py"]))
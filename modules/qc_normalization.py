@@ -1,10 +1,53 @@
-# modules/qc_normalization.py (simplified version)
+# modules/qc_normalization.py
 
 import pandas as pd
 import numpy as np
 import yaml
 import os
 import sys
+from numpy.lib.format import open_memmap
+from scipy.stats import rankdata
+
+from expression_matrix import create_expression_matrix, write_expression_matrix
+from instrumentation import count, phase, run_stage
+from stage_cache import cached
+from stage_io import ensure_parent, stage_paths
+
+# Named stage files (Snakemake rule input/output names) with their standalone paths
+def stage_inputs(cfg):
+    """Files QC reads; the optional sample annotation table comes from the config"""
+    return {"counts": "data/input_counts.csv", "sample_annotation": cfg.get("sample_metadata") or ""}
+OUTPUTS = {
+    "norm_counts": "results/norm_counts.csv",
+    "norm_matrix": "results/norm_counts.npy",
+    "norm_genes": "results/norm_counts.genes.txt",
+    "norm_samples": "results/norm_counts.samples.txt",
+    "metadata": "results/sample_metadata.csv",
+}
+# Config keys that change the results (stage cache)
+CONFIG_KEYS = ["normalization_method", "low_count_threshold", "sample_frac_threshold", "sample_metadata"]
+
+def sample_metadata(samples, annotation_path=""):
+    """
+    Per-sample metadata: sample_id, batch and every column of the optional annotation
+    table (.csv or tab-separated, keyed by sample_id), e.g. condition or subtype.
+    Samples missing from the table get NA; without a batch column all are batch1.
+    """
+    metadata = pd.DataFrame({'sample_id': pd.Index(samples).astype(str)})
+    if annotation_path:
+        sep = "," if annotation_path.endswith(".csv") else "\t"
+        annotation = pd.read_csv(annotation_path, sep=sep, dtype=str)
+        if 'sample_id' not in annotation.columns:
+            raise ValueError(f"Sample annotation {annotation_path} lacks a sample_id column")
+        annotation = annotation.drop_duplicates('sample_id').set_index('sample_id')
+        unmatched = (~metadata['sample_id'].isin(annotation.index)).sum()
+        if unmatched:
+            print(f"Warning: {unmatched} sample(s) not in {annotation_path}; their annotations are NA")
+        metadata = metadata.join(annotation, on='sample_id')
+        metadata = metadata.fillna('NA')
+    if 'batch' not in metadata.columns:
+        metadata.insert(1, 'batch', 'batch1')
+    return metadata
 
 def filter_low_expression(counts_df, min_counts=5, min_samples_frac=0.8):
     """Filter out genes with fewer than min_counts in less than min_samples_frac fraction of samples"""
@@ -13,12 +56,186 @@ def filter_low_expression(counts_df, min_counts=5, min_samples_frac=0.8):
     filtered_df = counts_df[pass_filter]
     return filtered_df
 
-def normalize_counts_cpm(counts_df):
-    """Simple CPM (Counts Per Million) normalization"""
+def normalize_counts_cpm(counts_df, norm_factors=None):
+    """CPM (Counts Per Million) normalization, optionally on TMM/RLE-scaled library sizes"""
     total_counts = counts_df.sum(axis=0)
+    if norm_factors is not None:
+        total_counts = total_counts * norm_factors
     normalized_df = counts_df.div(total_counts, axis=1) * 1e6
     return normalized_df
 
+def _tmm_factor(obs, ref, lib_obs, lib_ref, logratio_trim=0.3, sum_trim=0.05):
+    """TMM scaling factor of one sample against the reference (edgeR .calcFactorTMM)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_r = np.log2((obs / lib_obs) / (ref / lib_ref))
+        abs_e = (np.log2(obs / lib_obs) + np.log2(ref / lib_ref)) / 2
+        v = (lib_obs - obs) / lib_obs / obs + (lib_ref - ref) / lib_ref / ref
+    fin = np.isfinite(log_r) & np.isfinite(abs_e)
+    log_r, abs_e, v = log_r[fin], abs_e[fin], v[fin]
+    if len(log_r) == 0 or np.max(np.abs(log_r)) < 1e-6:
+        return 1.0
+
+    # Trim the most extreme log-ratios (M) and abundances (A), ties ranked as in R
+    n = len(log_r)
+    lo_l = np.floor(n * logratio_trim) + 1
+    hi_l = n + 1 - lo_l
+    lo_s = np.floor(n * sum_trim) + 1
+    hi_s = n + 1 - lo_s
+    rank_r = rankdata(log_r)
+    rank_e = rankdata(abs_e)
+    keep = (rank_r >= lo_l) & (rank_r <= hi_l) & (rank_e >= lo_s) & (rank_e <= hi_s)
+
+    # Precision-weighted mean of the kept log-ratios
+    f = np.nansum(log_r[keep] / v[keep]) / np.nansum(1 / v[keep])
+    if not np.isfinite(f):
+        f = 0.0
+    return 2 ** f
+
+def calc_norm_factors_tmm(counts, lib_sizes):
+    """
+    edgeR TMM normalization factors (default trims, precision weighting).
+    counts is a genes x samples array; only one sample column is held at a time, so
+    a column-major memmap works as well as an in-memory array.
+    """
+    n_samples = counts.shape[1]
+
+    def columns(j):
+        return np.asarray(counts[:, j], dtype=np.float64)
+
+    # All-zero genes carry no information about composition
+    expressed = np.zeros(counts.shape[0], dtype=bool)
+    for j in range(n_samples):
+        expressed |= columns(j) > 0
+
+    # Reference sample: upper quartile closest to the mean upper quartile
+    f75 = np.array([np.quantile(columns(j)[expressed] / lib_sizes[j], 0.75) for j in range(n_samples)])
+    if np.median(f75) < 1e-20:
+        ref_col = int(np.argmax([np.sqrt(columns(j)[expressed]).sum() for j in range(n_samples)]))
+    else:
+        ref_col = int(np.argmin(np.abs(f75 - f75.mean())))
+    ref = columns(ref_col)[expressed]
+
+    factors = np.array([
+        _tmm_factor(columns(j)[expressed], ref, lib_sizes[j], lib_sizes[ref_col])
+        for j in range(n_samples)
+    ])
+    # Factors multiply to one
+    return factors / np.exp(np.mean(np.log(factors)))
+
+def calc_norm_factors_rle(counts, lib_sizes, block_size=100_000):
+    """
+    edgeR RLE (DESeq-style median ratio) normalization factors.
+    Gene geometric means are accumulated over row blocks and each sample's median
+    ratio is then taken one column at a time.
+    """
+    n_genes, n_samples = counts.shape
+    geo_means = np.empty(n_genes)
+    for start in range(0, n_genes, block_size):
+        block = np.asarray(counts[start:start + block_size], dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            geo_means[start:start + block_size] = np.exp(np.log(block).mean(axis=1))
+    usable = geo_means > 0
+
+    factors = np.array([
+        np.median(np.asarray(counts[:, j], dtype=np.float64)[usable] / geo_means[usable])
+        for j in range(n_samples)
+    ]) / lib_sizes
+    # Factors multiply to one
+    return factors / np.exp(np.mean(np.log(factors)))
+
+def calc_norm_factors(counts, lib_sizes, method):
+    """Library-size scaling factors for the configured normalization method"""
+    method = str(method).upper()
+    if counts.shape[0] == 0:
+        return np.ones(counts.shape[1])
+    if method == "TMM":
+        return calc_norm_factors_tmm(counts, lib_sizes)
+    if method == "RLE":
+        return calc_norm_factors_rle(counts, lib_sizes)
+    if method in ("CPM", "NONE"):
+        return np.ones(counts.shape[1])
+    raise ValueError(f"Unknown normalization_method '{method}'. Use TMM, RLE or CPM.")
+
+def count_data_lines(path):
+    """Upper bound on data rows in a CSV (newline count minus the header)"""
+    n_lines = 0
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(1 << 20), b""):
+            n_lines += buf.count(b"\n")
+    return max(n_lines, 1)
+
+def spill_filtered_counts(counts_path, spill_path, min_counts, min_samples_frac, chunk_size):
+    """
+    Streaming pass 1: read the counts CSV in chunks, QC and filter each chunk, and
+    append the surviving genes to a column-major on-disk matrix so later per-sample
+    statistics read contiguous columns. Returns (matrix, genes, samples, n_input_genes).
+    """
+    n_upper = count_data_lines(counts_path)
+    spill = None
+    genes = []
+    n_kept = 0
+    n_total = 0
+    for chunk in pd.read_csv(counts_path, index_col=0, chunksize=chunk_size):
+        if spill is None:
+            samples = chunk.columns
+            index_name = chunk.index.name
+            spill = open_memmap(spill_path, mode="w+", dtype=np.float64,
+                                shape=(n_upper, len(samples)), fortran_order=True)
+        if (chunk < 0).any().any():
+            raise ValueError("Input counts contain negative values. Check input file.")
+        filtered = filter_low_expression(chunk.fillna(0), min_counts, min_samples_frac)
+        spill[n_kept:n_kept + len(filtered)] = filtered.to_numpy(dtype=np.float64)
+        genes.extend(filtered.index)
+        n_kept += len(filtered)
+        n_total += len(chunk)
+    if spill is None:
+        raise ValueError(f"No genes found in {counts_path}.")
+    spill.flush()
+    return spill[:n_kept], pd.Index(genes, name=index_name), samples, n_total
+
+def write_normalized_chunks(counts, genes, samples, eff_lib_sizes, chunk_size, csv_path, matrix_prefix):
+    """Streaming pass 2: log2 CPM on effective library sizes, written block by block"""
+    out = create_expression_matrix(genes, samples, matrix_prefix)
+    with open(csv_path, "w", newline="") as f:
+        pd.DataFrame(columns=samples, index=genes[:0]).to_csv(f)
+        for start in range(0, len(genes), chunk_size):
+            stop = start + chunk_size
+            block = np.asarray(counts[start:stop], dtype=np.float64)
+            block = np.log2(block / eff_lib_sizes * 1e6 + 1)
+            out[start:stop] = block
+            pd.DataFrame(block, index=genes[start:stop], columns=samples).to_csv(f, header=False)
+    out.flush()
+
+def normalize_streaming(counts_path, cfg, method, chunk_size, paths):
+    """Out-of-core QC and normalization for count matrices larger than memory"""
+    ensure_parent(paths["norm_matrix"])
+    spill_path = os.path.join(os.path.dirname(paths["norm_matrix"]), ".qc_filtered_counts.npy")
+    try:
+        with phase("load_filter"):
+            counts, genes, samples, n_total = spill_filtered_counts(
+                counts_path, spill_path,
+                cfg.get("low_count_threshold", 5),
+                cfg.get("sample_frac_threshold", 0.8),
+                chunk_size
+            )
+        count("input_rows", n_total)
+        count("output_rows", len(genes))
+        print(f"Loaded {n_total} genes across {len(samples)} samples in chunks of {chunk_size}")
+        print(f"Filtered out {n_total - len(genes)} genes due to low expression")
+
+        print(f"Using {method} normalization")
+        with phase("norm_factors"):
+            lib_sizes = np.asarray(counts.sum(axis=0), dtype=np.float64)
+            factors = calc_norm_factors(counts, lib_sizes, method)
+        with phase("writing"):
+            write_normalized_chunks(counts, genes, samples, lib_sizes * factors, chunk_size,
+                                    paths["norm_counts"], os.path.splitext(paths["norm_matrix"])[0])
+        del counts
+    finally:
+        if os.path.exists(spill_path):
+            os.remove(spill_path)
+    return samples
+
 def main():
     # Load config parameters
     cfg_path = "config/config.yaml"
@@ -28,46 +245,64 @@ def main():
     else:
         cfg = {}
 
+    method = str(cfg.get("normalization_method", "TMM")).upper()
+    chunk_size = int(cfg.get("qc_chunk_size") or 0)
+
     # Input counts
-    counts_path = "data/input_counts.csv"
-    counts_df = pd.read_csv(counts_path, index_col=0)
-
-    print(f"Loaded {counts_df.shape[0]} genes across {counts_df.shape[1]} samples")
-
-    # Basic sanity check
-    if (counts_df < 0).any().any():
-        raise ValueError("Input counts contain negative values. Check input file.")
-
-    # Fill NA with zeros
-    counts_df = counts_df.fillna(0)
-
-    # Filter low-expression genes
-    filtered_counts = filter_low_expression(
-        counts_df,
-        cfg.get("low_count_threshold", 5),
-        cfg.get("sample_frac_threshold", 0.8)
-    )
-    print(f"Filtered out {counts_df.shape[0] - filtered_counts.shape[0]} genes due to low expression")
-
-    # Simple CPM normalization (instead of edgeR TMM)
-    print("Using CPM normalization (simplified method)")
-    normalized_df = normalize_counts_cpm(filtered_counts)
-
-    # Log2 transform with pseudocount
-    normalized_df = np.log2(normalized_df + 1)
-    
-    # Save normalized counts and sample metadata
-    os.makedirs("results", exist_ok=True)
-    normalized_df.to_csv("results/norm_counts.csv")
-    
-    # Create simple sample metadata
-    metadata = pd.DataFrame({
-        'sample_id': counts_df.columns,
-        'batch': ['batch1'] * len(counts_df.columns)
-    })
-    metadata.to_csv("results/sample_metadata.csv", index=False)
+    paths = stage_paths(stage_inputs(cfg), OUTPUTS)
+    counts_path = paths["counts"]
+
+    if chunk_size > 0:
+        # Two-pass out-of-core mode
+        samples = normalize_streaming(counts_path, cfg, method, chunk_size, paths)
+    else:
+        with phase("load"):
+            counts_df = pd.read_csv(counts_path, index_col=0)
+        count("input_rows", counts_df.shape[0])
+
+        print(f"Loaded {counts_df.shape[0]} genes across {counts_df.shape[1]} samples")
+
+        # Basic sanity check
+        if (counts_df < 0).any().any():
+            raise ValueError("Input counts contain negative values. Check input file.")
+
+        # Fill NA with zeros
+        counts_df = counts_df.fillna(0)
+
+        # Filter low-expression genes
+        with phase("filter"):
+            filtered_counts = filter_low_expression(
+                counts_df,
+                cfg.get("low_count_threshold", 5),
+                cfg.get("sample_frac_threshold", 0.8)
+            )
+        count("output_rows", filtered_counts.shape[0])
+        print(f"Filtered out {counts_df.shape[0] - filtered_counts.shape[0]} genes due to low expression")
+
+        # Library-size normalization scaled by TMM/RLE factors
+        print(f"Using {method} normalization")
+        with phase("normalize"):
+            counts = filtered_counts.to_numpy(dtype=np.float64)
+            factors = calc_norm_factors(counts, counts.sum(axis=0), method)
+            normalized_df = normalize_counts_cpm(filtered_counts, factors)
+
+            # Log2 transform with pseudocount
+            normalized_df = np.log2(normalized_df + 1)
+
+        # Save normalized counts
+        with phase("writing"):
+            ensure_parent(paths["norm_counts"])
+            normalized_df.to_csv(paths["norm_counts"])
+            # Binary, memory-mappable copy with gene/sample sidecars for downstream stages
+            write_expression_matrix(normalized_df, os.path.splitext(paths["norm_matrix"])[0])
+        samples = counts_df.columns
+
+    # Sample metadata, with conditions from the optional annotation table
+    metadata = sample_metadata(samples, paths["sample_annotation"])
+    metadata.to_csv(paths["metadata"], index=False)
 
     print("QC and normalization completed successfully.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_stage("qc_normalization", cached("qc_normalization", main, stage_inputs, OUTPUTS, CONFIG_KEYS,
+                                         modules=["expression_matrix.py"]))
@@ -0,0 +1,234 @@
+# modules/sequence_features.py
+
+import os
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+from scipy import sparse
+from threadpoolctl import threadpool_limits
+
+from id_resolver import canonical_mirna_names, strip_ensembl_version
+from sequence_index import SITE_7MER_A1, SITE_7MER_M8, SITE_8MER, default_index_dir, load_seed_index, read_fasta
+
+# Per (miRNA sequence, transcript) site counts, one shard per mature sequence kept
+# inside the seed index directory: rebuilding the index for a new transcript FASTA
+# drops them with it
+SITE_SHARDS = "sites"
+SITE_COLUMNS = ["sequence", "transcript", "n_8mer", "n_7mer_m8", "n_7mer_a1", "energy"]
+SITE_DTYPES = {"sequence": str, "transcript": np.int64, "n_8mer": np.int64, "n_7mer_m8": np.int64,
+               "n_7mer_a1": np.int64, "energy": np.float64}
+
+def empty_sites():
+    return pd.DataFrame(columns=SITE_COLUMNS).astype(SITE_DTYPES)
+
+def load_mirna_sequences(path, mirnas):
+    """
+    Mature sequences (DNA alphabet) of the given miRNA names from a miRBase-style FASTA.
+    Header names are matched as-is and through canonical miRBase spellings.
+    Returns {miRNA name: sequence}; miRNAs without a sequence are left out.
+    """
+    records = {}
+    for header, sequence in read_fasta(path):
+        name = header.split()[0] if header.split() else header
+        records.setdefault(name, sequence.upper().replace("U", "T"))
+    names = pd.Series(list(records), dtype=object)
+    by_name = dict(zip(canonical_mirna_names(names), records.values()))
+    by_name.update(records)
+    canonical = canonical_mirna_names(pd.Series(list(mirnas), dtype=object))
+    sequences = {}
+    for mirna, alias in zip(mirnas, canonical):
+        sequence = by_name.get(mirna, by_name.get(alias))
+        if sequence:
+            sequences[mirna] = sequence
+    return sequences
+
+def _shard_path(index_dir, sequence):
+    # Mature sequences are short ACGT strings, safe as file names
+    return os.path.join(index_dir, SITE_SHARDS, f"{sequence}.parquet")
+
+def _read_site_shard(index_dir, sequence):
+    """Cached sites of one mature sequence, or None if it was never scanned"""
+    path = _shard_path(index_dir, sequence)
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path).astype(SITE_DTYPES)
+
+def _write_site_shard(index_dir, sequence, sites):
+    """
+    Store the sites of one sequence (possibly none) as its own file, written to a
+    temporary name and swapped in, so concurrent cohort jobs never see a partial
+    shard and never overwrite each other's sequences.
+    """
+    path = _shard_path(index_dir, sequence)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    sites.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+def transcript_sites(index, sequence):
+    """Per-transcript 8mer / 7mer-m8 / 7mer-A1 counts and best (lowest) energy of one miRNA"""
+    transcript, site_type, energy = index.scan(sequence)
+    if len(transcript) == 0:
+        return empty_sites()
+    df = pd.DataFrame({"transcript": transcript, "n_8mer": site_type == SITE_8MER,
+                       "n_7mer_m8": site_type == SITE_7MER_M8, "n_7mer_a1": site_type == SITE_7MER_A1,
+                       "energy": energy})
+    df = df.groupby("transcript", sort=True).agg(
+        n_8mer=("n_8mer", "sum"), n_7mer_m8=("n_7mer_m8", "sum"), n_7mer_a1=("n_7mer_a1", "sum"),
+        energy=("energy", "min")).reset_index()
+    df.insert(0, "sequence", sequence)
+    return df[SITE_COLUMNS]
+
+# Worker-side seed index, opened once per pool process
+_worker_index = None
+
+def _open_worker_index(fasta):
+    """Pool initializer: map the seed index (already current) without rebuilding it"""
+    global _worker_index
+    _worker_index = load_seed_index(fasta)
+    threadpool_limits(1)
+
+def _worker_sites(sequence):
+    return transcript_sites(_worker_index, sequence)
+
+def scan_sites(fasta, sequences, threads=1):
+    """
+    Site table for the given mature sequences. Sequences scanned before against the
+    same transcript FASTA come from their cache shards; the rest are scanned (one miRNA
+    per task across a process pool) and each stored as a new shard.
+    """
+    index = load_seed_index(fasta)
+    index_dir = default_index_dir(fasta)
+    sequences = sorted(set(sequences))
+    cached = {s: _read_site_shard(index_dir, s) for s in sequences}
+    missing = [s for s in sequences if cached[s] is None]
+    print(f"Seed sites: {len(sequences) - len(missing)} miRNA sequence(s) cached, {len(missing)} to scan")
+    if missing:
+        if threads <= 1 or len(missing) == 1:
+            new = [transcript_sites(index, s) for s in missing]
+        else:
+            ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else mp.get_context()
+            with ctx.Pool(min(threads, len(missing)), initializer=_open_worker_index, initargs=(fasta,)) as pool:
+                new = pool.map(_worker_sites, missing)
+        for sequence, sites in zip(missing, new):
+            _write_site_shard(index_dir, sequence, sites)
+            cached[sequence] = sites
+    found = [df for df in cached.values() if len(df)]
+    sites = pd.concat(found, ignore_index=True).astype(SITE_DTYPES) if found else empty_sites()
+    return index, sites
+
+def load_localization(path, genes):
+    """
+    Cytoplasmic fraction (0-1) of every expression-matrix gene from a table with a gene
+    column and either cytoplasmic_fraction or cn_rci (lncATLAS log2 cytoplasm/nucleus
+    ratio). Genes are matched with Ensembl versions stripped; unknown genes get NaN.
+    """
+    sep = "," if path.endswith(".csv") else "\t"
+    table = pd.read_csv(path, sep=sep)
+    if "gene" not in table.columns:
+        raise ValueError(f"Localization table {path} lacks a gene column")
+    if "cytoplasmic_fraction" in table.columns:
+        fraction = pd.to_numeric(table["cytoplasmic_fraction"], errors="coerce")
+    elif "cn_rci" in table.columns:
+        ratio = np.exp2(pd.to_numeric(table["cn_rci"], errors="coerce"))
+        fraction = ratio / (1 + ratio)
+    else:
+        raise ValueError(f"Localization table {path} needs a cytoplasmic_fraction or cn_rci column")
+    keys = strip_ensembl_version(table["gene"].astype(str))
+    by_gene = pd.Series(fraction.to_numpy(), index=keys.to_numpy()).groupby(level=0).mean()
+    stripped = strip_ensembl_version(pd.Series(pd.Index(genes).astype(str)))
+    return by_gene.reindex(stripped.to_numpy()).to_numpy(dtype=np.float64)
+
+class SequenceFeatures:
+    """
+    Gene-indexed sequence features for feature engineering: seed-site counts and best
+    duplex energy per (miRNA, target) as miRNA x gene sparse matrices, which genes and
+    miRNAs have sequences (others get NaN rather than zero sites), and localization.
+    """
+
+    def __init__(self, sites, energy, target_known, mirna_known, localization):
+        self.sites = sites
+        self.energy = energy
+        self.target_known = target_known
+        self.mirna_known = mirna_known
+        self.localization = localization
+
+    def target_values(self, mir, idx):
+        """(site counts, energies) of one miRNA on the target genes idx; NaN where unknown"""
+        if not self.mirna_known[mir]:
+            nan = np.full(len(idx), np.nan)
+            return nan, nan.copy()
+        sites = self.sites[mir, idx].toarray().ravel().astype(np.float64)
+        energy = self.energy[mir, idx].toarray().ravel()
+        sites[~self.target_known[idx]] = np.nan
+        energy = np.where(sites > 0, energy, np.nan)
+        return sites, energy
+
+    def block_columns(self, mir, lnc_idx, mrna_idx):
+        """
+        Triplet columns, lncRNA-major like the correlation features: mre_counts is the
+        7mer/8mer sites of the miRNA on the lncRNA plus on the mRNA, seed_match_energy
+        the lower of their best site energies and cytoplasmic_localization the lncRNA's.
+        """
+        lnc_sites, lnc_energy = self.target_values(mir, lnc_idx)
+        mrna_sites, mrna_energy = self.target_values(mir, mrna_idx)
+        n_lnc, n_mrna = len(lnc_idx), len(mrna_idx)
+        localization = (np.full(n_lnc, np.nan) if self.localization is None
+                        else self.localization[lnc_idx])
+        return {
+            "mre_counts": np.repeat(lnc_sites, n_mrna) + np.tile(mrna_sites, n_lnc),
+            "seed_match_energy": np.fmin(np.repeat(lnc_energy, n_mrna), np.tile(mrna_energy, n_lnc)),
+            "cytoplasmic_localization": np.repeat(localization, n_mrna),
+        }
+
+def sequence_features(cfg, paths, genes, mir_lnc, mir_mrna, threads=1):
+    """
+    SequenceFeatures for the candidate miRNA -> target edges, or None when neither
+    the transcript and miRNA FASTA files nor a localization table are available.
+    """
+    n_genes = len(genes)
+    transcript_fasta = paths.get("transcript_fasta") or ""
+    mirna_fasta = paths.get("mirna_fasta") or ""
+    localization_path = paths.get("localization_file") or ""
+    has_sequences = os.path.exists(transcript_fasta) and os.path.exists(mirna_fasta)
+    localization = load_localization(localization_path, genes) if os.path.exists(localization_path) else None
+    if not has_sequences and localization is None:
+        return None
+
+    empty = sparse.csr_matrix((n_genes, n_genes))
+    if not has_sequences:
+        return SequenceFeatures(empty, empty, np.zeros(n_genes, dtype=bool), np.zeros(n_genes, dtype=bool),
+                                localization)
+
+    edges = (mir_lnc + mir_mrna).tocsr()
+    mirna_rows = np.flatnonzero(edges.getnnz(axis=1))
+    names = pd.Index(genes)[mirna_rows]
+    mature = load_mirna_sequences(mirna_fasta, names)
+    index, sites = scan_sites(transcript_fasta, sorted(set(mature.values())), threads)
+
+    # Transcript -> gene; a gene takes the site counts of its transcript with the most
+    # 7mer/8mer sites and the best energy over all its transcripts
+    transcript_rows = index.transcript_genes(genes)
+    sites = sites.assign(gene=transcript_rows[sites["transcript"].to_numpy()])
+    sites = sites[sites["gene"] >= 0]
+    sites = sites.assign(n_sites=sites[["n_8mer", "n_7mer_m8", "n_7mer_a1"]].sum(axis=1))
+    per_gene = sites.groupby(["sequence", "gene"], sort=False).agg(
+        n_sites=("n_sites", "max"), energy=("energy", "min")).reset_index()
+
+    sequence_of = pd.Series([mature.get(n) for n in names], index=mirna_rows).dropna()
+    pairs = pd.DataFrame({"mirna": sequence_of.index, "sequence": sequence_of.to_numpy()}).merge(
+        per_gene, on="sequence")
+    # Only candidate edges are kept
+    candidate = np.asarray(edges[pairs["mirna"].to_numpy(), pairs["gene"].to_numpy()]).ravel() != 0
+    pairs = pairs[candidate]
+    rows, cols = pairs["mirna"].to_numpy(), pairs["gene"].to_numpy()
+    site_matrix = sparse.csr_matrix((pairs["n_sites"].to_numpy(np.float32), (rows, cols)), shape=(n_genes, n_genes))
+    energy_matrix = sparse.csr_matrix((pairs["energy"].to_numpy(np.float64), (rows, cols)), shape=(n_genes, n_genes))
+
+    target_known = np.zeros(n_genes, dtype=bool)
+    target_known[transcript_rows[transcript_rows >= 0]] = True
+    mirna_known = np.zeros(n_genes, dtype=bool)
+    mirna_known[sequence_of.index.to_numpy()] = True
+    print(f"Sequence features: {int(mirna_known.sum())} miRNAs with mature sequences, "
+          f"{int(target_known.sum())} genes with transcripts, {len(pairs)} candidate pairs with 7mer/8mer sites")
+    return SequenceFeatures(site_matrix, energy_matrix, target_known, mirna_known, localization)
@@ -0,0 +1,228 @@
+# modules/sequence_index.py
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+from interaction_index import file_checksum, index_is_current
+from id_resolver import strip_ensembl_version
+
+INDEX_VERSION = 1
+
+# Seed sites are found through the 6-mer pairing with miRNA nucleotides 2-7
+SEED_K = 6
+# A, C, G, T/U -> 0..3; anything else (N, separators) -> 4 and never matches
+BASES = "ACGT"
+NO_BASE = 4
+_CODES = np.full(256, NO_BASE, dtype=np.uint8)
+for _code, _chars in enumerate(("Aa", "Cc", "Gg", "TtUu")):
+    for _c in _chars:
+        _CODES[ord(_c)] = _code
+
+# Site types (TargetScan): 7mer-A1 = nt 2-7 match + A opposite nt 1, 7mer-m8 = nt 2-8
+# match, 8mer = both; bare 6mers are not counted
+SITE_6MER, SITE_7MER_A1, SITE_7MER_M8, SITE_8MER = 0, 1, 2, 3
+
+# RNA/RNA Watson-Crick nearest-neighbour stacks (Turner 2004, kcal/mol), keyed by the
+# miRNA dinucleotide 5'->3' (T for U); the target strand is its complement
+STACK_ENERGY = {
+    "AA": -0.93, "TT": -0.93, "AT": -1.10, "TA": -1.33, "CT": -2.08, "AG": -2.08,
+    "CA": -2.11, "TG": -2.11, "GT": -2.24, "AC": -2.24, "GA": -2.35, "TC": -2.35,
+    "CG": -2.36, "GG": -3.26, "CC": -3.26, "GC": -3.42,
+}
+DUPLEX_INIT = 4.09
+
+def default_index_dir(fasta):
+    """databases/transcripts.fa -> databases/transcripts.seed_index"""
+    return os.path.splitext(fasta)[0] + ".seed_index"
+
+def read_fasta(path):
+    """Yield (header, sequence) records of a FASTA file; header without the '>'"""
+    header, chunks = None, []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                if header is not None:
+                    yield header, "".join(chunks)
+                header, chunks = line[1:], []
+            elif line:
+                chunks.append(line)
+    if header is not None:
+        yield header, "".join(chunks)
+
+def encode(sequence):
+    """Nucleotide string -> uint8 codes (see BASES)"""
+    return _CODES[np.frombuffer(sequence.encode("ascii", "replace"), dtype=np.uint8)]
+
+def gene_keys(header):
+    """
+    Names a transcript may be known by in the expression matrix, most specific first:
+    gene: and gene_symbol: fields of Ensembl headers, '|'-separated ID fields, and the
+    first header token itself.
+    """
+    tokens = header.split()
+    keys = [t.split(":", 1)[1] for t in tokens[1:] if t.startswith(("gene:", "gene_symbol:"))]
+    if tokens:
+        keys.extend(field for field in tokens[0].split("|") if field)
+        keys.append(tokens[0])
+    return "|".join(dict.fromkeys(keys))
+
+def build_seed_index(fasta, index_dir=None):
+    """
+    Compile transcript sequences into a seed index: all sequences concatenated as
+    2-bit codes with a separator before each transcript, and the positions of every
+    6-mer grouped by its code (CSR over the 4**6 codes), so the candidate sites of a
+    miRNA are one slice instead of a scan over the transcriptome.
+    """
+    index_dir = index_dir or default_index_dir(fasta)
+    print(f"Compiling seed index for {fasta} ...")
+    names, keys, parts = [], [], []
+    for header, sequence in read_fasta(fasta):
+        names.append(header.split()[0] if header.split() else header)
+        keys.append(gene_keys(header))
+        parts.append(np.array([NO_BASE], dtype=np.uint8))
+        parts.append(encode(sequence))
+    parts.append(np.array([NO_BASE], dtype=np.uint8))
+    seq = np.concatenate(parts)
+    lengths = np.array([len(p) for p in parts[1::2]], dtype=np.int64)
+    starts = np.cumsum(np.concatenate([[1], lengths[:-1] + 1])) if len(lengths) else np.zeros(0, dtype=np.int64)
+
+    # 6-mer code at every position; windows touching a non-ACGT code are skipped
+    n_windows = max(len(seq) - SEED_K + 1, 0)
+    kmers = np.zeros(n_windows, dtype=np.int32)
+    valid = np.ones(n_windows, dtype=bool)
+    for j in range(SEED_K):
+        window = seq[j:j + n_windows]
+        kmers = kmers * 4 + np.minimum(window, 3)
+        valid &= window < NO_BASE
+    pos_dtype = np.int32 if len(seq) < np.iinfo(np.int32).max else np.int64
+    positions = np.flatnonzero(valid).astype(pos_dtype)
+    order = np.argsort(kmers[positions], kind="stable")
+    kmer_indptr = np.concatenate([[0], np.cumsum(np.bincount(kmers[positions], minlength=4 ** SEED_K))])
+    positions = positions[order]
+
+    # Build into a temporary directory and swap it in, so readers never see a partial index
+    tmp_dir = f"{index_dir}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, "sequence.npy"), seq)
+    np.save(os.path.join(tmp_dir, "starts.npy"), starts.astype(np.int64))
+    np.save(os.path.join(tmp_dir, "lengths.npy"), lengths)
+    np.save(os.path.join(tmp_dir, "kmer_indptr.npy"), kmer_indptr.astype(np.int64))
+    np.save(os.path.join(tmp_dir, "kmer_positions.npy"), positions)
+    pd.DataFrame({"transcript": names, "gene_keys": keys}).to_csv(
+        os.path.join(tmp_dir, "transcripts.tsv"), sep="\t", index=False)
+    stat = os.stat(fasta)
+    meta = {
+        "version": INDEX_VERSION,
+        "source": os.path.abspath(fasta),
+        "sha256": file_checksum(fasta),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "k": SEED_K,
+        "n_transcripts": len(names),
+        "n_bases": int(lengths.sum()),
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.isdir(index_dir):
+        shutil.rmtree(index_dir)
+    os.replace(tmp_dir, index_dir)
+    print(f"Indexed {len(names)} transcripts ({meta['n_bases']} nt) in {index_dir}")
+    return index_dir
+
+def seed_index_is_current(fasta, index_dir, refresh_stat=False):
+    """True if index_dir was compiled from the current contents of fasta (see index_is_current)"""
+    return index_is_current(fasta, index_dir, version=INDEX_VERSION, refresh_stat=refresh_stat)
+
+def cumulative_duplex_energy(mature):
+    """
+    Energy of a contiguous Watson-Crick duplex over miRNA nucleotides 2..k, for every
+    k (array index k; entries below 3 unused): initiation plus the stacks of nt 2..k.
+    """
+    energy = np.full(len(mature) + 1, np.nan)
+    total = DUPLEX_INIT
+    for k in range(3, len(mature) + 1):
+        total += STACK_ENERGY.get(mature[k - 2:k], 0.0)
+        energy[k] = total
+    return energy
+
+class SeedIndex:
+    """Memory-mapped transcript seed index (see build_seed_index)"""
+
+    def __init__(self, seq, starts, lengths, kmer_indptr, kmer_positions, transcripts):
+        self.seq = seq
+        self.starts = starts
+        self.lengths = lengths
+        self.kmer_indptr = kmer_indptr
+        self.kmer_positions = kmer_positions
+        self.transcripts = transcripts
+
+    def scan(self, mature):
+        """
+        7mer/8mer sites of a mature miRNA (DNA or RNA alphabet, 5'->3').
+        Returns (transcript, site_type, energy) arrays, one entry per site. energy is the
+        nearest-neighbour energy of the contiguous pairing from nt 2 through the seed
+        and on into the 3' part of the miRNA, up to the first mismatch.
+        """
+        mature = mature.upper().replace("U", "T")
+        codes = encode(mature).astype(np.int64)
+        if len(mature) < 8 or (codes[1:8] >= NO_BASE).any():
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8), np.zeros(0)
+        # Target site (5'->3') of nt 2-7 is their reverse complement; nt i pairs with p + 7 - i
+        site = 0
+        for c in codes[6:0:-1]:
+            site = site * 4 + (3 - int(c))
+        positions = np.asarray(self.kmer_positions[self.kmer_indptr[site]:self.kmer_indptr[site + 1]],
+                               dtype=np.int64)
+        m8 = self.seq[positions - 1] == 3 - codes[7]
+        a1 = self.seq[positions + SEED_K] == 0
+        site_type = (m8.astype(np.int8) * 2 + a1.astype(np.int8))
+        counted = site_type > SITE_6MER
+        positions, site_type, m8 = positions[counted], site_type[counted], m8[counted]
+
+        # Extend the pairing past nt 8 while the target keeps complementing the miRNA
+        paired_to = np.where(m8, 8, 7)
+        extending = m8.copy()
+        for i in range(9, len(mature) + 1):
+            target = positions + 7 - i
+            ok = extending & (target >= 0)
+            ok[ok] = self.seq[target[ok]] == 3 - codes[i - 1]
+            paired_to[ok] = i
+            extending = ok
+        energy = cumulative_duplex_energy(mature)[paired_to]
+        transcript = np.searchsorted(self.starts, positions, side="right") - 1
+        return transcript, site_type, energy
+
+    def transcript_genes(self, genes):
+        """Expression matrix row of every transcript (-1 if none of its gene keys matches)"""
+        stripped = strip_ensembl_version(pd.Series(pd.Index(genes).astype(str)))
+        first = ~stripped.duplicated()
+        lookup = pd.Series(np.flatnonzero(first), index=stripped[first].to_numpy())
+
+        # One row per (transcript, key) in priority order; the first matching key wins
+        keys = self.transcripts["gene_keys"].str.split("|").explode()
+        keys = keys[keys.notna() & (keys != "")]
+        matched = lookup.reindex(strip_ensembl_version(keys.astype(str)).to_numpy()).to_numpy()
+        hits = pd.Series(matched, index=keys.index).dropna()
+        hits = hits[~hits.index.duplicated()]
+        rows = np.full(len(self.transcripts), -1, dtype=np.int64)
+        rows[hits.index.to_numpy()] = hits.to_numpy().astype(np.int64)
+        return rows
+
+def load_seed_index(fasta, index_dir=None):
+    """Open the seed index of fasta via mmap, rebuilding it first if fasta changed"""
+    index_dir = index_dir or default_index_dir(fasta)
+    if not seed_index_is_current(fasta, index_dir):
+        build_seed_index(fasta, index_dir)
+    return SeedIndex(
+        np.load(os.path.join(index_dir, "sequence.npy"), mmap_mode="r"),
+        np.load(os.path.join(index_dir, "starts.npy")),
+        np.load(os.path.join(index_dir, "lengths.npy")),
+        np.load(os.path.join(index_dir, "kmer_indptr.npy")),
+        np.load(os.path.join(index_dir, "kmer_positions.npy"), mmap_mode="r"),
+        pd.read_csv(os.path.join(index_dir, "transcripts.tsv"), sep="\t", dtype=str, keep_default_na=False),
+    )
@@ -0,0 +1,205 @@
+# modules/sponge.py
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from threadpoolctl import threadpool_limits
+
+# Null-model tables are shared by every run and cohort with the same sample count
+NULL_TABLE_DIR = "databases/sponge_null"
+NULL_TABLE_VERSION = 2
+NULL_SIMULATIONS = 10_000
+NULL_SEED = 42
+
+# Pairs sharing more miRNAs than this are tested against the NULL_MAX_K table
+NULL_MAX_K = 10
+
+# Gene-gene correlation bins the null distributions are simulated at
+NULL_RHO_GRID = np.round(np.arange(0.0, 1.0, 0.05), 2)
+
+# Upper bound on values held by one batched regression (rows x samples x predictors)
+BATCH_VALUES = 20_000_000
+
+def mscor(g1, g2, mirs):
+    """
+    Batched sample multiple sensitivity correlation (SPONGE).
+    g1, g2: (P, m) expression of the two genes; mirs: (P, m, k) shared miRNAs.
+    mscor = cor(g1, g2) - pcor(g1, g2 | miRNAs); returns (mscor, cor), each of shape (P,).
+    The partial correlation needs m - k - 2 >= 1 residual degrees of freedom; with fewer
+    samples mscor is NaN.
+    """
+    g1 = g1 - g1.mean(axis=1, keepdims=True)
+    g2 = g2 - g2.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.einsum('ij,ij->i', g1, g2) / np.sqrt(np.einsum('ij,ij->i', g1, g1) * np.einsum('ij,ij->i', g2, g2))
+
+    n_samples, k = mirs.shape[1], mirs.shape[2]
+    if n_samples - k - 2 < 1:
+        return np.full(len(r), np.nan), r
+
+    # Residualize both genes on [1, miRNAs] with one batched QR
+    design = np.concatenate([np.ones(mirs.shape[:2] + (1,)), mirs], axis=2)
+    q, _ = np.linalg.qr(design)
+    genes = np.stack([g1, g2], axis=2)
+    resid = genes - q @ (np.swapaxes(q, 1, 2) @ genes)
+    e1, e2 = resid[:, :, 0], resid[:, :, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pcor = np.einsum('ij,ij->i', e1, e2) / np.sqrt(np.einsum('ij,ij->i', e1, e1) * np.einsum('ij,ij->i', e2, e2))
+    return r - pcor, r
+
+def _zero_mscor_models(rho, k, n, rng):
+    """
+    Sample n population models with cor(g1, g2) = rho and mscor = 0 exactly.
+    Genes have unit variance and load on k independent standard-normal miRNAs
+    (g_i = miRNAs . w_i + e_i). Returns w1, w2 of shape (n, k) and cov(e1, e2).
+    """
+    # g1: share a of its variance explained by miRNAs, loading direction u
+    a = rng.uniform(rho**2, 1.0, n)
+    u = rng.standard_normal((n, k))
+    u /= np.linalg.norm(u, axis=1, keepdims=True)
+    w1 = np.sqrt(a)[:, None] * u
+
+    # g2 loads along d, at angle theta to u, with the norm t solving mscor = 0:
+    # rho - sqrt(a) cos(theta) t = rho sqrt(1 - a) sqrt(1 - t^2)
+    if k == 1:
+        cos = np.ones(n)
+        d = u
+    else:
+        cos = rng.uniform(rho / np.sqrt(a), 1.0)
+        v = rng.standard_normal((n, k))
+        v -= np.einsum('ij,ij->i', v, u)[:, None] * u
+        v /= np.linalg.norm(v, axis=1, keepdims=True)
+        d = cos[:, None] * u + np.sqrt(1 - cos**2)[:, None] * v
+
+    lo = np.zeros(n)
+    hi = np.ones(n)
+    if rho > 0:
+        for _ in range(60):
+            t = (lo + hi) / 2
+            g = rho - np.sqrt(a) * cos * t - rho * np.sqrt(1 - a) * np.sqrt(1 - t**2)
+            lo = np.where(g > 0, t, lo)
+            hi = np.where(g > 0, hi, t)
+    t = lo
+    w2 = t[:, None] * d
+    c = rho * np.sqrt((1 - a) * (1 - t**2))
+    return w1, w2, c
+
+def simulate_null_mscor(n_samples, k, rho, n_sim, rng):
+    """Sample mscor values over n_samples observations from models whose true mscor is 0"""
+    w1, w2, c = _zero_mscor_models(rho, k, n_sim, rng)
+    var1 = np.einsum('ij,ij->i', w1, w1)
+    var2 = np.einsum('ij,ij->i', w2, w2)
+    s1 = np.sqrt(1 - var1)
+    chunk = max(1, BATCH_VALUES // (n_samples * (k + 3)))
+    out = np.empty(n_sim)
+    for start in range(0, n_sim, chunk):
+        sl = slice(start, start + chunk)
+        n = len(out[sl])
+        mirs = rng.standard_normal((n, n_samples, k))
+        z1 = rng.standard_normal((n, n_samples))
+        z2 = rng.standard_normal((n, n_samples))
+        e1 = s1[sl, None] * z1
+        e2 = (c[sl] / s1[sl])[:, None] * z1 + np.sqrt(np.clip((1 - var2[sl]) - c[sl]**2 / (1 - var1[sl]), 0, None))[:, None] * z2
+        g1 = np.einsum('nmk,nk->nm', mirs, w1[sl]) + e1
+        g2 = np.einsum('nmk,nk->nm', mirs, w2[sl]) + e2
+        out[sl], _ = mscor(g1, g2, mirs)
+    return out
+
+def null_table_k(k):
+    """Shared-miRNA count whose null table is used for pairs sharing k miRNAs"""
+    return min(int(k), NULL_MAX_K)
+
+def null_table_path(n_samples, k, cache_dir=NULL_TABLE_DIR):
+    return os.path.join(cache_dir, f"mscor_null_v{NULL_TABLE_VERSION}_m{n_samples}_k{k}_n{NULL_SIMULATIONS}.npz")
+
+def _simulate_null_row(n_samples, k, i):
+    """Sorted null mscor samples for NULL_RHO_GRID bin i, seeded per bin"""
+    rng = np.random.default_rng([NULL_SEED, n_samples, k, i])
+    return np.sort(simulate_null_mscor(n_samples, k, NULL_RHO_GRID[i], NULL_SIMULATIONS, rng))
+
+def load_null_table(n_samples, k, cache_dir=NULL_TABLE_DIR, threads=1):
+    """
+    Sorted null mscor samples per NULL_RHO_GRID bin for (n_samples, k).
+    Simulated once and cached on disk; later runs and cohorts reuse the file.
+    With threads > 1 the rho bins are simulated on a thread pool (the batched
+    QR and einsum calls release the GIL).
+    """
+    path = null_table_path(n_samples, k, cache_dir)
+    if os.path.exists(path):
+        return np.load(path)["null"]
+
+    print(f"Simulating SPONGE null model for {n_samples} samples and {k} miRNA(s)...")
+    table = np.empty((len(NULL_RHO_GRID), NULL_SIMULATIONS), dtype=np.float32)
+    with threadpool_limits(1), ThreadPoolExecutor(max(1, threads)) as pool:
+        rows = pool.map(lambda i: _simulate_null_row(n_samples, k, i), range(len(NULL_RHO_GRID)))
+        for i, row in enumerate(rows):
+            table[i] = row
+
+    # Write to a temporary name first so concurrent runs never read a partial table
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, null=table, rho=NULL_RHO_GRID)
+    os.replace(tmp_path, path)
+    return table
+
+def mscor_pvalues(scores, cors, n_samples, k, cache_dir=NULL_TABLE_DIR, threads=1):
+    """
+    One-sided p-values for positive sensitivity by lookup in the cached null table.
+    Each score is compared with the null at the bin nearest its |cor|; negatively
+    correlated pairs are mirrored (flipping one gene negates both cor and mscor).
+    k above NULL_MAX_K shares the NULL_MAX_K table.
+    """
+    table = load_null_table(n_samples, null_table_k(k), cache_dir, threads)
+    signed = np.sign(cors) * scores
+    bins = np.abs(np.abs(np.nan_to_num(cors))[:, None] - NULL_RHO_GRID[None, :]).argmin(axis=1)
+    pvalues = np.full(len(scores), np.nan)
+    for b in np.unique(bins):
+        sel = (bins == b) & np.isfinite(signed)
+        n_ge = table.shape[1] - np.searchsorted(table[b], signed[sel], side='left')
+        pvalues[sel] = (n_ge + 1) / (table.shape[1] + 1)
+    return pvalues
+
+def triplet_sensitivity(expr, lnc_idx, mir_idx, mrna_idx, cache_dir=NULL_TABLE_DIR, threads=1):
+    """
+    SPONGE sensitivity for each triplet: the mscor of its lncRNA-mRNA pair given every
+    miRNA the pair shares among the candidate triplets, and its null-table p-value.
+    Pairs sharing too many miRNAs for the sample count (n_samples - k - 2 < 1) get NaN.
+    expr is a genes x samples array; returns (sensitivity, pvalue) aligned to the triplets.
+    """
+    n_samples = expr.shape[1]
+    lnc_idx = np.asarray(lnc_idx)
+    mir_idx = np.asarray(mir_idx)
+    mrna_idx = np.asarray(mrna_idx)
+
+    # Unique triplets sorted by pair, so each pair's shared miRNAs form one contiguous run
+    unique = np.unique(np.column_stack([lnc_idx, mrna_idx, mir_idx]), axis=0)
+    pair_start = np.flatnonzero(np.r_[True, np.any(unique[1:, :2] != unique[:-1, :2], axis=1)])
+    n_shared = np.diff(np.r_[pair_start, len(unique)])
+
+    pair_score = np.full(len(pair_start), np.nan)
+    pair_pvalue = np.full(len(pair_start), np.nan)
+    for k in np.unique(n_shared):
+        if n_samples - k - 2 < 1:
+            continue
+        pairs = np.flatnonzero(n_shared == k)
+        starts = pair_start[pairs]
+        lnc = unique[starts, 0]
+        mrna = unique[starts, 1]
+        mirs = unique[starts[:, None] + np.arange(k)[None, :], 2]
+        scores = np.empty(len(pairs))
+        cors = np.empty(len(pairs))
+        chunk = max(1, BATCH_VALUES // (n_samples * (k + 3)))
+        for start in range(0, len(pairs), chunk):
+            sl = slice(start, start + chunk)
+            mir_expr = np.asarray(expr[mirs[sl].ravel()], dtype=np.float64).reshape(len(lnc[sl]), k, n_samples)
+            scores[sl], cors[sl] = mscor(np.asarray(expr[lnc[sl]], dtype=np.float64),
+                                         np.asarray(expr[mrna[sl]], dtype=np.float64),
+                                         np.swapaxes(mir_expr, 1, 2))
+        pair_score[pairs] = scores
+        pair_pvalue[pairs] = mscor_pvalues(scores, cors, n_samples, int(k), cache_dir, threads)
+
+    # Map every triplet back to its pair
+    pair_keys = pd.MultiIndex.from_arrays([unique[pair_start, 0], unique[pair_start, 1]])
+    pair_of_triplet = pair_keys.get_indexer(pd.MultiIndex.from_arrays([lnc_idx, mrna_idx]))
+    return pair_score[pair_of_triplet], pair_pvalue[pair_of_triplet]
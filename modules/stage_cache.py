@@ -0,0 +1,177 @@
+# modules/stage_cache.py
+
+import os
+import json
+import shutil
+import hashlib
+import datetime
+import yaml
+
+from interaction_index import file_checksum
+from instrumentation import count
+from stage_io import ensure_parent, stage_label, stage_paths
+
+CACHE_VERSION = 1
+# Stage code is part of the key; helpers are found next to this module
+MODULES_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = "results/.stage_cache"
+# Least recently used entries are evicted once the cache grows past this size
+DEFAULT_MAX_GB = 20
+
+# Checksums of unchanged files are reused instead of re-reading them
+HASH_MEMO = "hashes.json"
+
+def _load_memo(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, HASH_MEMO), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_memo(cache_dir, memo):
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = os.path.join(cache_dir, f"{HASH_MEMO}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(memo, f)
+    os.replace(tmp_path, os.path.join(cache_dir, HASH_MEMO))
+
+def content_hash(path, memo):
+    """
+    SHA-256 of a file, memoized on (size, mtime) so unchanged files are not re-read.
+    A directory (partitioned feature store) hashes the names and hashes of its files.
+    """
+    if os.path.isdir(path):
+        files = sorted(os.listdir(path))
+        listing = [(name, content_hash(os.path.join(path, name), memo)) for name in files]
+        return hashlib.sha256(json.dumps(listing).encode("utf-8")).hexdigest()
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    entry = memo.get(key)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["sha256"]
+    digest = file_checksum(path)
+    memo[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+    return digest
+
+def stage_key(stage, inputs, cfg, config_keys, modules, memo):
+    """
+    Cache key of one stage run: content hashes of its named inputs (missing optional
+    inputs hash as absent), the values of only the config keys the stage reads, and
+    the source of the stage module plus the helper modules it uses. Paths are not
+    part of the key, so cohorts with identical inputs share entries.
+    """
+    code_paths = [os.path.join(MODULES_DIR, name) for name in [f"{stage}.py", *modules]]
+    key = {
+        "version": CACHE_VERSION,
+        "stage": stage,
+        "inputs": {name: content_hash(p, memo) if os.path.exists(p) else None for name, p in inputs.items()},
+        "config": {k: cfg.get(k) for k in sorted(config_keys)},
+        "code": {os.path.basename(p): content_hash(p, memo) for p in code_paths},
+    }
+    blob = json.dumps(key, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest(), key
+
+def copy_output(src, dest):
+    """Copy a stage output, a file or a directory, replacing whatever is at dest"""
+    if os.path.isdir(src):
+        if os.path.isdir(dest):
+            shutil.rmtree(dest)
+        elif os.path.exists(dest):
+            os.remove(dest)
+        shutil.copytree(src, dest)
+    else:
+        if os.path.isdir(dest):
+            shutil.rmtree(dest)
+        shutil.copyfile(src, dest)
+
+def _entry_size(entry_dir):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(entry_dir) for name in names)
+
+def evict(cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_GB * 1024**3):
+    """Drop least recently used entries until the cache fits in max_bytes"""
+    entries = []
+    for stage in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+        stage_dir = os.path.join(cache_dir, stage)
+        if not os.path.isdir(stage_dir):
+            continue
+        for key in os.listdir(stage_dir):
+            meta_path = os.path.join(stage_dir, key, "meta.json")
+            if os.path.exists(meta_path):
+                entry_dir = os.path.dirname(meta_path)
+                entries.append((os.path.getmtime(meta_path), _entry_size(entry_dir), entry_dir))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_dir in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+        print(f"Evicted stage cache entry {entry_dir}")
+
+def cached(stage, main, inputs, outputs, config_keys, modules=(), cache_dir=CACHE_DIR):
+    """
+    Wrap a stage's main() with a content-addressed cache: when a previous run saw the
+    same inputs, config values and code, its outputs are copied back instead of
+    recomputing them. Otherwise main() runs and its outputs are stored under
+    <cache_dir>/<stage>/<key>/. Disabled with stage_cache: false in the config.
+    inputs and outputs map file names to default paths (see stage_io.stage_paths);
+    inputs may be a function of the config for stages whose input paths are configurable.
+    """
+    def run(*args, **kwargs):
+        cfg = _load_config()
+        if not cfg.get("stage_cache", True):
+            return main(*args, **kwargs)
+
+        memo = _load_memo(cache_dir)
+        stage_inputs = stage_paths(inputs(cfg) if callable(inputs) else inputs)
+        stage_outputs = list(stage_paths({}, outputs).values())
+        key, key_doc = stage_key(stage, stage_inputs, cfg, config_keys, modules, memo)
+        entry_dir = os.path.join(cache_dir, stage, key)
+        meta_path = os.path.join(entry_dir, "meta.json")
+
+        if os.path.exists(meta_path):
+            print(f"[{stage_label(stage)}] inputs and settings unchanged; reusing cached outputs {entry_dir}")
+            with open(meta_path, "r") as f:
+                output_hashes = json.load(f)["output_hashes"]
+            for i, path in enumerate(stage_outputs):
+                ensure_parent(path)
+                copy_output(os.path.join(entry_dir, str(i)), path)
+                # Downstream stages need not re-hash restored outputs (directories are
+                # hashed through their files)
+                if os.path.isfile(path):
+                    stat = os.stat(path)
+                    memo[os.path.abspath(path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                                   "sha256": output_hashes[i]}
+            os.utime(meta_path)  # mark as recently used
+            _save_memo(cache_dir, memo)
+            count("cache_hit", 1)
+            return None
+
+        count("cache_hit", 0)
+        result = main(*args, **kwargs)
+        if not all(os.path.exists(p) for p in stage_outputs):
+            return result
+
+        # Store outputs; built in a temporary directory and swapped in, like the indexes
+        tmp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for i, path in enumerate(stage_outputs):
+            copy_output(path, os.path.join(tmp_dir, str(i)))
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(dict(key_doc, outputs=list(outputs),
+                           output_hashes=[content_hash(p, memo) for p in stage_outputs],
+                           created=datetime.datetime.now().isoformat(timespec="seconds")), f, indent=2)
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.replace(tmp_dir, entry_dir)
+        _save_memo(cache_dir, memo)
+        evict(cache_dir, float(cfg.get("stage_cache_max_gb", DEFAULT_MAX_GB)) * 1024**3)
+        return result
+
+    return run
+
+def _load_config(cfg_path="config/config.yaml"):
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r") as f:
+            return yaml.safe_load(f) or {}
+    return {}
@@ -0,0 +1,36 @@
+# modules/stage_io.py
+
+import os
+import sys
+
+def snakemake_job():
+    """
+    The `snakemake` object Snakemake injects into a script run by a rule (inputs,
+    outputs, wildcards, threads), or None when the module runs standalone.
+    """
+    return getattr(sys.modules.get("__main__"), "snakemake", None)
+
+def stage_paths(inputs, outputs=None):
+    """
+    Resolve a stage's named files. inputs and outputs map the rule's input/output
+    names to standalone defaults; under Snakemake the job's paths replace them, so
+    the same module serves the single-run rules and the per-cohort batch rules.
+    """
+    job = snakemake_job()
+    paths = {}
+    for section, named in (("input", inputs), ("output", outputs or {})):
+        files = getattr(job, section, None)
+        for name, default in named.items():
+            path = files.get(name) if files is not None else None
+            paths[name] = str(path) if path else default
+    return paths
+
+def stage_label(stage):
+    """Stage name qualified by the batch-mode cohort wildcard, e.g. feature_engineering.GSE87340"""
+    wildcards = getattr(snakemake_job(), "wildcards", None)
+    cohort = wildcards.get("cohort") if wildcards is not None else None
+    return f"{stage}.{cohort}" if cohort else stage
+
+def ensure_parent(path):
+    """Create the directory an output file goes into"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
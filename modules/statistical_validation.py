@@ -1,65 +1,264 @@
 # modules/statistical_validation.py
 
 import pandas as pd
-import statsmodels.api as sm
 import numpy as np
 import os
+import yaml
 from scipy.stats import norm  # For p-value calculation
+from threadpoolctl import threadpool_limits
 
-def main():
-    predictions_path = "results/predicted_triplets.csv"
-    norm_counts_path = "results/norm_counts.csv"
-    validated_path = "results/validated_triplets.csv"
+from expression_matrix import open_expression_matrix
+from sponge import triplet_sensitivity
+from instrumentation import count, phase, run_stage
+from stage_cache import cached
+from stage_io import stage_paths
 
-    # Load predictions and normalized counts
-    predictions = pd.read_csv(predictions_path)
-    norm_counts = pd.read_csv(norm_counts_path, index_col=0)
+# Named stage files (Snakemake rule input/output names) with their standalone paths
+INPUTS = {
+    "triplets": "results/predicted_triplets.csv",
+    "counts": "results/norm_counts.npy",
+    "genes": "results/norm_counts.genes.txt",
+}
+OUTPUTS = {"validated": "results/validated_triplets.csv"}
+# Config keys that change the results (stage cache)
+CONFIG_KEYS = ["mediation_pval_cutoff", "mediation_bootstrap", "mediation_ci_level", "random_seed"]
 
-    if predictions.empty:
-        print("No predicted triplets. Saving empty validated file.")
-        pd.DataFrame(columns=predictions.columns.tolist() + ['mediation_pvalue', 'sensitivity']).to_csv(validated_path, index=False)
-        return
+# Upper bound on expression values gathered at once (triplets x samples x 3 rows)
+MEDIATION_BLOCK_VALUES = 30_000_000
 
-    validated = []
-    for _, row in predictions.iterrows():
-        lnc = row['lncRNA']
-        mir = row['miRNA']
-        mrna = row['mRNA']
+# Bootstrap columns written next to mediation_pvalue: a*b and its percentile and BCa interval
+MEDIATION_CI_COLUMNS = ['mediation_effect', 'mediation_ci_low', 'mediation_ci_high',
+                        'mediation_bca_low', 'mediation_bca_high']
 
-        if lnc in norm_counts.index and mir in norm_counts.index and mrna in norm_counts.index:
-            lnc_expr = norm_counts.loc[lnc].values
-            mir_expr = norm_counts.loc[mir].values
-            mrna_expr = norm_counts.loc[mrna].values
+def sobel_mediation(expr, lnc_idx, mir_idx, mrna_idx):
+    """
+    Vectorized Sobel test for lncRNA -> miRNA -> mRNA mediation over many triplets.
+    expr is a genes x samples array and the *_idx arrays pick one row per triplet.
+    Coefficients and standard errors are the closed-form OLS solutions of the two
+    models previously fitted with statsmodels:
+        miRNA ~ const + lncRNA             (a, se_a)
+        mRNA  ~ const + lncRNA + miRNA     (b, se_b)
+    Returns a dict of arrays: a, a_se, b, b_se, sobel_z, pvalue.
+    """
+    n_samples = expr.shape[1]
+    n_triplets = len(lnc_idx)
+    out = {k: np.empty(n_triplets) for k in ("a", "a_se", "b", "b_se", "sobel_z", "pvalue")}
+    block = max(1, MEDIATION_BLOCK_VALUES // (3 * n_samples))
 
-            # Mediation analysis (using OLS as example)
-            X = sm.add_constant(np.column_stack((lnc_expr, mir_expr)))
-            med_model = sm.OLS(mir_expr, sm.add_constant(lnc_expr)).fit()
-            out_model = sm.OLS(mrna_expr, X).fit()
+    for start in range(0, n_triplets, block):
+        sl = slice(start, start + block)
+        x = np.asarray(expr[lnc_idx[sl]], dtype=np.float64)
+        m = np.asarray(expr[mir_idx[sl]], dtype=np.float64)
+        y = np.asarray(expr[mrna_idx[sl]], dtype=np.float64)
+        x = x - x.mean(axis=1, keepdims=True)
+        m = m - m.mean(axis=1, keepdims=True)
+        y = y - y.mean(axis=1, keepdims=True)
 
-            # Use array indexing for params and bse (fixes numpy array issue)
-            a = med_model.params[1]
-            sa = med_model.bse[1]
-            b = out_model.params[2]
-            sb = out_model.bse[2]
+        # Centred sums of squares and cross-products per triplet
+        sxx = np.einsum('ij,ij->i', x, x)
+        smm = np.einsum('ij,ij->i', m, m)
+        syy = np.einsum('ij,ij->i', y, y)
+        sxm = np.einsum('ij,ij->i', x, m)
+        sxy = np.einsum('ij,ij->i', x, y)
+        smy = np.einsum('ij,ij->i', m, y)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Mediator model: miRNA ~ lncRNA
+            a = sxm / sxx
+            rss_a = smm - a * sxm
+            a_se = np.sqrt(rss_a / (n_samples - 2) / sxx)
+
+            # Outcome model: mRNA ~ lncRNA + miRNA
+            det = sxx * smm - sxm**2
+            b = (sxx * smy - sxm * sxy) / det
+            c = (smm * sxy - sxm * smy) / det
+            rss_b = syy - c * sxy - b * smy
+            b_se = np.sqrt(rss_b / (n_samples - 3) * sxx / det)
 
             # Mediation effect and p-value (Sobel test)
             mediation_effect = a * b
-            se_med = np.sqrt((a**2 * sb**2) + (b**2 * sa**2))
+            se_med = np.sqrt((a**2 * b_se**2) + (b**2 * a_se**2))
             z_med = mediation_effect / se_med
-            p_med = 2 * (1 - norm.cdf(abs(z_med)))  # Two-tailed p-value
+        p_med = 2 * (1 - norm.cdf(np.abs(z_med)))  # Two-tailed p-value
+
+        out["a"][sl] = a
+        out["a_se"][sl] = a_se
+        out["b"][sl] = b
+        out["b_se"][sl] = b_se
+        out["sobel_z"][sl] = z_med
+        out["pvalue"][sl] = p_med
+    return out
+
+def bootstrap_weights(n_samples, n_resamples, seed=42):
+    """
+    Draw the bootstrap resamples once, as an n_resamples x n_samples matrix of how often
+    each sample is drawn; every triplet is evaluated on the same resamples.
+    """
+    rng = np.random.default_rng(seed)
+    draws = rng.integers(0, n_samples, size=(n_resamples, n_samples))
+    offsets = np.arange(n_resamples)[:, None] * n_samples
+    counts = np.bincount((draws + offsets).ravel(), minlength=n_resamples * n_samples)
+    return counts.reshape(n_resamples, n_samples).astype(np.float64)
+
+def indirect_effect(n, sx, sm, sy, sxx, smm, sxm, sxy, smy):
+    """a*b from (weighted) sums: a from miRNA ~ lncRNA, b from mRNA ~ lncRNA + miRNA"""
+    cxx = sxx - sx * sx / n
+    cmm = smm - sm * sm / n
+    cxm = sxm - sx * sm / n
+    cxy = sxy - sx * sy / n
+    cmy = smy - sm * sy / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = cxm / cxx
+        b = (cxx * cmy - cxm * cxy) / (cxx * cmm - cxm**2)
+    return a * b
+
+def sorted_quantiles(sorted_values, levels):
+    """Per-row quantiles (linear interpolation) of row-sorted values at per-row levels"""
+    n = sorted_values.shape[1]
+    pos = np.clip(levels, 0, 1) * (n - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, n - 1)
+    frac = pos - lo
+    v_lo = np.take_along_axis(sorted_values, lo[:, None], axis=1)[:, 0]
+    v_hi = np.take_along_axis(sorted_values, hi[:, None], axis=1)[:, 0]
+    return v_lo + frac * (v_hi - v_lo)
+
+def bootstrap_mediation(expr, lnc_idx, mir_idx, mrna_idx, weights, level=0.95):
+    """
+    Bootstrap confidence intervals of the indirect effect a*b for many triplets.
+    weights (see bootstrap_weights) is shared by all triplets; for a block of triplets
+    the weighted sums of every resample are matrix products weights @ values, so no
+    resampled copies of the data are built. Returns a dict of arrays: effect, and the
+    percentile (ci_low, ci_high) and bias-corrected and accelerated (bca_low, bca_high)
+    interval bounds. BCa acceleration comes from the leave-one-out jackknife; BCa
+    bounds are NaN where the bias correction is undefined (every resample on one side
+    of the effect).
+    """
+    n_resamples, n_samples = weights.shape
+    n_triplets = len(lnc_idx)
+    out = {k: np.full(n_triplets, np.nan) for k in ("effect", "ci_low", "ci_high", "bca_low", "bca_high")}
+    alpha = (1 - level) / 2
+    z_alpha = norm.ppf([alpha, 1 - alpha])
+    # Per triplet: three rows and six products per sample, and per resample the eight
+    # weighted sums plus the temporaries of indirect_effect and sorting
+    block = max(1, MEDIATION_BLOCK_VALUES // (9 * n_samples + 24 * n_resamples))
+
+    for start in range(0, n_triplets, block):
+        sl = slice(start, start + block)
+        x = np.asarray(expr[lnc_idx[sl]], dtype=np.float64)
+        m = np.asarray(expr[mir_idx[sl]], dtype=np.float64)
+        y = np.asarray(expr[mrna_idx[sl]], dtype=np.float64)
+        # Centring leaves a*b unchanged and keeps the sums well conditioned
+        x = x - x.mean(axis=1, keepdims=True)
+        m = m - m.mean(axis=1, keepdims=True)
+        y = y - y.mean(axis=1, keepdims=True)
+        rows = (x, m, y, x * x, m * m, x * m, x * y, m * y)
+
+        effect = indirect_effect(n_samples, *(r.sum(axis=1) for r in rows))
+        boot = indirect_effect(n_samples, *(weights @ r.T for r in rows)).T  # triplets x resamples
+        boot.sort(axis=1)  # NaN (degenerate resamples) sort last
+        valid = np.isfinite(boot).all(axis=1) & np.isfinite(effect)
+
+        # Leave-one-out jackknife: each sum minus the left-out sample's term
+        totals = [r.sum(axis=1, keepdims=True) for r in rows]
+        jack = indirect_effect(n_samples - 1, *(t - r for t, r in zip(totals, rows)))
+        d = jack.mean(axis=1, keepdims=True) - jack
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Zero jackknife spread (no skew information) means no acceleration
+            accel = np.nan_to_num((d**3).sum(axis=1) / (6 * ((d**2).sum(axis=1)) ** 1.5))
+            below = (boot < effect[:, None]).mean(axis=1) + 0.5 * (boot == effect[:, None]).mean(axis=1)
+            z0 = norm.ppf(below)
+            bca_levels = [norm.cdf(z0 + (z0 + z) / (1 - accel * (z0 + z))) for z in z_alpha]
+        # All resamples on one side of the effect (infinite z0) leave BCa undefined;
+        # those bounds are NaN rather than a collapsed interval
+        bca_valid = valid & np.isfinite(z0) & np.isfinite(bca_levels[0]) & np.isfinite(bca_levels[1])
+
+        ci = [sorted_quantiles(boot, np.full(len(boot), p)) for p in (alpha, 1 - alpha)]
+        bca = [sorted_quantiles(boot, np.nan_to_num(p)) for p in bca_levels]
+        out["effect"][sl] = effect
+        for key, values in zip(("ci_low", "ci_high"), ci):
+            out[key][sl] = np.where(valid, values, np.nan)
+        for key, values in zip(("bca_low", "bca_high"), bca):
+            out[key][sl] = np.where(bca_valid, values, np.nan)
+    return out
+
+def configured_threads():
+    """Thread budget: the rule's threads under Snakemake, otherwise all available cores"""
+    try:
+        return int(snakemake.threads)
+    except NameError:
+        return os.cpu_count() or 1
+
+def main(threads=None):
+    cfg_path = "config/config.yaml"
+    if os.path.exists(cfg_path):
+        with open(cfg_path, "r") as f:
+            cfg = yaml.safe_load(f)
+    else:
+        cfg = {}
+    pval_cutoff = float(cfg.get("mediation_pval_cutoff", 0.05))
+    n_resamples = int(cfg.get("mediation_bootstrap", 1000))
+    if threads is None:
+        threads = configured_threads()
+
+    paths = stage_paths(INPUTS, OUTPUTS)
+    predictions_path = paths["triplets"]
+    norm_counts_prefix = os.path.splitext(paths["counts"])[0]
+    validated_path = paths["validated"]
+
+    # Load predictions and normalized counts
+    with phase("load"):
+        predictions = pd.read_csv(predictions_path)
+        norm_counts = open_expression_matrix(norm_counts_prefix)
+    count("input_rows", len(predictions))
+
+    if predictions.empty:
+        print("No predicted triplets. Saving empty validated file.")
+        bootstrap_columns = MEDIATION_CI_COLUMNS if n_resamples > 0 else []
+        pd.DataFrame(columns=predictions.columns.tolist() + ['mediation_pvalue'] + bootstrap_columns +
+                     ['sensitivity', 'sensitivity_pvalue']).to_csv(validated_path, index=False)
+        count("output_rows", 0)
+        return
+
+    # Resolve triplet members to expression rows; triplets with a missing gene are dropped
+    lnc_idx = norm_counts.index_of(predictions['lncRNA'])
+    mir_idx = norm_counts.index_of(predictions['miRNA'])
+    mrna_idx = norm_counts.index_of(predictions['mRNA'])
+    present = (lnc_idx >= 0) & (mir_idx >= 0) & (mrna_idx >= 0)
+
+    # Mediation analysis for all triplets at once
+    lnc_idx, mir_idx, mrna_idx = lnc_idx[present], mir_idx[present], mrna_idx[present]
+    with phase("mediation"):
+        mediation = sobel_mediation(norm_counts.values, lnc_idx, mir_idx, mrna_idx)
+
+    # Bootstrap intervals of the indirect effect; the Sobel normal approximation is
+    # poor at small sample sizes
+    if n_resamples > 0:
+        print(f"Bootstrapping mediation effects ({n_resamples} resamples)...")
+        with phase("bootstrap"), threadpool_limits(threads):
+            weights = bootstrap_weights(norm_counts.shape[1], n_resamples, int(cfg.get("random_seed", 42)))
+            intervals = bootstrap_mediation(norm_counts.values, lnc_idx, mir_idx, mrna_idx, weights,
+                                            float(cfg.get("mediation_ci_level", 0.95)))
 
-            # Sensitivity (placeholder; replace with actual if available)
-            sensitivity = np.random.rand()  # Example; adjust as needed
+    # SPONGE multiple sensitivity correlation, with p-values from cached null tables
+    with phase("sensitivity"):
+        sensitivity, sensitivity_pvalue = triplet_sensitivity(norm_counts.values, lnc_idx, mir_idx, mrna_idx,
+                                                              threads=threads)
 
-            validated_row = row.to_dict()
-            validated_row['mediation_pvalue'] = p_med
-            validated_row['sensitivity'] = sensitivity
-            validated.append(validated_row)
+    validated_df = predictions[present].reset_index(drop=True)
+    validated_df['mediation_pvalue'] = mediation['pvalue']
+    if n_resamples > 0:
+        for column, key in zip(MEDIATION_CI_COLUMNS, ("effect", "ci_low", "ci_high", "bca_low", "bca_high")):
+            validated_df[column] = intervals[key]
+    validated_df['sensitivity'] = sensitivity
+    validated_df['sensitivity_pvalue'] = sensitivity_pvalue
 
-    validated_df = pd.DataFrame(validated)
-    validated_df = validated_df[validated_df['mediation_pvalue'] < 0.05]  # Filter significant
-    validated_df.to_csv(validated_path, index=False)
+    validated_df = validated_df[validated_df['mediation_pvalue'] < pval_cutoff]  # Filter significant
+    with phase("writing"):
+        validated_df.to_csv(validated_path, index=False)
+    count("output_rows", len(validated_df))
     print(f"Validated {len(validated_df)} triplets saved to {validated_path}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_stage("statistical_validation", cached("statistical_validation", main, INPUTS, OUTPUTS,
+                                               CONFIG_KEYS, modules=["expression_matrix.py", "sponge.py"]))
\ No newline at end of file
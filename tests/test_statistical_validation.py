@@ -0,0 +1,44 @@
+# tests/test_statistical_validation.py
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "modules"))
+
+from statistical_validation import bootstrap_mediation, bootstrap_weights, indirect_effect
+
+def mediated_expression(n_samples=30, seed=0):
+    """lncRNA -> miRNA -> mRNA chain as a 3 x n_samples matrix (rows: lnc, mir, mrna)"""
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=n_samples)
+    m = 0.8 * x + rng.normal(scale=0.5, size=n_samples)
+    y = 0.7 * m + rng.normal(scale=0.5, size=n_samples)
+    return np.vstack([x, m, y])
+
+def resample_effects(expr, weights):
+    x, m, y = expr - expr.mean(axis=1, keepdims=True)
+    rows = (x, m, y, x * x, m * m, x * m, x * y, m * y)
+    return indirect_effect(expr.shape[1], *(weights @ r for r in rows))
+
+def test_bca_interval_brackets_effect():
+    expr = mediated_expression()
+    idx = np.array([0])
+    out = bootstrap_mediation(expr, idx, idx + 1, idx + 2, bootstrap_weights(expr.shape[1], 500, seed=1))
+    assert np.isfinite([out["bca_low"][0], out["bca_high"][0]]).all()
+    assert out["bca_low"][0] < out["effect"][0] < out["bca_high"][0]
+    assert out["ci_low"][0] < out["ci_high"][0]
+
+def test_one_sided_bootstrap_leaves_bca_undefined():
+    expr = mediated_expression()
+    idx = np.array([0])
+    candidates = bootstrap_weights(expr.shape[1], 2000, seed=1)
+    effect = bootstrap_mediation(expr, idx, idx + 1, idx + 2, candidates[:1])["effect"][0]
+    # Keep only resamples whose a*b falls below the full-sample effect
+    weights = candidates[resample_effects(expr, candidates) < effect][:200]
+    assert len(weights) == 200
+
+    out = bootstrap_mediation(expr, idx, idx + 1, idx + 2, weights)
+    assert np.isnan(out["bca_low"][0]) and np.isnan(out["bca_high"][0])
+    # The percentile interval is still reported, strictly below the effect
+    assert out["ci_low"][0] < out["ci_high"][0] < effect